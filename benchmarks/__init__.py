@@ -0,0 +1 @@
+"""Benchmarks for the compression engine; run each one with ``python -m benchmarks.<name>``."""
@@ -0,0 +1,102 @@
+"""Backends compared at equal SSIM: output bytes and encode time per codec.
+
+    python -m benchmarks.bench_backends [--ssim 0.95] [--codecs jpeg webp]
+
+For every installed backend and codec, the lowest quality whose output
+reaches ``--ssim`` against the source is found by bisection; the table shows
+that quality, the output bytes (and their change against Pillow) and the
+median time of one encode. The last table is the whole pipeline per backend
+(resize, quality search and encode to the default budget), timed with
+``engine.compress_to_bytes``. Backends that are not installed are listed and
+skipped.
+"""
+import argparse
+import io
+import statistics
+import time
+
+from PIL import Image
+
+from benchmarks.corpus import photo_like
+from benchmarks.quality import ssim
+from compressor import backends, codecs, engine
+
+REPEATS = 3
+
+
+def quality_for_ssim(codec, image, target):
+    # Lowest quality in 1-100 whose encode reaches ``target``, with its buffer; None if 100 does not
+    low, high, best = 1, 100, None
+    while low <= high:
+        quality = (low + high) // 2
+        buffer = codec.encode(image, quality)
+        with Image.open(io.BytesIO(buffer.getvalue())) as decoded:
+            score = ssim(image, decoded)
+        if score >= target:
+            best = (quality, buffer, score)
+            high = quality - 1
+        else:
+            low = quality + 1
+    return best
+
+
+def encode_seconds(codec, image, quality):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        codec.encode(image, quality)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ssim", type=float, default=0.95, help="SSIM every output must reach")
+    parser.add_argument("--codecs", nargs="+", default=["jpeg", "webp", "avif"], choices=["jpeg", "webp", "avif"])
+    parser.add_argument("--budget", type=int, default=engine.DEFAULT_MAX_SIZE)
+    args = parser.parse_args(argv)
+
+    installed = [name for name in backends.available_backends() if name != "auto"]
+    missing = [name for name in backends.BACKENDS if name not in installed]
+    print(f"backends: {', '.join(installed)}" + (f" (not installed: {', '.join(missing)})" if missing else ""))
+    cases = [
+        ("photo", photo_like(2400, 1600, 3)),
+        ("detailed photo", photo_like(2400, 1600, 5, cell=8, grain=24)),
+    ]
+    # Every backend encodes the same pixels: the sources resized once, by Pillow
+    resized = {name: engine.resize_to_fit(image, engine.DEFAULT_MAX_DIM, backend="pillow") for name, image in cases}
+    names = [name for name in args.codecs if codecs.CODECS[name].available()]
+
+    print(f"\nat SSIM >= {args.ssim}")
+    print(f"{'case':<15} {'codec':<5} {'backend':<11} {'quality':>7} {'bytes':>8} {'vs pillow':>9} {'encode ms':>9}")
+    for case, image in resized.items():
+        for name in names:
+            baseline = None
+            for backend_name in installed:
+                codec = backends.BACKENDS[backend_name].bind(codecs.CODECS[name])
+                prepared = codec.prepare(image)
+                found = quality_for_ssim(codec, prepared, args.ssim)
+                if found is None:
+                    print(f"{case:<15} {name:<5} {backend_name:<11} {'-':>7} {'misses':>8}")
+                    continue
+                quality, buffer, score = found
+                size = buffer.tell()
+                baseline = baseline or size
+                print(f"{case:<15} {name:<5} {backend_name:<11} {quality:>7} {size:>8} "
+                      f"{(size / baseline - 1) * 100:>+8.1f}% {encode_seconds(codec, prepared, quality) * 1000:>9.1f}")
+
+    print(f"\nwhole pipeline from 2400x1600 to {args.budget} bytes (JPEG)")
+    print(f"{'case':<15} {'backend':<11} {'seconds':>8} {'encodes':>8} {'bytes':>8} {'quality':>7} {'ssim':>7}")
+    for case, source in cases:
+        for backend_name in installed:
+            start = time.perf_counter()
+            result, data = engine.compress_to_bytes(source.copy(), args.budget, backend=backend_name)
+            elapsed = time.perf_counter() - start
+            with Image.open(io.BytesIO(data)) as decoded:
+                score = ssim(resized[case], decoded)
+            print(f"{case:<15} {backend_name:<11} {elapsed:>8.2f} {result.encodes:>8} {result.size:>8} "
+                  f"{result.quality:>7} {score:>7.4f}")
+
+
+if __name__ == "__main__":
+    main()
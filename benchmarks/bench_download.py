@@ -0,0 +1,62 @@
+"""Serial vs pooled downloads against a local HTTP server with simulated latency.
+
+    python -m benchmarks.bench_download [--images 48] [--latency 0.05]
+
+Every fourth URL goes through the server's ``/flaky/`` path, so the pooled
+run also exercises retry with backoff.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.corpus import write_photo_corpus
+from benchmarks.http_stub import StubServer
+from compressor import engine, parallel
+from compressor.fetch import Downloader
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=48)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--per-host", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench_download_")
+    try:
+        paths = write_photo_corpus(os.path.join(workdir, "corpus"), args.images, size=(800, 600))
+        with StubServer(os.path.join(workdir, "corpus"), args.latency) as server:
+            urls = [server.url_for(path) for path in paths]
+            flaky = [url.replace(server.base_url, server.base_url + "/flaky") if i % 4 == 0 else url
+                     for i, url in enumerate(urls)]
+
+            start = time.perf_counter()
+            for url in urls:
+                engine.fetch_image_bytes(url)
+            serial = time.perf_counter() - start
+            print(f"serial fetch:             {serial:6.2f}s  {len(urls) / serial:7.1f} urls/s")
+
+            with Downloader(args.concurrency, args.per_host, backoff=0.05) as downloader:
+                start = time.perf_counter()
+                failed = sum(1 for url, outcome in downloader.iter_fetch(flaky) if isinstance(outcome, Exception))
+                pooled = time.perf_counter() - start
+            print(f"pooled fetch (retries):   {pooled:6.2f}s  {len(urls) / pooled:7.1f} urls/s  "
+                  f"{serial / pooled:.1f}x  ({failed} failed)")
+
+            server.failed_once.clear()
+            with Downloader(args.concurrency, args.per_host, backoff=0.05) as downloader:
+                jobs = ((outcome, "") for url, outcome in downloader.iter_fetch(flaky))
+                start = time.perf_counter()
+                items = parallel.compress_jobs(jobs, os.path.join(workdir, "out"), workers=1)
+                elapsed = time.perf_counter() - start
+            ok = sum(1 for item in items if item.ok)
+            print(f"pipelined fetch+compress: {elapsed:6.2f}s  {ok}/{len(items)} compressed")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Output codecs at a fixed byte budget: keep (JPEG/PNG) vs WebP, AVIF and auto.
+
+    python -m benchmarks.bench_formats [--budget 100352]
+
+Every case is compressed once per output format; the table shows encode time,
+encodes, output bytes and SSIM against the source scaled to the output size
+(colour over white for transparent images). Formats this Pillow build cannot
+write are skipped.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from PIL import Image
+
+from benchmarks.corpus import icon_like, photo_like, screenshot_like, transparent_photo
+from benchmarks.quality import ssim
+from compressor import codecs, engine
+
+FORMATS = ("keep", "webp", "avif", "auto")
+
+
+def flattened(image):
+    image = image.convert('RGBA')
+    return Image.alpha_composite(Image.new('RGBA', image.size, (255, 255, 255, 255)), image).convert('RGB')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=int, default=engine.DEFAULT_MAX_SIZE)
+    args = parser.parse_args(argv)
+
+    cases = [
+        ("photo 3000x2000", photo_like(3000, 2000, 3), 'JPEG'),
+        ("detailed photo", photo_like(1920, 1280, 5, cell=8, grain=24), 'JPEG'),
+        ("screenshot", screenshot_like(1920, 1080, 1), 'PNG'),
+        ("transparent", transparent_photo(1200, 1200, 4), 'PNG'),
+        ("icon 64x64", icon_like(64, 6), 'PNG'),
+    ]
+    formats = [name for name in FORMATS if name in codecs.available_formats()]
+    workdir = tempfile.mkdtemp(prefix="bench_formats_")
+    try:
+        print(f"{'case':<16} {'format':<7} {'seconds':>8} {'encodes':>8} {'bytes':>8} {'ssim':>7}  codec")
+        for name, image, source_format in cases:
+            for output_format in formats:
+                source = image.copy()
+                source.format = source_format
+                path = os.path.join(workdir, f"{len(os.listdir(workdir))}{engine.output_extension(source_format)}")
+                start = time.perf_counter()
+                try:
+                    result = engine.compress_image(source, path, args.budget, output_format=output_format)
+                except IOError:
+                    print(f"{name:<16} {output_format:<7} {'-':>8} {'-':>8} {'misses':>8}")
+                    continue
+                elapsed = time.perf_counter() - start
+                with Image.open(result.path) as output:
+                    reference = flattened(image).resize(output.size, Image.LANCZOS)
+                    score = ssim(reference, flattened(output))
+                codec = result.settings.get("codec", os.path.splitext(result.path)[1][1:])
+                print(f"{name:<16} {output_format:<7} {elapsed:>8.2f} {result.encodes:>8} {result.size:>8} "
+                      f"{score:>7.4f}  {codec}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
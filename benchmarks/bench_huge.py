@@ -0,0 +1,84 @@
+"""Peak RSS and time to downscale huge images: whole decode vs strips.
+
+    python -m benchmarks.bench_huge [--size 12000x9000] [--formats png bmp jpeg]
+
+Each run is a fresh subprocess that opens one source and calls
+``engine.decode_and_resize``, so its peak RSS is the decode and resize alone.
+"whole" sets ``large_pixels`` above the source so it is decoded in one piece
+(the path every image took before); "strips" sets it to 0 so even a small
+``--size`` takes the strip path. The last columns compare the two downscaled
+images: largest and mean difference per channel, out of 255.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.corpus import photo_like
+
+CHILD = """
+import sys, time
+from compressor import engine
+path, output, large_pixels, max_dim = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+start = time.perf_counter()
+image, saved_format = engine.decode_and_resize(engine.load_local_image(path), max_dim,
+                                               large_pixels=large_pixels)
+elapsed = time.perf_counter() - start
+image.save(output)
+# VmHWM rather than ru_maxrss: the latter keeps the parent's high-water mark across exec
+with open("/proc/self/status") as f:
+    print(elapsed, next(int(line.split()[1]) for line in f if line.startswith("VmHWM:")))
+"""
+
+EXTENSIONS = {'png': '.png', 'bmp': '.bmp', 'jpeg': '.jpg'}
+
+
+def write_huge(path, width, height):
+    # Photo-like content without building a full-size noise field first
+    photo_like(width // 8, height // 8, 0).resize((width, height), Image.BICUBIC).save(path)
+
+
+def run(path, output, large_pixels, max_dim):
+    result = subprocess.run([sys.executable, "-c", CHILD, path, output, str(large_pixels), str(max_dim)],
+                            check=True, capture_output=True, text=True)
+    elapsed, peak = result.stdout.split()
+    return float(elapsed), int(peak) / 1024  # KiB
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="12000x9000", help="WIDTHxHEIGHT of the sources")
+    parser.add_argument("--formats", nargs="+", choices=sorted(EXTENSIONS), default=["png", "bmp", "jpeg"])
+    parser.add_argument("--max-dim", type=int, default=1920)
+    args = parser.parse_args(argv)
+    if not os.path.exists("/proc/self/status"):
+        parser.error("peak RSS is read from /proc; run this on Linux")
+    width, height = (int(value) for value in args.size.split("x"))
+
+    workdir = tempfile.mkdtemp(prefix="bench_huge_")
+    try:
+        print(f"{width}x{height} ({width * height / 1e6:.0f} MP) to {args.max_dim}px")
+        print(f"{'format':>6} {'whole MB':>9} {'whole s':>8} {'strips MB':>10} {'strips s':>9} "
+              f"{'max diff':>9} {'mean diff':>10}")
+        for name in args.formats:
+            source = os.path.join(workdir, "huge" + EXTENSIONS[name])
+            write_huge(source, width, height)
+            outputs = [os.path.join(workdir, f"{name}_{mode}.png") for mode in ("whole", "strips")]
+            whole = run(source, outputs[0], width * height + 1, args.max_dim)
+            strips = run(source, outputs[1], 0, args.max_dim)
+            a, b = (np.asarray(Image.open(output), dtype=np.int16) for output in outputs)
+            difference = np.abs(a - b)
+            print(f"{name:>6} {whole[1]:>9.0f} {whole[0]:>8.2f} {strips[1]:>10.0f} {strips[0]:>9.2f} "
+                  f"{difference.max():>9} {difference.mean():>10.3f}")
+            os.remove(source)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Peak RSS against batch size: eager image lists vs the streaming job pipeline.
+
+    python -m benchmarks.bench_memory [--sizes 10 40 160]
+
+Each measurement runs in a fresh subprocess so its peak RSS is not inflated by
+earlier runs. "eager" opens every image up front and hands the list to
+``engine.process_images`` (the old GUI behaviour); "streaming" feeds file paths
+through ``parallel.iter_compress_jobs``.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.corpus import write_photo_corpus
+
+CHILD = """
+import os, resource, sys
+from compressor import engine, parallel
+mode, output, paths = sys.argv[1], sys.argv[2], sys.argv[3:]
+names = [os.path.splitext(os.path.basename(p))[0] for p in paths]
+if mode == "eager":
+    images = [engine.load_local_image(p) for p in paths]
+    engine.process_images(images, names, output)
+else:
+    for item in parallel.iter_compress_jobs(list(zip(paths, names)), output, workers=1):
+        pass
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def peak_rss_mb(mode, output, paths):
+    result = subprocess.run([sys.executable, "-c", CHILD, mode, output] + paths,
+                            check=True, capture_output=True, text=True)
+    return int(result.stdout.strip().splitlines()[-1]) / 1024  # ru_maxrss is in KiB on Linux
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 40, 160])
+    parser.add_argument("--distinct", type=int, default=10,
+                        help="distinct corpus files; larger batches reuse them")
+    args = parser.parse_args(argv)
+    if sys.platform == "darwin":
+        parser.error("ru_maxrss units differ on macOS; run this on Linux")
+
+    workdir = tempfile.mkdtemp(prefix="bench_memory_")
+    try:
+        corpus = write_photo_corpus(os.path.join(workdir, "corpus"), args.distinct, size=(2400, 1600))
+        print(f"{'batch':>6} {'eager MB':>9} {'streaming MB':>13}")
+        for size in args.sizes:
+            paths = [corpus[i % len(corpus)] for i in range(size)]
+            row = []
+            for mode in ("eager", "streaming"):
+                output = os.path.join(workdir, f"out_{mode}_{size}")
+                row.append(peak_rss_mb(mode, output, paths))
+            print(f"{size:>6} {row[0]:>9.0f} {row[1]:>13.0f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Scaling curve of process-pool compression from 1 to N workers on a fixed corpus.
+
+    python -m benchmarks.bench_parallel [--images 24] [--max-workers 8]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.corpus import write_photo_corpus
+from compressor import parallel
+
+
+def worker_counts(max_workers):
+    counts, n = [], 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=24)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--executor", choices=("process", "thread"), default="process")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench_parallel_")
+    try:
+        paths = write_photo_corpus(os.path.join(workdir, "corpus"), args.images)
+        jobs = [(path, os.path.splitext(os.path.basename(path))[0]) for path in paths]
+
+        print(f"{'workers':>7} {'seconds':>8} {'images/s':>9} {'speedup':>8}")
+        baseline = None
+        for workers in worker_counts(args.max_workers):
+            output = os.path.join(workdir, f"out_{workers}")
+            start = time.perf_counter()
+            items = parallel.compress_jobs(jobs, output, workers=workers, executor=args.executor)
+            elapsed = time.perf_counter() - start
+            failed = sum(1 for item in items if not item.ok)
+            baseline = baseline or elapsed
+            print(f"{workers:>7} {elapsed:>8.2f} {len(jobs) / elapsed:>9.2f} {baseline / elapsed:>7.2f}x"
+                  + (f"  ({failed} failed)" if failed else ""))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
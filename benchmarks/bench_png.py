@@ -0,0 +1,68 @@
+"""PNG budget search: the original optimize/halving loop vs png.search_png.
+
+    python -m benchmarks.bench_png [--budget 100352]
+
+The legacy strategy is reproduced here as it was in compress_image: optimize
+encodes of the full image, then of a 128-colour ADAPTIVE palette, then of
+LANCZOS-halved copies until one fits.
+"""
+import argparse
+import io
+import time
+
+from PIL import Image
+
+from benchmarks.corpus import photo_like, screenshot_like, transparent_photo
+from compressor import engine, png
+
+
+def legacy_png(image, max_size):
+    encodes = 1
+    buffer = engine.encode_to_buffer(image, 'PNG')
+    if buffer.tell() <= max_size:
+        return buffer, encodes
+    palette_image = image.convert('P', palette=Image.ADAPTIVE, colors=128)
+    factor = 1
+    while True:
+        width, height = int(palette_image.width / factor), int(palette_image.height / factor)
+        if width < 1 or height < 1:
+            return None, encodes
+        resized = palette_image if factor == 1 else palette_image.resize((width, height), Image.LANCZOS)
+        buffer = io.BytesIO()
+        resized.save(buffer, format='PNG', optimize=True)
+        encodes += 1
+        if buffer.tell() <= max_size:
+            return buffer, encodes
+        factor *= 2
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=int, default=engine.DEFAULT_MAX_SIZE)
+    args = parser.parse_args(argv)
+
+    cases = [
+        ("screenshot 1920x1080", screenshot_like(1920, 1080, 1)),
+        ("screenshot 1280x800", screenshot_like(1280, 800, 2)),
+        ("photo 1600x1200", photo_like(1600, 1200, 3)),
+        ("transparent 1200x1200", transparent_photo(1200, 1200, 4)),
+    ]
+    print(f"{'case':<22} {'strategy':<8} {'seconds':>8} {'encodes':>8} {'bytes':>8} {'pixels kept':>12}  settings")
+    for name, image in cases:
+        start = time.perf_counter()
+        buffer, encodes = legacy_png(image, args.budget)
+        elapsed = time.perf_counter() - start
+        kept = Image.open(buffer).size if buffer else (0, 0)
+        print(f"{name:<22} {'legacy':<8} {elapsed:>8.2f} {encodes:>8} {len(buffer.getvalue()) if buffer else '-':>8} "
+              f"{kept[0] * kept[1] / (image.width * image.height):>11.0%}")
+
+        start = time.perf_counter()
+        buffer, encodes, settings = png.search_png(image, args.budget)
+        elapsed = time.perf_counter() - start
+        kept = Image.open(buffer).size if buffer else (0, 0)
+        print(f"{'':<22} {'search':<8} {elapsed:>8.2f} {encodes:>8} {len(buffer.getvalue()) if buffer else '-':>8} "
+              f"{kept[0] * kept[1] / (image.width * image.height):>11.0%}  {settings}")
+
+
+if __name__ == "__main__":
+    main()
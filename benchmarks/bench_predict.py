@@ -0,0 +1,71 @@
+"""Average full-size encodes per image: bisection vs the predictive quality search.
+
+    python -m benchmarks.bench_predict [--train 24] [--test 24]
+
+The predictive search is measured twice: with the uncalibrated prior and after
+calibrating a model on a separate training set. Quality loss is the mean
+number of quality points below the bisection result (which is optimal).
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.corpus import varied_photos
+from compressor import engine
+from compressor.predict import QualityModel
+
+BUDGETS = (40 * 1024, engine.DEFAULT_MAX_SIZE, 200 * 1024)
+
+
+def run(images, workdir, search, model=None, calibrate=False):
+    encodes, qualities, elapsed = [], [], 0.0
+    for index, image in enumerate(images):
+        for budget in BUDGETS:
+            path = os.path.join(workdir, f"{search}_{index}_{budget}.jpg")
+            start = time.perf_counter()
+            try:
+                result = engine.compress_image(image, path, budget, search=search, model=model)
+            except IOError:
+                continue  # Budget unreachable even at quality 1; every search agrees on that
+            finally:
+                elapsed += time.perf_counter() - start
+            if calibrate:
+                model.observe(result.samples)
+            encodes.append(result.encodes)
+            qualities.append(result.quality)
+    return encodes, qualities, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--train", type=int, default=24)
+    parser.add_argument("--test", type=int, default=24)
+    args = parser.parse_args(argv)
+
+    train = varied_photos(args.train, seed=7)
+    test = varied_photos(args.test, seed=1007)
+    for image in train + test:
+        image.format = 'JPEG'  # compress as a JPEG source
+
+    workdir = tempfile.mkdtemp(prefix="bench_predict_")
+    try:
+        base_encodes, base_quality, base_time = run(test, workdir, "bisect")
+        rows = [("bisect", base_encodes, base_quality, base_time)]
+        rows.append(("predict (prior)",) + run(test, workdir, "predict", QualityModel()))
+        model = QualityModel()
+        run(train, workdir, "predict", model, calibrate=True)
+        rows.append((f"predict ({model.samples} samples)",) + run(test, workdir, "predict", model))
+
+        print(f"{'search':<24} {'encodes/img':>11} {'<=2 encodes':>12} {'quality loss':>13} {'seconds':>8}")
+        for name, encodes, qualities, elapsed in rows:
+            within_two = sum(1 for e in encodes if e <= 2) / len(encodes)
+            loss = sum(b - q for b, q in zip(base_quality, qualities)) / len(qualities)
+            print(f"{name:<24} {sum(encodes) / len(encodes):>11.2f} {within_two:>11.0%} {loss:>13.2f} {elapsed:>8.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
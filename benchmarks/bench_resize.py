@@ -0,0 +1,57 @@
+"""Decode+resize time and SSIM for the exact and fast pre-resize paths.
+
+    python -m benchmarks.bench_resize [--images 4] [--size 6000 4000]
+
+SSIM compares each path's resized image against the exact path's output,
+so the exact column is 1.0 by definition.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from PIL import Image
+
+from benchmarks.corpus import write_photo_corpus
+from benchmarks.quality import ssim
+from compressor import engine
+
+
+def decode_and_resize(path, resize):
+    start = time.perf_counter()
+    with Image.open(path) as image:
+        resized = engine.resize_to_fit(image, engine.DEFAULT_MAX_DIM, resize)
+        resized.load()
+    return resized, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--size", type=int, nargs=2, default=(6000, 4000), metavar=("W", "H"))
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench_resize_")
+    try:
+        paths = write_photo_corpus(os.path.join(workdir, "corpus"), args.images, size=tuple(args.size))
+        totals = {"exact": 0.0, "fast": 0.0}
+        scores = []
+        for path in paths:
+            reference, elapsed = decode_and_resize(path, "exact")
+            totals["exact"] += elapsed
+            fast, elapsed = decode_and_resize(path, "fast")
+            totals["fast"] += elapsed
+            scores.append(ssim(reference, fast))
+
+        count = len(paths)
+        print(f"{'path':>6} {'ms/image':>9} {'SSIM vs exact':>14}")
+        print(f"{'exact':>6} {totals['exact'] / count * 1000:>9.0f} {1.0:>14.4f}")
+        print(f"{'fast':>6} {totals['fast'] / count * 1000:>9.0f} {sum(scores) / count:>14.4f}")
+        print(f"speedup: {totals['exact'] / totals['fast']:.1f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
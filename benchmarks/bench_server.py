@@ -0,0 +1,112 @@
+"""Load test for the HTTP service: throughput and latency by client concurrency.
+
+    python -m benchmarks.bench_server [--levels 1,2,4,8,16] [--requests 48]
+    python -m benchmarks.bench_server --url http://127.0.0.1:8080
+
+Without ``--url`` a CompressionServer is started in this process on a free
+port. Each level runs ``--requests`` uploads from that many client threads,
+each on its own keep-alive connection, cycling through a small corpus of
+photo-like JPEGs. Requests answered 429 are counted and not retried, so the
+columns show where the service starts shedding load.
+"""
+import argparse
+import http.client
+import io
+import itertools
+import threading
+import time
+from urllib.parse import urlsplit
+
+from benchmarks.corpus import photo_like
+from compressor import metrics, parallel, server
+
+
+def upload(connection, path, body):
+    connection.request("POST", path, body=body, headers={"Content-Type": "image/jpeg"})
+    response = connection.getresponse()
+    response.read()
+    if response.getheader("Connection", "").lower() == "close":
+        connection.close()  # http.client reconnects on the next request
+    return response.status
+
+
+def run_level(url, bodies, concurrency, requests, path):
+    counter = itertools.count()
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+
+    def client():
+        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=120)
+        try:
+            while True:
+                index = next(counter)
+                if index >= requests:
+                    return
+                start = time.perf_counter()
+                status = upload(connection, path, bodies[index % len(bodies)])
+                elapsed = time.perf_counter() - start
+                with lock:
+                    statuses[status] = statuses.get(status, 0) + 1
+                    if status == 200:
+                        latencies.append(elapsed)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, sorted(latencies), statuses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="test a running service instead of starting one")
+    parser.add_argument("--levels", default="1,2,4,8,16", help="comma-separated client counts")
+    parser.add_argument("--requests", type=int, default=48, help="requests per level")
+    parser.add_argument("--size", default="1600x1200", help="WIDTHxHEIGHT of the uploaded photos")
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--max-size", type=int, default=60000)
+    parser.add_argument("--workers", type=int, default=parallel.default_workers())
+    parser.add_argument("--queue-size", type=int, default=server.DEFAULT_QUEUE_SIZE)
+    args = parser.parse_args(argv)
+    width, height = (int(value) for value in args.size.split("x"))
+
+    bodies = []
+    for seed in range(args.images):
+        buffer = io.BytesIO()
+        photo_like(width, height, seed).save(buffer, format="JPEG", quality=92)
+        bodies.append(buffer.getvalue())
+
+    service = None
+    if args.url:
+        url = urlsplit(args.url)
+    else:
+        service = server.CompressionServer(("127.0.0.1", 0), workers=args.workers, queue_size=args.queue_size)
+        threading.Thread(target=service.serve_forever, daemon=True).start()
+        url = urlsplit(service.url)
+        print(f"service with {service.workers} worker(s), capacity {service.capacity}")
+    try:
+        path = f"/compress?max_size={args.max_size}"
+        run_level(url, bodies, 1, 2, path)  # Connection setup and first-request costs
+        print(f"{args.requests} uploads of {width}x{height} per level, budget {args.max_size} bytes")
+        print(f"{'clients':>7} {'req/s':>7} {'p50 ms':>8} {'p99 ms':>8} {'ok':>5} {'429':>5} {'other':>5}")
+        for concurrency in (int(level) for level in args.levels.split(",")):
+            elapsed, latencies, statuses = run_level(url, bodies, concurrency, args.requests, path)
+            ok = statuses.get(200, 0)
+            refused = statuses.get(429, 0)
+            other = sum(statuses.values()) - ok - refused
+            p50 = metrics.percentile(latencies, 0.5)
+            p99 = metrics.percentile(latencies, 0.99)
+            print(f"{concurrency:>7} {ok / elapsed:>7.2f} {p50 * 1000 if p50 else 0:>8.1f} "
+                  f"{p99 * 1000 if p99 else 0:>8.1f} {ok:>5} {refused:>5} {other:>5}")
+    finally:
+        if service is not None:
+            service.shutdown()
+            service.server_close()
+
+
+if __name__ == "__main__":
+    main()
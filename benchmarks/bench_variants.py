@@ -0,0 +1,78 @@
+"""Responsive variants: one compress_image run per width vs compress_variants.
+
+    python -m benchmarks.bench_variants [--images 8]
+
+"separate" decodes and resizes the source again for every width, as running
+the tool once per width did. "variants" decodes once, resizes each width from
+the previous one and encodes the variants on threads. SSIM compares both sets
+of outputs with a direct LANCZOS resize of the source; the difference between
+the columns is the cost of resizing in a chain.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from PIL import Image
+
+from benchmarks.corpus import write_photo_corpus
+from benchmarks.quality import ssim
+from compressor import engine
+
+VARIANTS = [engine.Variant(1920, 200 * 1024), engine.Variant(1280, 100 * 1024),
+            engine.Variant(640, 40 * 1024), engine.Variant(320, 15 * 1024)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench_variants_")
+    try:
+        paths = write_photo_corpus(os.path.join(workdir, "corpus"), args.images)
+
+        start = time.perf_counter()
+        for index, path in enumerate(paths):
+            for variant in VARIANTS:
+                image = engine.load_local_image(path)
+                engine.compress_image(image, os.path.join(workdir, f"separate_{index}_{variant.max_dim}.jpg"),
+                                      variant.max_size, variant.max_dim)
+                image.close()
+        separate = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for index, path in enumerate(paths):
+            image = engine.load_local_image(path)
+            outputs = [os.path.join(workdir, f"variants_{index}_{variant.max_dim}.jpg") for variant in VARIANTS]
+            engine.compress_variants(image, outputs, VARIANTS, workers=args.threads)
+            image.close()
+        chained = time.perf_counter() - start
+
+        scores = {(mode, variant.max_dim): [] for mode in ("separate", "variants") for variant in VARIANTS}
+        for index, path in enumerate(paths):
+            with Image.open(path) as source:
+                source.load()
+                for mode in ("separate", "variants"):
+                    for variant in VARIANTS:
+                        output = os.path.join(workdir, f"{mode}_{index}_{variant.max_dim}.jpg")
+                        with Image.open(output) as candidate:
+                            reference = source.resize(candidate.size, Image.LANCZOS)
+                            scores[mode, variant.max_dim].append(ssim(reference, candidate))
+
+        print(f"{len(paths)} images x {len(VARIANTS)} widths, {args.threads} encode thread(s)")
+        print(f"separate runs:     {separate:6.2f}s")
+        print(f"compress_variants: {chained:6.2f}s  ({separate / chained:.1f}x)")
+        print(f"{'width':>7} {'SSIM separate':>14} {'SSIM variants':>14}")
+        for variant in VARIANTS:
+            print(f"{variant.max_dim:>6}w {statistics.fmean(scores['separate', variant.max_dim]):>14.4f} "
+                  f"{statistics.fmean(scores['variants', variant.max_dim]):>14.4f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Watch mode: seconds from a file landing in the hot folder to its output.
+
+    python -m benchmarks.bench_watch [--files 20] [--interval 0.5] [--poll]
+
+Photos are uploaded the way most upload tools do it, written under a hidden
+name and renamed into place, every ``--interval`` seconds. The table shows
+lag percentiles and the deepest the queue got; when files arrive faster than
+the workers compress them the queue grows and the lag with it.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from benchmarks.corpus import photo_like
+from compressor import metrics, parallel
+from compressor.watch import FolderWatcher
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between arrivals")
+    parser.add_argument("--size", default="2000x1500", help="WIDTHxHEIGHT of the uploaded photos")
+    parser.add_argument("--workers", type=int, default=parallel.default_workers())
+    parser.add_argument("--poll", action="store_true", help="rescan instead of using inotify")
+    args = parser.parse_args(argv)
+    width, height = (int(value) for value in args.size.split("x"))
+
+    workdir = tempfile.mkdtemp(prefix="bench_watch_")
+    try:
+        sources = []
+        for index in range(args.files):
+            path = os.path.join(workdir, f"source_{index}.jpg")
+            photo_like(width, height, index).save(path, quality=92)
+            sources.append(path)
+        hot = os.path.join(workdir, "hot")
+        os.makedirs(hot)
+
+        lags = []
+        depth = [0]
+        finished = threading.Event()
+
+        def progress(item, lag):
+            lags.append(lag)
+            if len(lags) == args.files:
+                finished.set()
+
+        watcher = FolderWatcher(hot, os.path.join(workdir, "out"), workers=args.workers, poll=args.poll,
+                                progress=progress)
+        thread = threading.Thread(target=watcher.run)
+        thread.start()
+        time.sleep(0.5)  # Let the watch start before the first upload
+        try:
+            for index, path in enumerate(sources):
+                partial = os.path.join(hot, f".upload_{index}")
+                shutil.copyfile(path, partial)
+                os.replace(partial, os.path.join(hot, f"photo_{index}.jpg"))
+                deadline = time.monotonic() + args.interval
+                while time.monotonic() < deadline:
+                    stats = watcher.stats()
+                    depth[0] = max(depth[0], stats["queue_depth"] + stats["in_flight"])
+                    time.sleep(0.01)
+            finished.wait(60)
+        finally:
+            watcher.stop()
+            thread.join()
+
+        lags.sort()
+        print(f"{args.files} files of {width}x{height}, one every {args.interval}s, {args.workers} worker(s), "
+              f"{'polling' if args.poll else 'inotify'}")
+        print(f"lag p50 {metrics.percentile(lags, 0.5):.3f}s  p95 {metrics.percentile(lags, 0.95):.3f}s  "
+              f"max {lags[-1]:.3f}s  queued+in flight at most {depth[0]}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
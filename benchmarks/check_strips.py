@@ -0,0 +1,113 @@
+"""Strip downscaling against the in-memory resize, per source format and mode.
+
+    python -m benchmarks.check_strips [--size 3000x2000] [--max-dim 640]
+
+Every case is encoded, opened the way a job opens it and downscaled twice
+with ``engine.decode_and_resize``: once with ``large_pixels`` above the
+source, which decodes it whole and goes through ``resize_to_fit``, and once
+with ``large_pixels=0`` and a small STRIP_BYTES, so the strip path reads it
+in many strips. Sources with alpha are compared as they show over black.
+Opaque sources must come out identical. With alpha, Pillow's in-memory
+resize skips the box reduce the strips do (see ``strips``), which moves
+pixels along alpha edges: the largest difference per channel (out of 255)
+may be up to ALPHA_MAX_DIFF and the mean up to ALPHA_MEAN_DIFF. "whole"
+marks sources the strip reader sends to the whole decode. Exits 1 if any
+case is over its tolerance.
+"""
+import argparse
+import io
+import sys
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.corpus import photo_like, transparent_photo
+from compressor import codecs, engine, png, strips
+
+ALPHA_MAX_DIFF = 12  # 8-10 measured on transparent_photo at 3000x2000 and 4000x3000
+ALPHA_MEAN_DIFF = 0.5  # 0.1-0.2 measured
+STRIP_BYTES = 256 * 1024
+
+
+def palette_with_key(image):
+    # A palette image with index 0 as its tRNS transparency key over part of the picture
+    palette = image.convert('RGB').quantize(255)
+    pixels = np.asarray(palette).copy() + 1
+    height, width = pixels.shape
+    pixels[height // 4:height // 2, width // 3:] = 0
+    keyed = Image.fromarray(pixels.astype(np.uint8), 'P')
+    keyed.putpalette([0, 0, 0] + palette.getpalette()[:255 * 3])
+    keyed.info['transparency'] = 0
+    return keyed
+
+
+def cases(width, height):
+    photo = photo_like(width, height, 7)
+    alpha = transparent_photo(width, height, 7)
+    return [
+        ("png RGB", photo, 'PNG'),
+        ("png L", photo.convert('L'), 'PNG'),
+        ("png LA", alpha.convert('LA'), 'PNG'),
+        ("png RGBA", alpha, 'PNG'),
+        ("png P", photo.quantize(256), 'PNG'),
+        ("png P tRNS", palette_with_key(photo), 'PNG'),
+        ("bmp RGB", photo, 'BMP'),
+        ("tga RGBA", alpha, 'TGA'),
+        ("ppm RGB", photo, 'PPM'),
+        ("tiff RGB", photo, 'TIFF'),
+    ]
+
+
+def in_memory(data, max_dim):
+    # The whole decode and resize_to_fit, converted as decode_and_resize converts it. Palettes
+    # without a transparency key are expanded first, as the strips expand them.
+    image = engine.open_source(data)
+    image.load()
+    if image.format not in engine.KEPT_FORMATS:
+        image = image.convert('RGB')
+    elif image.mode == 'P' and 'transparency' not in image.info:
+        image = image.convert('RGB')
+    return engine.resize_to_fit(image, max_dim, "fast")
+
+
+def in_strips(data, max_dim):
+    image, saved_format = engine.decode_and_resize(engine.open_source(data), max_dim, large_pixels=0)
+    return image
+
+
+def pixels(image, alpha):
+    # Colour under fully transparent pixels is not compared, as in codecs.psnr
+    return np.asarray(codecs.visible(image) if alpha else image.convert('RGB'), dtype=np.int16)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="3000x2000", help="WIDTHxHEIGHT of the sources")
+    parser.add_argument("--max-dim", type=int, default=640)
+    args = parser.parse_args(argv)
+    width, height = (int(value) for value in args.size.split("x"))
+    strips.STRIP_BYTES = STRIP_BYTES
+
+    failures = 0
+    print(f"{width}x{height} to {args.max_dim}px, strips of {STRIP_BYTES // 1024} KiB")
+    print(f"{'case':<11} {'path':>6} {'max diff':>9} {'mean diff':>10} {'tolerance':>10}")
+    for name, image, image_format in cases(width, height):
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format)
+        data = buffer.getvalue()
+        with engine.open_source(data) as source:
+            path = "strips" if strips.strip_reader(source) is not None else "whole"
+        reference = in_memory(data, args.max_dim)
+        alpha = png.has_alpha(reference)
+        difference = np.abs(pixels(reference, alpha) - pixels(in_strips(data, args.max_dim), alpha))
+        largest, mean = difference.max(), difference.mean()
+        limits = (ALPHA_MAX_DIFF, ALPHA_MEAN_DIFF) if alpha else (0, 0)
+        ok = largest <= limits[0] and mean <= limits[1]
+        failures += not ok
+        print(f"{name:<11} {path:>6} {largest:>9} {mean:>10.3f} {f'{limits[0]}/{limits[1]}':>10}"
+              f"{'' if ok else '  over tolerance'}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
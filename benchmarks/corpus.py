@@ -0,0 +1,110 @@
+"""Deterministic synthetic images so benchmark runs are comparable across machines."""
+import os
+
+import numpy as np
+from PIL import Image
+
+
+def photo_like(width, height, seed, cell=32, grain=12):
+    # Low-frequency colour noise plus gradients: compresses roughly like a photograph.
+    # Smaller ``cell`` means more detail; ``grain`` is the amplitude of per-pixel noise.
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (max(height // cell, 2), max(width // cell, 2), 3), dtype=np.uint8)
+    image = Image.fromarray(coarse).resize((width, height), Image.BICUBIC)
+    pixels = np.asarray(image, dtype=np.int16)
+    if grain:
+        pixels += rng.integers(-grain, grain + 1, pixels.shape, dtype=np.int16)  # sensor-like grain
+    ramp = np.linspace(-40, 40, width, dtype=np.int16)
+    pixels += ramp[None, :, None]
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def screenshot_like(width, height, seed):
+    # Flat UI panels with text-like noise rows: the typical PNG input
+    rng = np.random.default_rng(seed)
+    pixels = np.full((height, width, 3), 240, dtype=np.uint8)
+    for _ in range(40):
+        x, y = rng.integers(0, width - 50), rng.integers(0, height - 20)
+        pixels[y:y + rng.integers(10, 200), x:x + rng.integers(40, 600)] = rng.integers(0, 256, 3)
+    for row in range(20, height - 8, 24):
+        mask = rng.random((8, width)) < 0.3
+        pixels[row:row + 8][mask] = 30
+    return Image.fromarray(pixels)
+
+
+def transparent_photo(width, height, seed):
+    image = photo_like(width, height, seed).convert('RGBA')
+    yy, xx = np.mgrid[0:height, 0:width]
+    alpha = ((xx - width / 2) ** 2 + (yy - height / 2) ** 2 < (min(width, height) / 2.2) ** 2) * 255
+    image.putalpha(Image.fromarray(alpha.astype(np.uint8)))
+    return image
+
+
+def icon_like(size, seed):
+    # A few flat shapes on a transparent square, like a favicon or toolbar icon
+    rng = np.random.default_rng(seed)
+    pixels = np.zeros((size, size, 4), dtype=np.uint8)
+    for _ in range(4):
+        x, y = rng.integers(0, size // 2, 2)
+        w, h = rng.integers(size // 4, size // 2 + 1, 2)
+        pixels[y:y + h, x:x + w] = (*rng.integers(0, 256, 3), 255)
+    return Image.fromarray(pixels)
+
+
+def write_photo_corpus(directory, count=24, size=(3000, 2000), seed=1234):
+    """Write ``count`` photo-like JPEGs into ``directory`` and return their paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"photo_{index:03d}.jpg")
+        if not os.path.exists(path):
+            photo_like(size[0], size[1], seed + index).save(path, quality=92)
+        paths.append(path)
+    return paths
+
+
+def varied_photos(count, seed=99):
+    """Photo-like images that differ in size, detail and grain, for estimator tests."""
+    rng = np.random.default_rng(seed)
+    images = []
+    for index in range(count):
+        width = int(rng.choice([640, 1024, 1600, 1920]))
+        height = int(width * rng.choice([0.5625, 0.667, 0.75, 1.0]))
+        cell = int(rng.choice([8, 16, 32, 64]))
+        grain = int(rng.choice([0, 4, 12, 24]))
+        images.append(photo_like(width, height, seed + index, cell, grain))
+    return images
+
+
+# Suite cases: name -> (count, file extension, make(index) -> image, save options).
+# GIF and BMP inputs are re-encoded as JPEG through the convert('RGB') path.
+SUITE_CASES = {
+    "photo": (8, "jpg", lambda i: photo_like(3000, 2000, 100 + i), {"quality": 92}),
+    "screenshot": (6, "png", lambda i: screenshot_like(1920, 1080, 200 + i), {}),
+    "transparent": (4, "png", lambda i: transparent_photo(1200, 1200, 300 + i), {}),
+    "huge": (2, "jpg", lambda i: photo_like(7680, 4320, 400 + i, cell=48), {"quality": 90}),
+    "icon": (48, "png", lambda i: icon_like((16, 32, 48, 64)[i % 4], 500 + i), {}),
+    "gif": (4, "gif", lambda i: photo_like(800, 600, 600 + i).quantize(256), {}),
+    "bmp": (4, "bmp", lambda i: photo_like(1600, 1200, 700 + i), {}),
+}
+
+
+def write_suite_corpus(directory, cases=None):
+    """Write the benchmark suite corpus into ``directory``; returns case -> paths.
+
+    Files that already exist are reused, so a corpus directory can be kept
+    between runs. The images depend only on their seeds.
+    """
+    corpus = {}
+    for case in cases or SUITE_CASES:
+        count, extension, make, options = SUITE_CASES[case]
+        case_dir = os.path.join(directory, case)
+        os.makedirs(case_dir, exist_ok=True)
+        paths = []
+        for index in range(count):
+            path = os.path.join(case_dir, f"{case}_{index:03d}.{extension}")
+            if not os.path.exists(path):
+                make(index).save(path, **options)
+            paths.append(path)
+        corpus[case] = paths
+    return corpus
@@ -0,0 +1,81 @@
+"""A local HTTP server that stands in for an image CDN during benchmarks.
+
+Every request sleeps ``latency`` seconds before answering. Paths map to files in
+``root``; ``/flaky/<name>`` answers 503 on the first request for each name and
+serves the file afterwards, and ``/missing`` always answers 404.
+"""
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png',
+                 '.gif': 'image/gif', '.bmp': 'image/bmp'}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root, latency=0.0):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.root = root
+        self.latency = latency
+        self.requests = 0
+        self.failed_once = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def url_for(self, path):
+        return f"{self.base_url}/{os.path.basename(path)}"
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse is visible
+    disable_nagle_algorithm = True  # headers and body are separate writes; avoid delayed-ACK stalls
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        name = self.path.lstrip('/')
+        if name.startswith('flaky/'):
+            name = name[len('flaky/'):]
+            with server.lock:
+                first = name not in server.failed_once
+                server.failed_once.add(name)
+            if first:
+                return self.send_body(503, b'try again', 'text/plain')
+
+        path = os.path.join(server.root, os.path.basename(name))
+        if not os.path.isfile(path):
+            return self.send_body(404, b'not found', 'text/plain')
+        with open(path, 'rb') as f:
+            body = f.read()
+        content_type = CONTENT_TYPES.get(os.path.splitext(path)[1].lower(), 'application/octet-stream')
+        self.send_body(200, body, content_type)
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,28 @@
+"""Image similarity helpers for benchmarks (NumPy only, no scikit-image needed)."""
+import numpy as np
+from PIL import Image
+
+WINDOW = 8
+C1 = (0.01 * 255) ** 2
+C2 = (0.03 * 255) ** 2
+
+
+def box_mean(values, window=WINDOW):
+    # Mean over every window x window block, via a summed-area table
+    table = np.pad(values, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+    sums = table[window:, window:] - table[:-window, window:] - table[window:, :-window] + table[:-window, :-window]
+    return sums / (window * window)
+
+
+def ssim(reference, candidate):
+    """Mean SSIM of the luma channels; ``candidate`` is resized to ``reference`` if needed."""
+    if candidate.size != reference.size:
+        candidate = candidate.resize(reference.size, Image.LANCZOS)
+    a = np.asarray(reference.convert('L'), dtype=np.float64)
+    b = np.asarray(candidate.convert('L'), dtype=np.float64)
+    mu_a, mu_b = box_mean(a), box_mean(b)
+    var_a = box_mean(a * a) - mu_a ** 2
+    var_b = box_mean(b * b) - mu_b ** 2
+    covar = box_mean(a * b) - mu_a * mu_b
+    score = ((2 * mu_a * mu_b + C1) * (2 * covar + C2)) / ((mu_a ** 2 + mu_b ** 2 + C1) * (var_a + var_b + C2))
+    return float(score.mean())
@@ -0,0 +1,287 @@
+"""Reproducible benchmark suite: every input kind through the local and URL flows.
+
+    python -m benchmarks.suite run [-o results.json] [--repeat 3] [--cases photo icon ...]
+    python -m benchmarks.suite compare BASE.json NEW.json [--threshold 0.10]
+
+``run`` writes a fixed synthetic corpus (photos, screenshots, transparent PNGs,
+8K JPEGs, icons, GIF and BMP inputs; see ``corpus.SUITE_CASES``) and compresses
+each case through the CLI, once from local files and once from URLs served by
+``http_stub.StubServer``. Every run happens in a fresh subprocess so peak RSS
+belongs to that run alone. Timing metrics are the median over ``--repeat`` runs.
+
+``compare`` flags metrics of NEW that are worse than BASE by more than
+``--threshold`` (relative) and exits with status 1 if any are.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import PIL
+from PIL import Image
+
+from benchmarks.corpus import SUITE_CASES, write_suite_corpus
+from benchmarks.quality import ssim
+from compressor.metrics import percentile
+
+FLOWS = ("local", "url")
+
+# name -> (higher is better, absolute change below which a difference is noise)
+METRICS = {
+    "images_per_second": (True, 0.0),
+    "mb_per_second": (True, 0.0),
+    "latency_p50": (False, 0.010),
+    "latency_p95": (False, 0.010),
+    "latency_p99": (False, 0.010),
+    "peak_rss_mb": (False, 4.0),
+    "encodes_per_image": (False, 0.0),
+    "bytes_out_mean": (False, 0.0),
+    "ssim_mean": (True, 0.0),
+}
+QUALITY_METRICS = ("ssim_mean",)  # compared by absolute difference, see --quality-threshold
+
+CHILD = """
+import json, resource, sys
+from compressor import cli
+config = json.loads(sys.argv[1])
+argv = ["-o", config["output"], "--metrics", config["metrics"], "-q",
+        "-j", str(config["workers"]), "--search", config["search"]]
+if config["flow"] == "url":
+    from benchmarks.http_stub import StubServer
+    with StubServer(config["root"], config["latency"]) as server:
+        cli.main([server.url_for(path) for path in config["paths"]] + argv)
+else:
+    cli.main(config["paths"] + argv)
+# VmHWM rather than ru_maxrss: the latter keeps the parent's high-water mark across exec
+with open("/proc/self/status") as f:
+    own = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+print(max(own, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss))
+"""
+
+
+def run_child(config):
+    result = subprocess.run([sys.executable, "-c", CHILD, json.dumps(config)],
+                            check=True, capture_output=True, text=True)
+    return int(result.stdout.strip().splitlines()[-1]) / 1024  # KiB
+
+
+def read_metrics(path):
+    records, summary = [], None
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("type") == "summary":
+                summary = record
+            else:
+                records.append(record)
+    return records, summary
+
+
+def flattened(image):
+    # Composite over white so pixels hidden by transparency do not count
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+        return Image.alpha_composite(background, image).convert('RGB')
+    return image.convert('RGB')
+
+
+def reference_for(path, size):
+    # The source scaled to the output size, which is what the output should look like
+    with Image.open(path) as image:
+        image.draft('RGB', size)
+        return flattened(image).resize(size, Image.LANCZOS)
+
+
+def output_quality(records, paths):
+    scores = []
+    for record in records:
+        if not record["ok"]:
+            continue
+        with Image.open(record["output"]) as output:
+            scores.append(ssim(reference_for(paths[record["index"] - 1], output.size), flattened(output)))
+    return scores
+
+
+def measure(paths, flow, workdir, args, with_quality):
+    output = tempfile.mkdtemp(prefix="out_", dir=workdir)
+    metrics_path = os.path.join(output, "metrics.jsonl")
+    peak_rss = run_child({"flow": flow, "paths": paths, "root": os.path.dirname(paths[0]),
+                          "output": output, "metrics": metrics_path, "workers": args.workers,
+                          "search": args.search, "latency": args.latency})
+    records, summary = read_metrics(metrics_path)
+    latencies = sorted(sum(record["stages"].values()) for record in records if record["ok"])
+    row = {
+        "images": summary["images"],
+        "failed": summary["failed"],
+        "images_per_second": summary["images_per_second"],
+        "mb_per_second": summary["bytes_in"] / 1e6 / summary["seconds"],
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+        "peak_rss_mb": peak_rss,
+        "encodes_per_image": summary["encodes_per_image"],
+        "bytes_out_mean": summary["bytes_out"] / summary["ok"] if summary["ok"] else None,
+    }
+    if with_quality:
+        scores = output_quality(records, paths)
+        row["ssim_mean"] = statistics.fmean(scores) if scores else None
+        row["ssim_min"] = min(scores) if scores else None
+    shutil.rmtree(output, ignore_errors=True)
+    return row
+
+
+def median_row(rows):
+    merged = dict(rows[0])
+    for name in rows[0]:
+        values = [row[name] for row in rows if row.get(name) is not None]
+        if values and name not in ("ssim_mean", "ssim_min"):
+            merged[name] = statistics.median(values)
+    return merged
+
+
+def corpus_digest(corpus):
+    digest = hashlib.sha256()
+    for case in sorted(corpus):
+        for path in corpus[case]:
+            with open(path, 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()[:16]
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args):
+    corpus_dir = args.corpus or os.path.join(tempfile.gettempdir(), "image_compressor_suite_corpus")
+    corpus = write_suite_corpus(corpus_dir, args.cases)
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "corpus": corpus_digest(corpus),
+            "repeat": args.repeat,
+            "options": {"workers": args.workers, "search": args.search, "latency": args.latency},
+        },
+        "cases": {},
+    }
+    workdir = tempfile.mkdtemp(prefix="bench_suite_")
+    try:
+        for case, paths in corpus.items():
+            for flow in FLOWS:
+                rows = [measure(paths, flow, workdir, args, with_quality=repeat == 0)
+                        for repeat in range(args.repeat)]
+                row = median_row(rows)
+                results["cases"][f"{case}/{flow}"] = row
+                print(f"{case + '/' + flow:<18} {row['images_per_second']:>7.2f} img/s "
+                      f"{row['mb_per_second']:>7.2f} MB/s  p50 {row['latency_p50'] * 1000:>7.1f} ms  "
+                      f"p95 {row['latency_p95'] * 1000:>7.1f} ms  rss {row['peak_rss_mb']:>5.0f} MB  "
+                      f"{row['encodes_per_image'] or 0:>4.1f} enc  ssim {row['ssim_mean']:.4f}"
+                      + (f"  ({row['failed']} failed)" if row["failed"] else ""))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+    return results
+
+
+def compare(base, new, threshold, quality_threshold):
+    """Return ``(case, metric, base value, new value, change)`` for every regression."""
+    regressions = []
+    for case, new_row in new["cases"].items():
+        base_row = base["cases"].get(case)
+        if base_row is None:
+            continue
+        for name, (higher_is_better, noise) in METRICS.items():
+            old, value = base_row.get(name), new_row.get(name)
+            if old is None or value is None:
+                continue
+            worse = old - value if higher_is_better else value - old
+            if worse <= noise:
+                continue
+            if name in QUALITY_METRICS:
+                change = -worse
+                regressed = worse > quality_threshold
+            else:
+                change = (value - old) / old if old else float('inf')
+                regressed = old == 0 or worse / old > threshold
+            if regressed:
+                regressions.append((case, name, old, value, change))
+    return regressions
+
+
+def report_regressions(base, new, args):
+    if base["meta"].get("corpus") != new["meta"].get("corpus"):
+        print("warning: the runs used different corpora", file=sys.stderr)
+    if base["meta"].get("options") != new["meta"].get("options"):
+        print("warning: the runs used different options", file=sys.stderr)
+    regressions = compare(base, new, args.threshold, args.quality_threshold)
+    for case, name, old, value, change in regressions:
+        change_text = f"{change:+.4f}" if name in QUALITY_METRICS else f"{change:+.0%}"
+        print(f"REGRESSION {case:<18} {name:<18} {old:.4g} -> {value:.4g} ({change_text})")
+    if not regressions:
+        print(f"no regressions beyond {args.threshold:.0%} "
+              f"({len(new['cases'])} cases, base {base['meta'].get('revision')}, "
+              f"new {new['meta'].get('revision')})")
+    return 1 if regressions else 0
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the suite")
+    run_parser.add_argument("-o", "--output", metavar="FILE", help="write results as JSON")
+    run_parser.add_argument("--cases", nargs="+", choices=sorted(SUITE_CASES), help="default: all")
+    run_parser.add_argument("--corpus", metavar="DIR", help="corpus directory, reused between runs")
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("-j", "--workers", type=int, default=1)
+    run_parser.add_argument("--search", choices=("bisect", "predict", "linear"), default="bisect")
+    run_parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each HTTP response")
+    run_parser.add_argument("--baseline", metavar="FILE", help="compare against these results afterwards")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+
+    for command_parser in (run_parser, compare_parser):
+        command_parser.add_argument("--threshold", type=float, default=0.10,
+                                    help="relative change that counts as a regression (default: %(default)s)")
+        command_parser.add_argument("--quality-threshold", type=float, default=0.005,
+                                    help="SSIM drop that counts as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        return report_regressions(load_results(args.base), load_results(args.new), args)
+    if not sys.platform.startswith("linux"):
+        parser.error("peak RSS is read from /proc; run this on Linux")
+    results = run_suite(args)
+    if args.baseline:
+        return report_regressions(load_results(args.baseline), results, args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
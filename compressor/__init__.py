@@ -0,0 +1,32 @@
+"""Headless image compression engine used by the Image Compressor GUI and CLI."""
+from compressor.engine import (
+    DEFAULT_MAX_DIM,
+    DEFAULT_MAX_SIZE,
+    CompressionResult,
+    ItemResult,
+    OutputNamer,
+    UnsupportedImageError,
+    Variant,
+    compress_image,
+    compress_to_bytes,
+    compress_variants,
+    download_image,
+    load_local_image,
+    process_images,
+)
+
+__all__ = [
+    "DEFAULT_MAX_DIM",
+    "DEFAULT_MAX_SIZE",
+    "CompressionResult",
+    "ItemResult",
+    "OutputNamer",
+    "UnsupportedImageError",
+    "Variant",
+    "compress_image",
+    "compress_to_bytes",
+    "compress_variants",
+    "download_image",
+    "load_local_image",
+    "process_images",
+]
@@ -0,0 +1,169 @@
+"""Backends: what resizes, quantises and encodes the pixels.
+
+The engine works on Pillow images throughout; a backend only swaps the code
+behind those three steps:
+
+- "pillow": stock Pillow, the original behaviour and the fallback for
+  anything the others do not handle (PNG, WebP, AVIF and quantising).
+- "vips": libvips through ``pyvips`` for the fast resize (about 3x Pillow's)
+  and JPEG encodes. A libvips built against mozjpeg uses its trellis
+  quantisation: 6-10% smaller files at the same SSIM, but each encode takes
+  4-6x as long, so a whole quality search is several times slower.
+- "vips-resize": the libvips fast resize with Pillow's encoders.
+- "mozjpeg": JPEG encodes through mozjpeg's ``cjpeg`` (found on PATH, or set
+  MOZJPEG_CJPEG), with the same trade-off as "vips".
+
+"vips" and "mozjpeg" trade time for bytes, so they are only used when asked
+for. ``get_backend("auto")`` picks "vips-resize" when pyvips is installed,
+since it only saves time, and "pillow" otherwise.
+
+A quality number does not mean the same bytes in every encoder, but outputs
+stay comparable: the same search fits every output to its byte budget, and
+the backend is recorded in the result settings and in cache keys.
+``benchmarks/bench_backends.py`` compares them at equal SSIM.
+"""
+import io
+import os
+import shutil
+import subprocess
+from dataclasses import replace
+
+from PIL import Image
+
+
+class PillowBackend:
+    name = 'pillow'
+    codecs = ()  # codec names this backend encodes instead of Image.save
+
+    def available(self):
+        return True
+
+    def resize(self, image, size, reducing_gap=None):
+        return image.resize(size, Image.LANCZOS, reducing_gap=reducing_gap)
+
+    def quantize(self, image, colors, method):
+        # Dithering noise costs far more bytes in PNG than it buys in looks
+        return image.quantize(colors, method=method, dither=Image.Dither.NONE)
+
+    def encode(self, codec, image, quality):
+        return codec.save(image, quality)
+
+    def bind(self, codec):
+        # ``codec`` with its encodes going through this backend, if it handles that codec
+        if codec.name not in self.codecs:
+            return codec
+        return replace(codec, encoder=lambda image, quality: self.encode(codec, image, quality))
+
+
+def buffer_of(data):
+    # Positioned at the end, like a buffer Image.save wrote
+    buffer = io.BytesIO()
+    buffer.write(data)
+    return buffer
+
+
+class MozjpegBackend(PillowBackend):
+    name = 'mozjpeg'
+    codecs = ('jpeg',)
+
+    def __init__(self):
+        self.command = None
+        self.checked = False
+
+    def available(self):
+        # libjpeg-turbo also ships a cjpeg; only mozjpeg's names itself in -version
+        if not self.checked:
+            command = os.environ.get('MOZJPEG_CJPEG') or shutil.which('cjpeg')
+            if command:
+                try:
+                    version = subprocess.run([command, '-version'], capture_output=True, text=True, timeout=10)
+                    if 'mozjpeg' in (version.stdout + version.stderr).lower():
+                        self.command = command
+                except (OSError, subprocess.SubprocessError):
+                    pass
+            self.checked = True
+        return self.command is not None
+
+    def encode(self, codec, image, quality):
+        # mozjpeg's defaults are progressive, optimised scans and trellis quantisation
+        source = io.BytesIO()
+        image.save(source, format='PPM')
+        result = subprocess.run([self.command, '-quality', str(quality)], input=source.getbuffer(),
+                                capture_output=True)
+        if result.returncode != 0:
+            raise IOError(f"cjpeg failed: {result.stderr.decode(errors='replace').strip()}")
+        return buffer_of(result.stdout)
+
+
+class VipsBackend(PillowBackend):
+    name = 'vips'
+    codecs = ('jpeg',)  # Its WebP and AVIF wrap the same libraries as Pillow's, only slower here
+    BANDS = {'L': 1, 'LA': 2, 'RGB': 3, 'RGBA': 4}
+
+    def __init__(self):
+        self.pyvips = None
+        self.checked = False
+
+    def available(self):
+        if not self.checked:
+            try:
+                import pyvips  # Optional; needs the libvips shared library too
+
+                self.pyvips = pyvips
+            except (ImportError, OSError):
+                pass
+            self.checked = True
+        return self.pyvips is not None
+
+    def to_vips(self, image):
+        return self.pyvips.Image.new_from_memory(image.tobytes(), image.width, image.height,
+                                                 self.BANDS[image.mode], 'uchar')
+
+    def resize(self, image, size, reducing_gap=None):
+        # libvips always box-shrinks before its LANCZOS3 pass, so it only stands in for the fast resize
+        if reducing_gap is None or image.mode not in self.BANDS:
+            return super().resize(image, size, reducing_gap)
+        alpha = image.mode in ('LA', 'RGBA')
+        resized = self.to_vips(image)
+        if alpha:
+            resized = resized.premultiply()
+        resized = resized.resize(size[0] / image.width, vscale=size[1] / image.height, kernel='lanczos3')
+        if alpha:
+            resized = resized.unpremultiply()
+        resized = resized.cast('uchar')
+        if (resized.width, resized.height) != tuple(size):
+            return super().resize(image, size, reducing_gap)  # libvips rounded a side differently
+        return Image.frombytes(image.mode, size, resized.write_to_memory())
+
+    def encode(self, codec, image, quality):
+        # The mozjpeg options are ignored by a libvips built against libjpeg-turbo. Its other
+        # quantisation tables (quant_table) lose to the standard ones at equal SSIM.
+        data = self.to_vips(image).jpegsave_buffer(Q=quality, optimize_coding=True, interlace=True,
+                                                   trellis_quant=True, overshoot_deringing=True,
+                                                   optimize_scans=True, strip=True)
+        return buffer_of(data)
+
+
+class VipsResizeBackend(VipsBackend):
+    name = 'vips-resize'
+    codecs = ()
+
+
+BACKENDS = {backend.name: backend
+            for backend in (PillowBackend(), MozjpegBackend(), VipsBackend(), VipsResizeBackend())}
+BACKEND_NAMES = ('auto',) + tuple(BACKENDS)
+
+
+def get_backend(name="auto"):
+    if name == "auto":
+        return BACKENDS['vips-resize'] if BACKENDS['vips-resize'].available() else BACKENDS['pillow']
+    backend = BACKENDS.get(name)
+    if backend is None:
+        raise ValueError(f"Unknown backend: {name}")
+    if not backend.available():
+        raise ValueError(f"The {name} backend is not installed")
+    return backend
+
+
+def available_backends():
+    return [name for name in BACKEND_NAMES if name == 'auto' or BACKENDS[name].available()]
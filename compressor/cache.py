@@ -0,0 +1,193 @@
+"""On-disk, content-addressed cache of compressed outputs.
+
+Entries are keyed by a SHA-256 of the source bytes plus the compression
+options, so an unchanged input compressed with the same settings is copied (or
+hard-linked) from the cache instead of being re-encoded. The index is a SQLite
+database in WAL mode, which keeps it consistent when several worker processes
+read and write at once. When the cached bytes exceed ``max_bytes`` the least
+recently used entries are evicted.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+from compressor import engine, predict
+
+DEFAULT_CACHE_BYTES = 1024 * 1024 * 1024  # 1 GB
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    ext TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    quality INTEGER,
+    encodes INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def cache_key(data, options):
+    # Every option that changes the output bytes goes into the key; debug output and
+    # verification do not. The predict search stops at the first encode that fills most
+    # of the budget, so which quality it lands on depends on the model's weights
+    digest = hashlib.sha256()
+    keyed = {k: v for k, v in options.items() if k not in ('debug', 'model', 'verify')}
+    if options.get('search') == 'predict':
+        keyed['model'] = (options.get('model') or predict.QualityModel()).weights.tolist()
+    digest.update(json.dumps(keyed, sort_keys=True).encode())
+    digest.update(b'\0')
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Content-addressed output cache rooted at ``directory``.
+
+    Safe to pickle into worker processes: each process opens its own SQLite
+    connection on first use.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_BYTES, hardlink=False):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.hardlink = hardlink
+        self._conn = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['_pid'] = None
+        return state
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.join(self.directory, 'objects'), exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.directory, 'index.sqlite3'), timeout=30,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def object_path(self, key, ext):
+        return os.path.join(self.directory, 'objects', key[:2], key + ext)
+
+    def count(self, name):
+        self.conn.execute('INSERT INTO counters (name, value) VALUES (?, 1) '
+                          'ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+
+    def get(self, key, output_path):
+        """Restore the entry for ``key`` to ``output_path``; returns a CompressionResult or None."""
+        row = self.conn.execute('SELECT ext, size, quality, encodes FROM entries WHERE key = ?',
+                                (key,)).fetchone()
+        if row is not None:
+            ext, size, quality, encodes = row
+            output_path = os.path.splitext(output_path)[0] + ext  # An "auto" entry keeps its codec
+            try:
+                self.restore(self.object_path(key, ext), output_path)
+            except FileNotFoundError:
+                # Evicted by another process between the lookup and the copy
+                self.conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            else:
+                self.conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+                self.count('hits')
+                with Image.open(output_path) as restored:  # Reads the header only
+                    width, height = restored.size
+                return engine.CompressionResult(output_path, size, quality, encodes, cached=True,
+                                                width=width, height=height)
+        self.count('misses')
+        return None
+
+    def restore(self, object_path, output_path):
+        # Linked or copied under a temporary name and renamed, like engine.write_buffer,
+        # so an existing output is replaced whole and a failed restore leaves nothing behind
+        directory, name = os.path.split(output_path)
+        temp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            linked = False
+            if self.hardlink:
+                try:
+                    os.link(object_path, temp_path)
+                    linked = True
+                except FileNotFoundError:
+                    raise
+                except OSError:
+                    pass  # Cross-device or unsupported; fall back to a copy
+            if not linked:
+                shutil.copyfile(object_path, temp_path)
+            os.replace(temp_path, output_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def put(self, key, result):
+        """Store the file behind ``result`` under ``key`` and evict down to ``max_bytes``."""
+        ext = os.path.splitext(result.path)[1]
+        object_path = self.object_path(key, ext)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        # Copy under a temporary name and rename, so readers never see a partial object
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(object_path), suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(result.path, temp_path)
+            os.chmod(temp_path, 0o644)  # mkstemp's 0600 would carry over to hard-linked outputs
+            os.replace(temp_path, object_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.conn.execute('INSERT OR REPLACE INTO entries (key, ext, size, quality, encodes, last_used) '
+                          'VALUES (?, ?, ?, ?, ?, ?)',
+                          (key, ext, result.size, result.quality, result.encodes, time.time()))
+        self.evict()
+
+    def evict(self):
+        conn = self.conn
+        evicted = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total > self.max_bytes:
+                for key, ext, size in conn.execute('SELECT key, ext, size FROM entries ORDER BY last_used'):
+                    evicted.append((key, ext))
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+                conn.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key, ext in evicted])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        for key, ext in evicted:
+            try:
+                os.unlink(self.object_path(key, ext))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """Hit/miss counters (across every process using this cache) and current size."""
+        counters = dict(self.conn.execute('SELECT name, value FROM counters'))
+        entries, total = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return {'hits': counters.get('hits', 0), 'misses': counters.get('misses', 0),
+                'entries': entries, 'bytes': total}
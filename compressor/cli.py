@@ -0,0 +1,448 @@
+"""Command-line interface: ``python -m compressor INPUT... -o OUTPUT``."""
+import argparse
+import glob
+import json
+import os
+import signal
+import sys
+import threading
+
+from compressor import backends, codecs, engine, journal, metrics, parallel
+
+
+def is_url(value):
+    return value.startswith(("http://", "https://"))
+
+
+def expand_inputs(patterns):
+    # Expand globs ourselves so quoting works the same on every shell
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        paths.extend(matches)
+    return paths
+
+
+def read_url_file(path):
+    # One "URL [name]" per line; blank lines and '#' comments are ignored
+    handle = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        entries = []
+        for line in handle:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split(None, 1)
+            entries.append((parts[0], parts[1].strip() if len(parts) > 1 else ""))
+        return entries
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+def collect_sources(args):
+    # Returns a list of (kind, location, name) tuples in command-line order
+    sources = []
+    for value in expand_inputs(args.inputs):
+        if is_url(value):
+            sources.append(("url", value, ""))
+        else:
+            sources.append(("file", value, os.path.splitext(os.path.basename(value))[0]))
+    for url_file in args.url_file:
+        sources.extend(("url", url, name) for url, name in read_url_file(url_file))
+    return sources
+
+
+def job_key(kind, location):
+    # What the journal knows an input by: its absolute path or its URL
+    return os.path.abspath(location) if kind == "file" else location
+
+
+def iter_jobs(sources, downloader, batch_metrics=None):
+    # File jobs pass straight through; URL jobs come from the downloader in order,
+    # so compression starts while later URLs are still downloading. Each job
+    # carries its journal key.
+    downloads = downloader.iter_fetch((location for kind, location, name in sources if kind == "url"),
+                                      timed=True)
+    for index, (kind, location, name) in enumerate(sources, 1):
+        if kind == "file":
+            yield location, name, job_key(kind, location)
+        else:
+            url, outcome, seconds = next(downloads)
+            if batch_metrics is not None and seconds is not None:
+                size = len(outcome) if isinstance(outcome, (bytes, bytearray)) else 0
+                batch_metrics.record_download(index, seconds, size)
+            yield outcome, name, url
+
+
+def parse_variant(value):
+    # "DIM:BYTES[:FORMAT]", e.g. "640:40000" or "1280:120000:webp"
+    parts = value.split(":")
+    if len(parts) not in (2, 3):
+        raise argparse.ArgumentTypeError(f"expected DIM:BYTES[:FORMAT], got {value!r}")
+    try:
+        max_dim, max_size = int(parts[0]), int(parts[1])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"DIM and BYTES must be integers in {value!r}")
+    output_format = parts[2] if len(parts) == 3 else "keep"
+    if output_format not in codecs.available_formats():
+        raise argparse.ArgumentTypeError(f"unknown or unavailable format {output_format!r} in {value!r}")
+    return engine.Variant(max_dim, max_size, output_format)
+
+
+def describe(result):
+    quality = f", quality {result.quality}" if result.quality is not None else ""
+    how = "cached" if result.cached else f"{result.encodes} encodes"
+    if result.settings.get("codec"):
+        how += f", {result.settings['codec']}"
+    if result.settings.get("colors"):
+        how += f", {result.settings['colors']} colours at scale {result.settings['scale']}"
+    if result.variants:
+        how += ", variants " + " ".join(f"{variant.width}w:{variant.size}" for variant in result.variants)
+    return f"{result.path} ({result.size} bytes{quality}, {how})"
+
+
+def open_cache(args):
+    if not args.cache:
+        return None
+    from compressor.cache import ResultCache
+
+    return ResultCache(args.cache, args.cache_size * 1024 * 1024, hardlink=args.cache_hardlink)
+
+
+def open_model(args):
+    if args.search != "predict":
+        return None
+    from compressor.predict import QualityModel
+
+    return QualityModel(args.quality_model)
+
+
+def read_manifest(path):
+    # The manifest of an earlier run, which a resumed run adds to
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_manifest(path, manifest):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m compressor",
+        description="Compress images to a byte budget without the GUI.",
+    )
+    parser.add_argument("inputs", nargs="*", metavar="INPUT",
+                        help="image files, glob patterns or http(s) URLs")
+    parser.add_argument("-u", "--url-file", action="append", default=[], metavar="FILE",
+                        help="file with one 'URL [name]' per line ('-' for stdin); may be repeated")
+    parser.add_argument("-o", "--output", metavar="DIR",
+                        help="output directory (created if missing)")
+    parser.add_argument("-s", "--max-size", type=int, default=engine.DEFAULT_MAX_SIZE, metavar="BYTES",
+                        help="byte budget per image (default: %(default)s)")
+    parser.add_argument("--max-dim", type=int, default=engine.DEFAULT_MAX_DIM, metavar="PX",
+                        help="longest side after pre-resize (default: %(default)s)")
+    parser.add_argument("--resize", choices=("fast", "exact"), default="fast",
+                        help="fast decodes large JPEGs at reduced scale before the final LANCZOS pass; "
+                             "exact decodes every pixel (default: %(default)s)")
+    parser.add_argument("--large-image", type=float, default=engine.LARGE_IMAGE_PIXELS / 1e6, metavar="MP",
+                        help="downscale images over MP megapixels a strip at a time instead of decoding them "
+                             "whole, always with the fast resize (default: %(default)g)")
+    parser.add_argument("--max-pixels", type=float, default=engine.MAX_IMAGE_PIXELS / 1e6, metavar="MP",
+                        help="refuse images over MP megapixels before decoding them or, for URLs, "
+                             "downloading them (default: %(default)g)")
+    parser.add_argument("--search", choices=("bisect", "predict", "linear"), default="bisect",
+                        help="how JPEG quality is found; predict starts from a learned estimate "
+                             "(default: %(default)s)")
+    parser.add_argument("--quality-model", metavar="FILE",
+                        help="load and update the --search predict calibration in this JSON file")
+    parser.add_argument("--quantizer", choices=("auto", "fastoctree", "mediancut", "libimagequant"),
+                        default="auto", help="palette quantiser for PNG outputs (default: %(default)s)")
+    parser.add_argument("--backend", choices=backends.BACKEND_NAMES, default="auto",
+                        help="what resizes, quantises and encodes; auto is vips-resize (the pyvips resize with "
+                             "Pillow's encoders) when pyvips is installed and Pillow otherwise, vips (pyvips) and "
+                             "mozjpeg (cjpeg) give smaller JPEGs at several times the encode time "
+                             "(default: %(default)s)")
+    parser.add_argument("-f", "--format", dest="output_format", choices=codecs.available_formats(), default="keep",
+                        help="output codec; keep writes PNG for PNG inputs and JPEG otherwise, auto picks the "
+                             "format closest to the source within the budget, trying costlier codecs only "
+                             "when needed (default: %(default)s)")
+    parser.add_argument("--variant", dest="variants", action="append", type=parse_variant,
+                        metavar="DIM:BYTES[:FORMAT]",
+                        help="also write a rendition at most DIM pixels on its longest side and BYTES large; "
+                             "repeat for a responsive set (replaces --max-dim, --max-size and --format)")
+    parser.add_argument("--manifest", metavar="FILE",
+                        help="write a JSON manifest mapping each source to its outputs (with --variant: every "
+                             "variant's path, dimensions, bytes and quality)")
+    parser.add_argument("--no-verify", dest="verify", action="store_false",
+                        help="skip re-parsing each encoded image before it is written")
+    parser.add_argument("-j", "--workers", type=int, default=1, metavar="N",
+                        help="number of images compressed concurrently; 0 means one per CPU (default: %(default)s)")
+    parser.add_argument("--executor", choices=("process", "thread"), default="process",
+                        help="how --workers run in parallel (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=8, metavar="N",
+                        help="maximum downloads in flight (default: %(default)s)")
+    parser.add_argument("--per-host", type=int, default=4, metavar="N",
+                        help="maximum downloads in flight per host (default: %(default)s)")
+    parser.add_argument("--retries", type=int, default=3, metavar="N",
+                        help="retries for transient download failures (default: %(default)s)")
+    parser.add_argument("--max-download", type=int, default=50, metavar="MB",
+                        help="refuse downloads over MB megabytes while they stream (default: %(default)s)")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="reuse outputs for unchanged inputs from this cache directory")
+    parser.add_argument("--cache-size", type=int, default=1024, metavar="MB",
+                        help="evict least recently used cache entries above this size (default: %(default)s)")
+    parser.add_argument("--cache-hardlink", action="store_true",
+                        help="hard-link cached outputs instead of copying them when the cache is on the same "
+                             "filesystem; outputs then share their bytes with the cache, so do not edit them "
+                             "in place")
+    parser.add_argument("--serve", metavar="[HOST:]PORT",
+                        help="run an HTTP service: POST an image to /compress and get it back compressed")
+    parser.add_argument("--max-body", type=int, default=50, metavar="MB",
+                        help="with --serve, largest upload accepted (default: %(default)s)")
+    parser.add_argument("--watch", metavar="DIR",
+                        help="keep running and compress images as they are written to DIR (stop with Ctrl+C)")
+    parser.add_argument("--poll", action="store_true",
+                        help="with --watch, rescan DIR instead of using inotify (for network shares)")
+    parser.add_argument("--queue-size", type=int, metavar="N",
+                        help="files (--watch, default 64) or requests (--serve, default 16) that may wait for a "
+                             "worker before new ones are held back or refused")
+    parser.add_argument("--status", metavar="FILE",
+                        help="with --watch, keep queue depth, lag and stage timings in FILE as Prometheus text")
+    parser.add_argument("--journal", metavar="FILE",
+                        help="record every input's status, outputs and timings in a SQLite journal")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip inputs the journal has as done (default journal: OUTPUT/"
+                             f"{journal.JOURNAL_NAME}); interrupted ones overwrite their earlier outputs "
+                             "and --manifest is added to rather than replaced")
+    parser.add_argument("--max-attempts", type=int, default=journal.DEFAULT_MAX_ATTEMPTS, metavar="N",
+                        help="with --resume, stop retrying an input after it failed N times (default: %(default)s)")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="write per-image stage timings as JSON lines, then a summary ('-' for stdout)")
+    parser.add_argument("--metrics-format", choices=("jsonl", "prometheus"), default="jsonl",
+                        help="jsonl streams one record per image; prometheus writes the batch summary "
+                             "in text exposition format (default: %(default)s)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="run the batch under cProfile and write the stats to FILE")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only report failures")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print debug output")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.workers < 0:
+        parser.error("--workers must not be negative")
+    if args.max_pixels <= 0:
+        parser.error("--max-pixels must be positive")
+    # Pillow's own limit is process-wide; this process is ours, so it follows --max-pixels
+    engine.allow_pixels(int(args.max_pixels * 1e6))
+    try:
+        # Resolved here so cache keys and journals name the backend actually used
+        args.backend = backends.get_backend(args.backend).name
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.serve:
+        return serve(args, parser)
+    if not args.output:
+        parser.error("the following arguments are required: -o/--output")
+    if args.watch:
+        return watch(args)
+    sources = collect_sources(args)
+    if not sources:
+        parser.error("no inputs given")
+
+    job_journal = None
+    if args.journal or args.resume:
+        job_journal = journal.JobJournal(args.journal or os.path.join(args.output, journal.JOURNAL_NAME),
+                                         args.max_attempts)
+    if args.resume:
+        skipped = {}
+        remaining = []
+        for source in sources:
+            reason = job_journal.skip_reason(job_key(source[0], source[1]))
+            if reason:
+                skipped[reason] = skipped.get(reason, 0) + 1
+            else:
+                remaining.append(source)
+        if skipped and not args.quiet:
+            print(f"resuming: {skipped.get('done', 0)} done, {skipped.get('gave up', 0)} given up after "
+                  f"{args.max_attempts} attempts, {len(remaining)} to go")
+        sources = remaining
+    # Metrics on stdout replace the per-image report lines so the output stays parseable
+    quiet = args.quiet or args.metrics == "-"
+
+    def report(done, total, item):
+        if batch_metrics is not None:
+            batch_metrics.observe(item)
+        if manifest is not None and item.ok:
+            kind, location, name = sources[item.index - 1]
+            manifest[location] = {"name": item.name, "variants": engine.manifest_entry(item.result)}
+        if item.ok:
+            if not quiet:
+                print(f"[{done}/{total}] {describe(item.result)}")
+        else:
+            print(f"FAILED {item.output_path or item.name or item.index}: {item.error}", file=sys.stderr)
+
+    cache = open_cache(args)
+    model = open_model(args)
+
+    manifest = None
+    if args.manifest:
+        try:
+            # Inputs a resumed run skips keep the entries they got the first time
+            manifest = read_manifest(args.manifest) if args.resume else {}
+        except ValueError as e:
+            parser.error(f"cannot add to manifest {args.manifest}: {e}")
+    batch_metrics = metrics_stream = None
+    if args.metrics:
+        metrics_stream = sys.stdout if args.metrics == "-" else open(args.metrics, "w")
+        batch_metrics = metrics.BatchMetrics(metrics_stream if args.metrics_format == "jsonl" else None)
+
+    downloader = None
+    if any(kind == "url" for kind, location, name in sources):
+        from compressor.fetch import Downloader
+
+        downloader = Downloader(args.concurrency, args.per_host, retries=args.retries,
+                                max_bytes=args.max_download * 1024 * 1024,
+                                max_pixels=int(args.max_pixels * 1e6), debug=args.verbose)
+    try:
+        jobs = (iter_jobs(sources, downloader, batch_metrics) if downloader
+                else [(location, name, job_key(kind, location)) for kind, location, name in sources])
+        # Consume results as they stream out instead of collecting them, so memory stays flat
+        succeeded = failures = 0
+        with metrics.profiled(args.profile):
+            for item in parallel.iter_compress_jobs(jobs, args.output, workers=args.workers or None,
+                                                    executor=args.executor, max_size=args.max_size,
+                                                    max_dim=args.max_dim, search=args.search, resize=args.resize,
+                                                    large_pixels=int(args.large_image * 1e6), backend=args.backend,
+                                                    max_pixels=int(args.max_pixels * 1e6),
+                                                    model=model, quantizer=args.quantizer,
+                                                    output_format=args.output_format, variants=args.variants,
+                                                    verify=args.verify, cache=cache,
+                                                    timings=batch_metrics is not None, progress=report,
+                                                    journal=job_journal, total=len(sources),
+                                                    debug=args.verbose):
+                if item.ok:
+                    succeeded += 1
+                else:
+                    failures += 1
+    except IOError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if downloader:
+            downloader.close()
+        if job_journal is not None:
+            job_journal.close()
+        if model is not None:
+            model.save()
+        if manifest is not None:
+            write_manifest(args.manifest, manifest)
+        if batch_metrics is not None:
+            if args.metrics_format == "prometheus":
+                metrics_stream.write(batch_metrics.prometheus_text())
+            else:
+                batch_metrics.write_summary(metrics_stream)
+            if metrics_stream is not sys.stdout:
+                metrics_stream.close()
+
+    if not quiet:
+        print(f"{succeeded} of {len(sources)} images compressed")
+        if downloader:
+            stats = downloader.stats()
+            print(f"downloads: {stats['downloads']} ({stats['bytes']} bytes), {stats['rejected']} refused early "
+                  f"({stats['bytes_saved']} bytes not downloaded)")
+        if cache:
+            stats = cache.stats()
+            print(f"cache: {stats['hits']} hits, {stats['misses']} misses, "
+                  f"{stats['entries']} entries ({stats['bytes']} bytes)")
+        if args.profile:
+            print(f"profile written to {args.profile} (view with: python -m pstats {args.profile})")
+    return 1 if failures else 0
+
+
+def watch(args):
+    from compressor.watch import FolderWatcher
+
+    quiet = args.quiet or args.metrics == "-"
+    metrics_stream = None
+    if args.metrics:
+        metrics_stream = sys.stdout if args.metrics == "-" else open(args.metrics, "w")
+    job_journal = journal.JobJournal(args.journal or os.path.join(args.output, journal.JOURNAL_NAME),
+                                     args.max_attempts)
+    model = open_model(args)
+
+    def report(item, lag):
+        if not item.ok:
+            print(f"FAILED {item.output_path or item.name}: {item.error}", file=sys.stderr)
+        elif not quiet:
+            print(f"{describe(item.result)} after {lag:.2f}s")
+
+    watcher = FolderWatcher(args.watch, args.output, workers=args.workers or None, executor=args.executor,
+                            queue_size=args.queue_size or 64, poll=args.poll, job_journal=job_journal,
+                            batch_metrics=metrics.BatchMetrics(metrics_stream), progress=report,
+                            status_path=args.status, max_size=args.max_size, max_dim=args.max_dim,
+                            search=args.search, resize=args.resize, large_pixels=int(args.large_image * 1e6),
+                            max_pixels=int(args.max_pixels * 1e6),
+                            backend=args.backend, model=model, quantizer=args.quantizer,
+                            output_format=args.output_format, variants=args.variants, verify=args.verify,
+                            cache=open_cache(args), debug=args.verbose)
+    # Stop cleanly when a service manager asks, finishing the files in flight
+    signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+    if not quiet:
+        print(f"watching {watcher.folder} (Ctrl+C to stop)")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if model is not None:
+            model.save()
+        if metrics_stream is not None and metrics_stream is not sys.stdout:
+            metrics_stream.close()
+    if not quiet:
+        stats = watcher.stats()
+        print(f"{stats['compressed']} compressed, {stats['failed']} failed, {stats['unchanged']} unchanged")
+    return 0
+
+
+def serve(args, parser):
+    from compressor import server
+
+    host, _, port = args.serve.rpartition(":")
+    try:
+        address = (host or "127.0.0.1", int(port))
+    except ValueError:
+        parser.error(f"--serve expects [HOST:]PORT, got {args.serve!r}")
+    try:
+        service = server.CompressionServer(address, workers=args.workers or None,
+                                           queue_size=args.queue_size or server.DEFAULT_QUEUE_SIZE,
+                                           max_body=args.max_body * 1024 * 1024,
+                                           max_pixels=int(args.max_pixels * 1e6), max_size=args.max_size,
+                                           max_dim=args.max_dim, search=args.search, resize=args.resize,
+                                           large_pixels=int(args.large_image * 1e6), backend=args.backend,
+                                           quantizer=args.quantizer, output_format=args.output_format,
+                                           verify=args.verify, debug=args.verbose)
+    except OSError as e:
+        print(f"error: cannot listen on {address[0]}:{address[1]}: {e}", file=sys.stderr)
+        return 2
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=service.shutdown).start())
+    if not args.quiet:
+        print(f"serving on {service.url} with {service.workers} worker(s) (Ctrl+C to stop)")
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.server_close()
+    return 0
@@ -0,0 +1,153 @@
+"""Output codecs the engine can encode to, and how ``output_format="auto"`` picks one.
+
+Each Codec knows its Pillow format, file extension, whether it keeps alpha and
+roughly how expensive one encode is relative to JPEG. WebP and AVIF are
+optional Pillow plugins, so ``available()`` checks the running build.
+
+Auto mode tries the cheap codec for the image first and only moves on to a
+costlier one when the cheap one did not fit at all, or when its encode at
+AUTO_REFERENCE_QUALITY misses the budget by more than AUTO_MARGIN (the budget
+forced the quality well down). The ``keep`` codec is always tried last, so
+auto fits whatever keep would.
+"""
+import io
+import math
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from PIL import Image, ImageChops, ImageStat, features
+
+from compressor import png
+
+WEBP_METHOD = 4  # libwebp effort, 0-6; 4 is cwebp's default
+AVIF_SPEED = 8  # libavif speed, 0-10; 6 (Pillow's default) is about 2.5x slower for ~15% smaller files
+AUTO_REFERENCE_QUALITY = 80  # a lossy encode at this quality looks close to the source
+AUTO_MARGIN = 1.25  # costlier codecs are tried when the reference encode is over this times the budget
+LOSSLESS_RAW_RATIO = 4  # lossless codecs rarely beat 4:1 on photographic content
+
+
+@dataclass(frozen=True)
+class Codec:
+    name: str
+    format: str  # Pillow format name
+    extension: str
+    alpha: bool  # keeps an alpha channel
+    lossless: bool
+    cost: float  # encode time relative to JPEG, measured on a 1920x1280 photo
+    options: Optional[Callable] = None  # quality -> keyword arguments for Image.save
+    quality_step: int = 1  # bisection stops once the quality window is narrower than this
+    feature: Optional[str] = None  # PIL.features name the codec needs
+    other_extensions: tuple = ()
+    encoder: Optional[Callable] = None  # (image, quality) -> BytesIO replacing Image.save; see backends.bind
+
+    def owns(self, extension):
+        return extension.lower() in (self.extension,) + self.other_extensions
+
+    def available(self):
+        return self.feature is None or bool(features.check(self.feature))
+
+    def prepare(self, image):
+        # Convert to a mode the encoder accepts, dropping alpha it cannot store
+        if self.name == 'png':
+            return image
+        mode = 'RGBA' if self.alpha and png.has_alpha(image) else 'RGB'
+        return image if image.mode == mode else image.convert(mode)
+
+    def encode(self, image, quality=None):
+        if self.encoder is not None:
+            return self.encoder(image, quality)
+        return self.save(image, quality)
+
+    def save(self, image, quality=None):
+        # Pillow's encoder for this codec, whatever backend it is bound to
+        if self.name == 'png':
+            return png.encode_png(image, optimize=True)
+        buffer = io.BytesIO()
+        image.save(buffer, format=self.format, **self.options(quality))
+        return buffer
+
+
+CODECS = {
+    'jpeg': Codec('jpeg', 'JPEG', '.jpg', alpha=False, lossless=False, cost=1.0,
+                  options=lambda quality: {'quality': quality, 'optimize': True, 'progressive': True},
+                  other_extensions=('.jpeg',)),
+    'png': Codec('png', 'PNG', '.png', alpha=True, lossless=True, cost=10.0),
+    'webp': Codec('webp', 'WEBP', '.webp', alpha=True, lossless=False, cost=5.0,
+                  options=lambda quality: {'quality': quality, 'method': WEBP_METHOD},
+                  quality_step=2, feature='webp'),
+    'webp-lossless': Codec('webp-lossless', 'WEBP', '.webp', alpha=True, lossless=True, cost=6.0,
+                           options=lambda quality: {'lossless': True, 'quality': 50, 'method': WEBP_METHOD},
+                           feature='webp'),
+    'avif': Codec('avif', 'AVIF', '.avif', alpha=True, lossless=False, cost=12.0,
+                  options=lambda quality: {'quality': quality, 'speed': AVIF_SPEED},
+                  quality_step=4, feature='avif'),
+}
+OUTPUT_FORMATS = ('keep', 'auto') + tuple(CODECS)
+
+
+def get_codec(name):
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"Unknown output format: {name}")
+    if not codec.available():
+        raise ValueError(f"This Pillow build cannot write {codec.format} ({name})")
+    return codec
+
+
+def available_formats():
+    return [name for name in OUTPUT_FORMATS if name not in CODECS or CODECS[name].available()]
+
+
+def keep_codec(source_format):
+    # The original behaviour: PNG stays PNG, everything else becomes JPEG
+    return CODECS['png'] if source_format == 'PNG' else CODECS['jpeg']
+
+
+def auto_candidates(image, max_size, source_format=None):
+    """Codecs worth trying for ``image`` in auto mode, in the order to try them.
+
+    Cheapest first, except that lossless codecs go first when they stand a
+    chance: on flat images (at most 256 colours: UI, line art, icons) and on
+    images whose raw pixels are within LOSSLESS_RAW_RATIO of the budget. They
+    are not tried otherwise, and JPEG is skipped for images with alpha. The
+    keep codec for ``source_format`` comes last if it is not in already.
+    """
+    alpha = png.has_alpha(image)
+    raw_size = image.width * image.height * (4 if alpha else 3)
+    counted = image
+    if image.mode not in ('1', 'L', 'LA', 'P', 'PA', 'RGB', 'RGBA'):
+        # getcolors() rejects I;16; count in the 8-bit mode the codecs encode, as PngSearch does
+        counted = image.convert('RGBA' if alpha else 'RGB')
+    lossless = raw_size <= LOSSLESS_RAW_RATIO * max_size or counted.getcolors(256) is not None
+    candidates = [codec for codec in CODECS.values()
+                  if codec.available() and (codec.alpha or not alpha) and (lossless or not codec.lossless)]
+    candidates.sort(key=lambda codec: (not codec.lossless, codec.cost))
+    fallback = keep_codec(source_format)
+    return candidates if fallback in candidates else candidates + [fallback]
+
+
+def auto_extensions():
+    # Every extension an auto-mode output may end up with
+    return sorted({codec.extension for codec in CODECS.values() if codec.available()})
+
+
+def visible(image):
+    # Colour as it shows over black plus the alpha itself, so colour hidden under
+    # transparent pixels (which WebP and AVIF are free to change) does not count
+    image = image.convert('RGBA')
+    flat = Image.alpha_composite(Image.new('RGBA', image.size, (0, 0, 0, 255)), image)
+    flat.putalpha(image.getchannel('A'))
+    return flat
+
+
+def psnr(reference, buffer):
+    """PSNR in dB of the encoded ``buffer`` against ``reference`` (inf when identical)."""
+    alpha = png.has_alpha(reference)
+    with Image.open(io.BytesIO(buffer.getbuffer())) as decoded:
+        candidate = visible(decoded) if alpha else decoded.convert('RGB')
+    if candidate.size != reference.size:
+        candidate = candidate.resize(reference.size, Image.BILINEAR)
+    reference = visible(reference) if alpha else reference.convert('RGB')
+    squares = ImageStat.Stat(ImageChops.difference(reference, candidate)).sum2
+    mse = sum(squares) / (reference.width * reference.height * len(squares))
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
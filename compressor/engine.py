@@ -0,0 +1,696 @@
+"""Image compression engine shared by the GUI and the command-line interface.
+
+Nothing in this module imports tkinter, and ``requests`` is only imported when
+an image is actually downloaded, so headless workers can use it cheaply.
+"""
+import hashlib
+import io
+import math
+import os
+import re
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import List, Optional
+
+from PIL import Image
+
+from compressor import backends, codecs, png, strips
+from compressor.metrics import NULL_TIMER, StageTimer
+
+DEFAULT_MAX_SIZE = 100352  # 98 KB
+DEFAULT_MAX_DIM = 1920
+FAST_REDUCING_GAP = 2.0  # fast resize box-reduces to no less than this multiple of the target size
+SUPPORTED_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
+KEPT_FORMATS = ['JPEG', 'PNG', 'GIF', 'BMP']
+LARGE_IMAGE_PIXELS = 40_000_000  # larger sources are downscaled without being decoded whole
+# Sources over this are refused before they are decoded. Pillow refuses twice
+# its own Image.MAX_IMAGE_PIXELS (about 89 MP) outright, which would turn away
+# scans the strip path handles in bounded memory, so allow_pixels raises
+# Pillow's limit to the one a caller asks for.
+MAX_IMAGE_PIXELS = 400_000_000  # e.g. 20000x20000
+
+
+class UnsupportedImageError(IOError):
+    """Raised when an input is not an image format the compressor accepts."""
+
+
+@dataclass
+class CompressionResult:
+    path: str
+    size: int
+    quality: Optional[int]  # None for PNG output
+    encodes: int
+    cached: bool = False  # restored from a ResultCache instead of encoded
+    samples: List = field(default_factory=list)  # calibration pairs for predict.QualityModel
+    settings: dict = field(default_factory=dict)  # e.g. the palette and scale picked for a PNG
+    timings: dict = field(default_factory=dict)  # stage name -> seconds, when a StageTimer was used
+    bytes_in: Optional[int] = None  # encoded size of the source, when known
+    width: Optional[int] = None  # output dimensions
+    height: Optional[int] = None
+    digest: Optional[str] = None  # SHA-256 of the output bytes; None when restored from a cache
+    variants: List = field(default_factory=list)  # every CompressionResult of a compress_variants call
+
+
+@dataclass(frozen=True)
+class Variant:
+    """One responsive rendition: longest side, byte budget and output format."""
+    max_dim: int
+    max_size: int
+    output_format: str = "keep"
+
+
+@dataclass
+class ItemResult:
+    index: int
+    name: str
+    output_path: Optional[str] = None
+    result: Optional[CompressionResult] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def encode_to_buffer(image, saved_format, quality=None):
+    return codecs.keep_codec(saved_format).encode(image, quality)
+
+
+def write_buffer(buffer, output_path):
+    """Write ``buffer`` to ``output_path`` atomically; returns the bytes written.
+
+    The bytes go to a temporary file next to the output, which is then renamed
+    over it, so readers (and a crashed run) never leave a partial image behind.
+    """
+    directory, name = os.path.split(output_path)
+    temp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    data = buffer.getbuffer()
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return len(data)
+
+
+def buffer_dimensions(buffer):
+    # Reads only the header; the PNG search may have scaled below the resized size
+    with Image.open(io.BytesIO(buffer.getbuffer())) as encoded:
+        return encoded.size
+
+
+def verify_buffer(buffer):
+    # Parse the encoded bytes again without decoding the pixels; raises on a broken stream
+    with Image.open(io.BytesIO(buffer.getbuffer())) as test_image:
+        test_image.verify()
+
+
+def search_quality(image, max_size, search="bisect", codec=None):
+    # Returns (quality, buffer, encodes) for the highest quality that fits max_size,
+    # or (None, None, encodes) if even the lowest quality tried is too large.
+    codec = codec or codecs.CODECS['jpeg']
+    encodes = 0
+    if search == "linear":
+        for quality in range(90, 29, -5):
+            buffer = codec.encode(image, quality)
+            encodes += 1
+            if buffer.tell() <= max_size:
+                return quality, buffer, encodes
+        return None, None, encodes
+
+    # Bisect over 1-94 (95 has already been tried for JPEG); file size grows with quality.
+    # Costly codecs stop once the window is narrower than their quality_step.
+    best_quality, best_buffer = None, None
+    low, high = 1, 94 if codec.name == 'jpeg' else 95
+    while high - low + 1 >= codec.quality_step:
+        quality = (low + high) // 2
+        buffer = codec.encode(image, quality)
+        encodes += 1
+        if buffer.tell() <= max_size:
+            best_quality, best_buffer = quality, buffer
+            low = quality + 1
+        else:
+            high = quality - 1
+    if best_quality is None and low <= high:
+        # The coarse window ended above the lowest quality; give that one a chance
+        buffer = codec.encode(image, low)
+        encodes += 1
+        if buffer.tell() <= max_size:
+            best_quality, best_buffer = low, buffer
+    return best_quality, best_buffer, encodes
+
+
+def encode_with_codec(image, codec, max_size, search="bisect", model=None, quantizer="auto", backend="auto"):
+    """Find the best ``codec`` encode of ``image`` within ``max_size``.
+
+    Returns ``(quality, buffer, encodes, samples, settings)``; ``buffer`` is None
+    when the budget cannot be met.
+    """
+    image = codec.prepare(image)
+    if codec.name == 'png':
+        buffer, encodes, settings = png.search_png(image, max_size, quantizer, backend)
+        return None, buffer, encodes, [], settings
+    if codec.lossless:
+        buffer = codec.encode(image)
+        return None, (buffer if buffer.tell() <= max_size else None), 1, [], {}
+    if codec.name == 'jpeg' and search == "predict":
+        from compressor import predict  # NumPy is only needed for this mode
+
+        quality, buffer, encodes, samples = predict.search_jpeg_quality(
+            image, max_size, model or predict.QualityModel(), codec.encode)
+        if codec.encoder is not None:
+            samples = []  # The model is calibrated on Pillow's JPEG sizes
+        return quality, buffer, encodes, samples, {}
+    if codec.name == 'jpeg':
+        # Check initial size
+        buffer = codec.encode(image, 95)
+        if buffer.tell() <= max_size:
+            return 95, buffer, 1, [], {}
+        quality, buffer, encodes = search_quality(image, max_size, search, codec)
+        return quality, buffer, encodes + 1, [], {}
+    quality, buffer, encodes = search_quality(image, max_size, codec=codec)
+    return quality, buffer, encodes, [], {}
+
+
+def budget_error(codec, max_size, search):
+    if codec.lossless:
+        return IOError(f"Could not compress {codec.format} image to {max_size} bytes")
+    min_quality = 30 if search == "linear" and codec.name == 'jpeg' else 1
+    return IOError(f"Could not compress {codec.format} image to {max_size} bytes at minimum quality {min_quality}")
+
+
+def encode_auto(image, candidates, max_size, search="bisect", model=None, quantizer="auto", backend="auto",
+                debug=False):
+    # Cost-aware format choice: stop at the first codec that fits without the budget
+    # costing much quality; otherwise keep the closest result of every codec tried
+    best = None
+    encodes = 0
+    for codec in candidates:
+        quality, buffer, codec_encodes, samples, settings = encode_with_codec(
+            image, codec, max_size, search, model, quantizer, backend)
+        encodes += codec_encodes
+        if buffer is None:
+            if debug:
+                print(f"auto: {codec.name} misses {max_size} bytes after {codec_encodes} encode(s)")
+            continue
+        score = codecs.psnr(image, buffer)
+        if debug:
+            print(f"auto: {codec.name} fits at {score:.1f} dB in {codec_encodes} encode(s)")
+        if best is None or score > best[0]:
+            best = (score, codec, quality, buffer, samples, settings)
+        if quality is None:
+            if math.isinf(score):
+                break  # lossless
+            continue
+        if quality >= codecs.AUTO_REFERENCE_QUALITY or codec is candidates[-1]:
+            break
+        # How far the budget is from a good-looking encode; a costlier codec is
+        # only worth its encode time when the cheap one falls well short
+        needed = codec.encode(codec.prepare(image), codecs.AUTO_REFERENCE_QUALITY).tell()
+        encodes += 1
+        if debug:
+            print(f"auto: {codec.name} needs {needed} bytes at quality {codecs.AUTO_REFERENCE_QUALITY}")
+        if needed <= codecs.AUTO_MARGIN * max_size:
+            break
+    if best is None:
+        return None, None, None, encodes, [], {}
+    score, codec, quality, buffer, samples, settings = best
+    return codec, quality, buffer, encodes, samples, dict(settings, psnr=round(score, 2))
+
+
+def fit_size(width, height, max_dim):
+    ratio = min(max_dim / width, max_dim / height)
+    return int(width * ratio), int(height * ratio)
+
+
+def draft_to_fit(image, max_dim):
+    # Ask the JPEG decoder for DCT scaling down to no less than the target size;
+    # a no-op for other formats and for images whose pixels are already loaded
+    if image.format == 'JPEG' and (image.width > max_dim or image.height > max_dim):
+        image.draft(None, fit_size(image.width, image.height, max_dim))
+
+
+def resize_to_fit(image, max_dim, resize="fast", backend="auto"):
+    """Downscale ``image`` so neither side exceeds ``max_dim``.
+
+    ``resize="exact"`` decodes every source pixel and runs a single LANCZOS pass.
+    ``resize="fast"`` lets the JPEG decoder scale by 1/2, 1/4 or 1/8 (DCT scaling)
+    without going below the target size, then box-reduces down to
+    FAST_REDUCING_GAP times the target before the final LANCZOS pass. The JPEG
+    shortcut only applies while ``image`` has not been loaded yet. The
+    resampling itself is ``backend``'s (see ``backends``).
+    """
+    if image.width <= max_dim and image.height <= max_dim:
+        return image
+    backend = backends.get_backend(backend)
+    if resize == "exact":
+        return backend.resize(image, fit_size(image.width, image.height, max_dim))
+
+    size = fit_size(image.width, image.height, max_dim)
+    draft_to_fit(image, max_dim)
+    if image.size == size:
+        image.load()
+        return image
+    return backend.resize(image, size, reducing_gap=FAST_REDUCING_GAP)
+
+
+def compress_image(image, output_path, max_size=DEFAULT_MAX_SIZE, max_dim=DEFAULT_MAX_DIM,
+                   search="bisect", resize="fast", model=None, quantizer="auto", output_format="keep", verify=True,
+                   timer=None, large_pixels=LARGE_IMAGE_PIXELS, backend="auto", debug=False):
+    """Compress ``image`` to at most ``max_size`` bytes at ``output_path``.
+
+    ``search`` picks how JPEG quality is found: "bisect" (default), "linear"
+    (the original 95..30 sweep) or "predict", which starts from the quality a
+    ``predict.QualityModel`` (``model``, or an uncalibrated one) expects to fit.
+    PNG outputs go through ``png.search_png``; ``quantizer`` picks its palette
+    quantiser ("auto" prefers libimagequant when Pillow has it).
+
+    ``output_format`` is "keep" (PNG stays PNG, anything else becomes JPEG), a
+    codec name from ``codecs.CODECS`` or "auto", which picks the codec that gets
+    closest to the source within the budget. The result path's extension
+    follows the codec, so it can differ from ``output_path``'s. The chosen
+    buffer is written once, atomically; ``verify`` re-parses it in memory first.
+    Pass a ``metrics.StageTimer`` as ``timer`` to record per-stage timings.
+
+    Sources over ``large_pixels`` pixels are downscaled without being decoded
+    whole (see ``strips``), which always gives the "fast" resize. ``backend``
+    names what resizes, quantises and encodes (see ``backends``); "auto" is
+    Pillow.
+    """
+    timer = timer or NULL_TIMER
+    try:
+        image, saved_format = decode_and_resize(image, max_dim, resize, timer, large_pixels, backend)
+        return encode_and_write(image, output_path, saved_format, max_size, search, model, quantizer,
+                                output_format, verify, timer, backend, debug)
+
+    except (PermissionError, OSError) as e:
+        raise IOError(f"Error saving image to {output_path}: {str(e)}")
+
+
+def decode_and_resize(image, max_dim, resize="fast", timer=None, large_pixels=LARGE_IMAGE_PIXELS, backend="auto"):
+    # Returns the image scaled to fit max_dim and the format a "keep" output is saved as.
+    # Sources over large_pixels are never decoded whole, whatever ``resize`` says: JPEGs
+    # are decoded at reduced scale and other formats a strip at a time where strips.py can.
+    timer = timer or NULL_TIMER
+    # Determine the format to save as (before resizing, which drops image.format)
+    saved_format = image.format if image.format in ['JPEG', 'PNG'] else 'JPEG'
+    # Opened sources in other formats (TIFF, WebP, ...) are encoded from RGB
+    to_rgb = image.format is not None and image.format not in KEPT_FORMATS
+    large = bool(getattr(image, 'tile', None)) and image.width * image.height > large_pixels
+    if large and image.format != 'JPEG' and (image.width > max_dim or image.height > max_dim):
+        reduced = strips.reduce_in_strips(image, fit_size(image.width, image.height, max_dim), FAST_REDUCING_GAP,
+                                          timer, 'RGB' if to_rgb else None)
+        if reduced is not None:
+            return reduced, saved_format
+
+    with timer.stage('decode'):
+        if resize != "exact" or large:
+            draft_to_fit(image, max_dim)
+        image.load()
+        if to_rgb:
+            converted = image.convert('RGB')
+            image.close()  # Release the source file and decoded pixels right away
+            image = converted
+
+    # Pre-resize the image to a maximum dimension of max_dim pixels
+    with timer.stage('resize'):
+        image = resize_to_fit(image, max_dim, "fast" if large else resize, backend)
+    return image, saved_format
+
+
+def encode_image(image, saved_format, max_size, search="bisect", model=None, quantizer="auto", output_format="keep",
+                 timer=None, backend="auto", debug=False):
+    # Returns (codec, quality, buffer, encodes, samples, settings) for the output that fits max_size
+    timer = timer or NULL_TIMER
+    backend = backends.get_backend(backend)
+    with timer.stage('encode'):
+        if output_format == "auto":
+            candidates = [backend.bind(codec) for codec in codecs.auto_candidates(image, max_size, saved_format)]
+            codec, final_quality, buffer, encodes, samples, settings = encode_auto(
+                image, candidates, max_size, search, model, quantizer, backend.name, debug)
+            if buffer is None:
+                raise IOError(f"Could not compress image to {max_size} bytes in any format")
+        else:
+            codec = codecs.keep_codec(saved_format) if output_format == "keep" else codecs.get_codec(output_format)
+            codec = backend.bind(codec)
+            final_quality, buffer, encodes, samples, settings = encode_with_codec(
+                image, codec, max_size, search, model, quantizer, backend.name)
+            if buffer is None:
+                raise budget_error(codec, max_size, search)
+        if output_format != "keep":
+            settings = dict(settings, codec=codec.name)
+        if backend.name != 'pillow':
+            settings = dict(settings, backend=backend.name)
+    return codec, final_quality, buffer, encodes, samples, settings
+
+
+def encode_and_write(image, output_path, saved_format, max_size, search="bisect", model=None, quantizer="auto",
+                     output_format="keep", verify=True, timer=None, backend="auto", debug=False):
+    # The encode, verify and write half of compress_image, for an already resized image
+    timer = timer or NULL_TIMER
+    output_path = os.path.abspath(output_path)  # Ensure absolute path
+    output_dir = os.path.dirname(output_path)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+
+    if debug:
+        print(f"Attempting to save to: {output_path}")
+
+    codec, final_quality, buffer, encodes, samples, settings = encode_image(
+        image, saved_format, max_size, search, model, quantizer, output_format, timer, backend, debug)
+
+    # The reserved path carries the source-derived extension; follow the codec chosen
+    root, ext = os.path.splitext(output_path)
+    if not codec.owns(ext):
+        output_path = root + codec.extension
+
+    # Validate the encoded bytes before they reach the disk
+    if verify:
+        with timer.stage('verify'):
+            try:
+                verify_buffer(buffer)
+            except Exception as e:
+                raise IOError(f"Encoded image is corrupted: {output_path}, Error: {str(e)}")
+
+    with timer.stage('write'):
+        compressed_size = write_buffer(buffer, output_path)
+    final_path = output_path
+    width, height = buffer_dimensions(buffer)
+    digest = hashlib.sha256(buffer.getbuffer()).hexdigest()
+
+    if debug:
+        print(f"Encoded {os.path.basename(final_path)} in {encodes} encode(s)"
+              + (f" with {settings}" if settings else ""))
+
+    return CompressionResult(final_path, compressed_size, final_quality, encodes, samples=samples,
+                             settings=settings, timings=dict(timer.stages), width=width, height=height,
+                             digest=digest)
+
+
+def compress_to_bytes(image, max_size=DEFAULT_MAX_SIZE, max_dim=DEFAULT_MAX_DIM, search="bisect", resize="fast",
+                      model=None, quantizer="auto", output_format="keep", verify=True, timer=None,
+                      large_pixels=LARGE_IMAGE_PIXELS, backend="auto", debug=False):
+    """Like compress_image, but returns ``(result, data)`` instead of writing a file.
+
+    ``result.path`` is None and ``result.settings["codec"]`` names the codec
+    ``data`` is encoded with.
+    """
+    timer = timer or NULL_TIMER
+    image, saved_format = decode_and_resize(image, max_dim, resize, timer, large_pixels, backend)
+    codec, final_quality, buffer, encodes, samples, settings = encode_image(
+        image, saved_format, max_size, search, model, quantizer, output_format, timer, backend, debug)
+    if verify:
+        with timer.stage('verify'):
+            try:
+                verify_buffer(buffer)
+            except Exception as e:
+                raise IOError(f"Encoded image is corrupted: {str(e)}")
+    data = buffer.getvalue()
+    width, height = buffer_dimensions(buffer)
+    return CompressionResult(None, len(data), final_quality, encodes, samples=samples,
+                             settings=dict(settings, codec=codec.name), timings=dict(timer.stages), width=width,
+                             height=height, digest=hashlib.sha256(data).hexdigest()), data
+
+
+def manifest_entry(result):
+    """The variants behind ``result`` as JSON-ready dicts, for a srcset manifest."""
+    return [{'path': variant.path, 'file': os.path.basename(variant.path), 'width': variant.width,
+             'height': variant.height, 'bytes': variant.size, 'quality': variant.quality,
+             'format': os.path.splitext(variant.path)[1][1:].lower()}
+            for variant in result.variants or [result]]
+
+
+def largest_variant(variants):
+    # Index of the variant with the largest max_dim, whose result stands for the set
+    return max(range(len(variants)), key=lambda i: variants[i].max_dim)
+
+
+def variant_set(results, variants, **changes):
+    """A copy of the largest variant's result that stands for the whole set.
+
+    ``variants`` on it lists every result in variant order and ``encodes``
+    counts the encodes of all of them; calibration samples stay on the
+    individual results.
+    """
+    return replace(results[largest_variant(variants)], variants=results, samples=[],
+                   encodes=sum(result.encodes for result in results), **changes)
+
+
+def compress_variants(image, output_paths, variants, search="bisect", resize="fast", model=None,
+                      quantizer="auto", verify=True, workers=None, timer=None, large_pixels=LARGE_IMAGE_PIXELS,
+                      backend="auto", debug=False):
+    """Compress one decode of ``image`` into several ``Variant`` renditions.
+
+    ``output_paths`` holds one path per variant. Variants are resized largest
+    first, each from the previous resize rather than from the source, and then
+    encoded on up to ``workers`` threads (Pillow releases the GIL while
+    encoding). Returns a ``variant_set`` of the results.
+    """
+    timer = timer or NULL_TIMER
+    if len(output_paths) != len(variants):
+        raise ValueError("Number of output paths and variants must match")
+    order = sorted(range(len(variants)), key=lambda i: variants[i].max_dim, reverse=True)
+    image, saved_format = decode_and_resize(image, variants[order[0]].max_dim, resize, timer, large_pixels, backend)
+
+    resized = {}
+    with timer.stage('resize'):
+        for i in order:
+            previous = image
+            image = resize_to_fit(image, variants[i].max_dim, resize, backend)
+            # Threads must not save the same Image object concurrently
+            resized[i] = image.copy() if image is previous and resized else image
+
+    def encode(i):
+        variant = variants[i]
+        variant_timer = StageTimer() if timer.enabled else NULL_TIMER
+        try:
+            result = encode_and_write(resized[i], output_paths[i], saved_format, variant.max_size, search, model,
+                                      quantizer, variant.output_format, verify, variant_timer, backend, debug)
+        except (PermissionError, OSError) as e:
+            raise IOError(f"Error saving {variant.max_dim}px variant to {output_paths[i]}: {str(e)}")
+        return result, variant_timer
+
+    workers = max(min(workers or os.cpu_count() or 1, len(variants)), 1)
+    if workers == 1:
+        outcomes = [encode(i) for i in range(len(variants))]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(encode, range(len(variants))))
+
+    results = [result for result, variant_timer in outcomes]
+    for result, variant_timer in outcomes:
+        timer.merge(variant_timer)
+    return variant_set(results, variants, timings=dict(timer.stages))
+
+
+def sanitize_name(name, index):
+    name = re.sub(r'[<>:"/\\|?*]', '', name or '')
+    return name or f"image_{index}"
+
+
+def output_extension(image_format, output_format="keep"):
+    if output_format in ("keep", "auto"):
+        return codecs.keep_codec(image_format).extension  # compress_image switches it for auto
+    return codecs.get_codec(output_format).extension
+
+
+class OutputNamer:
+    """Hands out unique ``<name>_compressed[_N].<ext>`` paths inside an output folder.
+
+    With ``output_format="auto"`` the extension is only known after encoding, so
+    the name is reserved for every extension an auto output may take.
+    """
+
+    def __init__(self, output_folder, output_format="keep"):
+        self.output_folder = output_folder
+        self.output_format = output_format
+        self.used_filenames = set()
+
+    def extensions(self, image_format, output_format):
+        ext = output_extension(image_format, output_format)
+        return ext, (codecs.auto_extensions() if output_format == "auto" else [ext])
+
+    def claim(self, base_name, outputs):
+        # outputs: (suffix, extension, every extension to hold) per file; returns one path per output
+        stem = f"{base_name}_compressed"
+        counter = 1
+        while any(f"{stem}{suffix}{other}".lower() in self.used_filenames
+                  or os.path.exists(os.path.join(self.output_folder, f"{stem}{suffix}{other}"))
+                  for suffix, ext, held in outputs for other in held):
+            stem = f"{base_name}_compressed_{counter}"
+            counter += 1
+        for suffix, ext, held in outputs:
+            self.used_filenames.update(f"{stem}{suffix}{other}".lower() for other in held)
+        return [os.path.join(self.output_folder, f"{stem}{suffix}{ext}") for suffix, ext, held in outputs]
+
+    def hold(self, paths):
+        # Mark paths reused from an earlier run as taken, under every extension they may get
+        for path in paths:
+            stem, ext = os.path.splitext(os.path.basename(path))
+            self.used_filenames.update(f"{stem}{other}".lower() for other in [ext] + codecs.auto_extensions())
+
+    def reserve(self, name, index, image_format):
+        ext, held = self.extensions(image_format, self.output_format)
+        return self.claim(sanitize_name(name, index), [("", ext, held)])[0]
+
+    def reserve_variants(self, name, index, image_format, variants):
+        """One ``<name>_compressed_<max_dim>w.<ext>`` path per Variant, sharing a stem."""
+        outputs = [(f"_{variant.max_dim}w",) + self.extensions(image_format, variant.output_format)
+                   for variant in variants]
+        return self.claim(sanitize_name(name, index), outputs)
+
+
+def ensure_output_folder(output_folder):
+    output_folder = os.path.abspath(output_folder)
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder, exist_ok=True)
+    if not os.access(output_folder, os.W_OK):
+        raise IOError(f"Output folder {output_folder} is not writable")
+    return output_folder
+
+
+def allow_pixels(max_pixels):
+    """Raise Pillow's process-wide Image.MAX_IMAGE_PIXELS to ``max_pixels`` if it is lower.
+
+    Never lowers it, so a limit the application set stays. ``open_image`` calls
+    this for the limit it is given; the CLI calls it once at start-up.
+    """
+    if max_pixels and Image.MAX_IMAGE_PIXELS is not None and Image.MAX_IMAGE_PIXELS < max_pixels:
+        Image.MAX_IMAGE_PIXELS = max_pixels
+
+
+def open_image(fp, max_pixels=MAX_IMAGE_PIXELS):
+    # Still lazy: decode_and_resize may read it in strips
+    allow_pixels(max_pixels)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            image = Image.open(fp)
+    except Image.DecompressionBombError as e:
+        raise UnsupportedImageError(str(e))
+    if max_pixels and image.width * image.height > max_pixels:
+        image.close()
+        raise UnsupportedImageError(f"{image.width}x{image.height} pixels is over the limit of {max_pixels}")
+    return image
+
+
+def load_local_image(file_path, max_pixels=MAX_IMAGE_PIXELS):
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        raise UnsupportedImageError(f"Skipping {file_path}: Unsupported file format")
+    return open_image(file_path, max_pixels)
+
+
+class BufferReader(io.RawIOBase):
+    """A seekable read-only file over a bytearray or memoryview.
+
+    ``io.BytesIO`` copies anything but ``bytes`` before reading it; this reads
+    the buffer in place, so a streamed download is decoded without a second copy.
+    """
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer).cast('B')
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, target):
+        count = max(min(len(target), len(self.view) - self.position), 0)
+        target[:count] = self.view[self.position:self.position + count]
+        self.position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: len(self.view)}[whence]
+        self.position = max(base + offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+
+def encoded_file(data):
+    # A file object over encoded image bytes, without copying them
+    return io.BytesIO(data) if isinstance(data, bytes) else BufferReader(data)
+
+
+def fetch_image_bytes(url, session=None, timeout=None, debug=False):
+    from compressor import fetch  # Only pays for importing requests when something is downloaded
+
+    return fetch.get_image_bytes(url, session, timeout or fetch.DOWNLOAD_TIMEOUT, debug)
+
+
+def download_image(url, session=None, timeout=None, debug=False, max_pixels=MAX_IMAGE_PIXELS):
+    return open_image(encoded_file(fetch_image_bytes(url, session, timeout, debug)), max_pixels)
+
+
+def open_source(source, max_pixels=MAX_IMAGE_PIXELS):
+    """Open a job source: a file path, encoded image bytes or an already opened image.
+
+    A source may also be an exception recording a load that already failed
+    (e.g. a download); it is raised here so it becomes that job's error.
+    Sources over ``max_pixels`` raise UnsupportedImageError.
+    """
+    if isinstance(source, Exception):
+        raise source
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return open_image(encoded_file(source), max_pixels)
+    return load_local_image(source, max_pixels)
+
+
+def read_source_bytes(source):
+    # Encoded bytes of a path or bytes source; None for opened images and failed loads
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return source
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return f.read()
+    return None
+
+
+def source_format(source, max_pixels=MAX_IMAGE_PIXELS):
+    # Only reads the header, so output names can be reserved before the decode happens elsewhere
+    if isinstance(source, Exception):
+        raise source
+    if isinstance(source, Image.Image):
+        return source.format
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        handle = encoded_file(source)
+    else:
+        if os.path.splitext(source)[1].lower() not in SUPPORTED_EXTENSIONS:
+            raise UnsupportedImageError(f"Skipping {source}: Unsupported file format")
+        handle = source
+    with open_image(handle, max_pixels) as image:
+        return image.format if image.format in KEPT_FORMATS else None
+
+
+def process_images(images, names, output_folder, max_size=DEFAULT_MAX_SIZE, max_dim=DEFAULT_MAX_DIM,
+                   search="bisect", resize="fast", output_format="keep", variants=None, workers=1, progress=None,
+                   debug=False, **options):
+    """Compress already opened ``images`` into ``output_folder``; returns one ItemResult per image, in order.
+
+    A thin wrapper over ``parallel.iter_compress_jobs`` (on threads, as the
+    images are already in memory), which takes further ``options`` and is
+    the better fit for new code: it streams, so it never needs every image
+    open at once.
+    """
+    from compressor import parallel  # parallel imports this module
+
+    if len(images) != len(names):
+        raise ValueError("Number of images and names must match")
+    return list(parallel.iter_compress_jobs(list(zip(images, names)), output_folder, workers=workers,
+                                            executor="thread", progress=progress, max_size=max_size,
+                                            max_dim=max_dim, search=search, resize=resize,
+                                            output_format=output_format, variants=variants, debug=debug,
+                                            **options))
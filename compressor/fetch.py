@@ -0,0 +1,287 @@
+"""Concurrent URL downloads with pooled connections, per-host limits and retries.
+
+Downloads run on a thread pool and share one ``requests.Session``, so repeated
+requests to the same host reuse keep-alive connections. ``Downloader.iter_fetch``
+yields results in input order while later URLs keep downloading, which lets the
+compressor start on the first image before the last one has arrived.
+
+Bodies are streamed. A download is refused as soon as its Content-Length, or
+the bytes received so far, pass ``max_bytes``. It is also refused once the
+image header in the first chunks shows a format Pillow cannot read or more
+than ``max_pixels`` pixels, so a mislabelled or huge URL costs one chunk
+instead of its whole body.
+"""
+import io
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+from compressor import engine
+
+DOWNLOAD_TIMEOUT = 10
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+SNIFF_LIMIT = 1024 * 1024  # give up on finding the image header after this many bytes
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRY_AFTER = 30  # seconds; cap for servers that ask for very long waits
+
+REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36',
+    'Accept': 'image/jpeg,image/png,image/webp,image/*,*/*;q=0.8'
+}
+FALLBACK_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Safari/605.1.15',
+    'Accept': 'image/*,*/*;q=0.8'
+}
+
+
+class DownloadError(IOError):
+    """A URL could not be downloaded; ``retryable`` marks transient failures."""
+
+    def __init__(self, message, retryable=False, retry_after=None, bytes_saved=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.bytes_saved = bytes_saved  # set when the body was refused before it was read in full
+
+
+class NotAnImageError(DownloadError):
+    """The server answered, but not with an image."""
+
+
+class TooLargeError(DownloadError):
+    """The image is over the byte or pixel limit."""
+
+
+def retry_after_seconds(response):
+    value = response.headers.get('Retry-After')
+    if value and value.strip().isdigit():
+        return min(int(value), MAX_RETRY_AFTER)
+    return None
+
+
+def sniff_header(data, max_pixels=engine.MAX_IMAGE_PIXELS):
+    """``(format, (width, height))`` from the start of an image, or None if more bytes are needed.
+
+    Raises TooLargeError for more than ``max_pixels`` pixels.
+    """
+    engine.allow_pixels(max_pixels)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(io.BytesIO(data)) as image:
+                header = image.format, image.size
+    except Image.DecompressionBombError as e:
+        raise TooLargeError(str(e))
+    except Exception:
+        return None  # Not an image, or its header is not complete yet
+    width, height = header[1]
+    if max_pixels and width * height > max_pixels:
+        raise TooLargeError(f"{width}x{height} pixels, over the limit of {max_pixels}")
+    return header
+
+
+def looks_like_text(prefix):
+    # HTML error pages and JSON served as image/*, the usual mislabelled bodies
+    return prefix.lstrip()[:1] in (b'<', b'{')
+
+
+def read_image_body(response, url, max_bytes=DEFAULT_MAX_BYTES, max_pixels=engine.MAX_IMAGE_PIXELS):
+    # Streams the body of ``response`` into one buffer, checking size and header as it arrives
+    length = response.headers.get('Content-Length', '')
+    length = int(length) if length.isdigit() and not response.headers.get('Content-Encoding') else None
+    if length is not None and length > max_bytes:
+        raise TooLargeError(f"Error: {url} is {length} bytes, over the limit of {max_bytes}", bytes_saved=length)
+    # With a known length the buffer is allocated once; the decoder reads it in place (engine.open_source)
+    data = bytearray(length) if length is not None else bytearray()
+    received = 0
+    header = None
+
+    def refuse(error_class, message):
+        saved = length - received if length is not None else 0
+        return error_class(message, bytes_saved=saved)
+
+    for chunk in response.iter_content(CHUNK_SIZE):
+        if received + len(chunk) > max_bytes or (length is not None and received + len(chunk) > length):
+            raise refuse(TooLargeError, f"Error: {url} is over the limit of {max_bytes} bytes")
+        if length is not None:
+            data[received:received + len(chunk)] = chunk
+        else:
+            data += chunk
+        received += len(chunk)
+        if header is None and received <= SNIFF_LIMIT + CHUNK_SIZE:
+            try:
+                header = sniff_header(bytes(memoryview(data)[:received]), max_pixels)
+            except TooLargeError as e:
+                raise refuse(TooLargeError, f"Error: {url} is {e}")  # Before the pixels are downloaded
+            if header is None and (received >= min(SNIFF_LIMIT, length or SNIFF_LIMIT)
+                                   or looks_like_text(bytes(data[:64]))):
+                raise refuse(NotAnImageError, f"Error: {url} is not an image")
+    if received != len(data):
+        raise DownloadError(f"Error downloading {url}: body ended after {received} of {length} bytes",
+                            retryable=True)
+    if header is None:
+        raise NotAnImageError(f"Error: {url} is not an image")
+    return data
+
+
+def get_image_bytes(url, session=None, timeout=DOWNLOAD_TIMEOUT, debug=False, max_bytes=DEFAULT_MAX_BYTES,
+                    max_pixels=engine.MAX_IMAGE_PIXELS):
+    """Download ``url`` once (plus the 406 fallback-header retry) and return the body.
+
+    The body is a bytearray; see ``read_image_body`` for the limits applied while it streams.
+    """
+    http = session or requests
+    try:
+        response = http.get(url, headers=REQUEST_HEADERS, timeout=timeout, stream=True)
+        if response.status_code == 406:
+            if debug:
+                print(f"406 Error for {url}, retrying with fallback headers: {response.text[:100]}...")
+            response.close()
+            response = http.get(url, headers=FALLBACK_HEADERS, timeout=timeout, stream=True)
+        with response:
+            response.raise_for_status()
+            content_type = response.headers.get('content-type', '')
+            if not content_type.startswith('image/'):
+                if debug:
+                    print(f"Invalid content-type: {content_type}")
+                length = response.headers.get('Content-Length', '')
+                raise NotAnImageError(f"Error: {url} is not an image",
+                                      bytes_saved=int(length) if length.isdigit() else 0)
+            return read_image_body(response, url, max_bytes, max_pixels)
+    except requests.HTTPError as e:
+        status = e.response.status_code
+        if debug:
+            print(f"HTTP Error: {str(e)}, Response: {e.response.text[:100]}...")
+        if status in RETRY_STATUSES:
+            raise DownloadError(f"Error downloading {url}: HTTP {status}", retryable=True,
+                                retry_after=retry_after_seconds(e.response))
+        raise DownloadError(f"Error: {status} Client Error for {url}. Server may block automated requests.")
+    except (requests.ConnectionError, requests.Timeout) as e:
+        raise DownloadError(f"Error downloading {url}: {str(e)}", retryable=True)
+    except requests.RequestException as e:
+        raise DownloadError(f"Error downloading {url}: {str(e)}")
+
+
+class Downloader:
+    """Thread-pooled downloader; use as a context manager or call ``close()``.
+
+    ``concurrency`` bounds downloads in flight overall and ``per_host`` bounds
+    them per host. Transient failures (connection errors, timeouts, 429 and 5xx)
+    are retried up to ``retries`` times, waiting ``backoff * 2**attempt`` seconds
+    or the server's Retry-After, whichever is longer. Bodies over ``max_bytes``
+    and images over ``max_pixels`` are refused while they stream; ``stats()``
+    counts them and the bytes that were not downloaded because of it.
+    """
+
+    def __init__(self, concurrency=8, per_host=4, timeout=DOWNLOAD_TIMEOUT, retries=3, backoff=0.5,
+                 max_bytes=DEFAULT_MAX_BYTES, max_pixels=engine.MAX_IMAGE_PIXELS, debug=False):
+        self.concurrency = max(concurrency, 1)
+        self.per_host = max(per_host, 1)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.debug = debug
+        self.counts = {'downloads': 0, 'bytes': 0, 'rejected': 0, 'bytes_saved': 0}
+        self.counts_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.per_host)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="download")
+        self.host_limits = {}
+        self.host_limits_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.session.close()
+
+    def host_limit(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self.host_limits_lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_limits[host]
+
+    def count(self, **increments):
+        with self.counts_lock:
+            for name, value in increments.items():
+                self.counts[name] += value
+
+    def stats(self):
+        """Downloads, bytes downloaded, early rejections and the bytes those saved."""
+        with self.counts_lock:
+            return dict(self.counts)
+
+    def fetch(self, url):
+        """Download one URL with retries; raises DownloadError."""
+        attempt = 0
+        while True:
+            with self.host_limit(url):
+                try:
+                    data = get_image_bytes(url, self.session, self.timeout, self.debug, self.max_bytes,
+                                           self.max_pixels)
+                    self.count(downloads=1, bytes=len(data))
+                    return data
+                except DownloadError as e:
+                    if e.bytes_saved is not None:
+                        self.count(rejected=1, bytes_saved=e.bytes_saved)
+                    if not e.retryable or attempt >= self.retries:
+                        raise
+                    delay = max(self.backoff * 2 ** attempt, e.retry_after or 0)
+            # Sleep outside the host slot so other downloads from the host can proceed
+            if self.debug:
+                print(f"Retrying {url} in {delay:.2f}s (attempt {attempt + 2} of {self.retries + 1})")
+            time.sleep(delay)
+            attempt += 1
+
+    def timed_fetch(self, url):
+        # Returns (bytes_or_exception, seconds), the time including retries and backoff
+        start = time.perf_counter()
+        try:
+            outcome = self.fetch(url)
+        except Exception as e:
+            outcome = e
+        return outcome, time.perf_counter() - start
+
+    def iter_fetch(self, urls, window=None, timed=False):
+        """Yield ``(url, bytes_or_exception)`` for each URL, in input order.
+
+        Up to ``window`` (default: twice ``concurrency``) downloads are started
+        ahead of the one being yielded. With ``timed`` each tuple also carries the
+        seconds the download took.
+        """
+        window = max(window or self.concurrency * 2, 1)
+        pending = []
+        url_iter = iter(urls)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < window:
+                try:
+                    url = next(url_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.append((url, self.executor.submit(self.timed_fetch, url)))
+            if not pending:
+                return
+            url, future = pending.pop(0)
+            try:
+                outcome, seconds = future.result()
+            except Exception as e:
+                outcome, seconds = e, None
+            yield (url, outcome, seconds) if timed else (url, outcome)
@@ -0,0 +1,155 @@
+"""Persistent per-input record of a batch, so an interrupted run can be resumed.
+
+Each input (a file path or URL) gets one row: its status, the output path(s)
+reserved for it, the SHA-256 of the output (and, for the folder watcher, of
+the source it was made from), attempts, the last error and the stage
+timings. A row is written "pending" with its output path before the input is
+compressed and updated once it finishes, so a resumed run overwrites the
+outputs of interrupted items instead of piling up ``_compressed_1`` copies.
+The database is SQLite in WAL mode; each update is one short transaction,
+safe with several processes sharing the journal.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_MAX_ATTEMPTS = 3
+JOURNAL_NAME = '.compressor-journal.sqlite3'  # default location inside the output folder
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    key TEXT PRIMARY KEY,
+    name TEXT,
+    stamp TEXT,
+    status TEXT NOT NULL,
+    target TEXT,
+    digest TEXT,
+    size INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    timings TEXT,
+    updated REAL NOT NULL,
+    source_digest TEXT
+);
+"""
+COLUMNS = {'source_digest': 'TEXT'}  # added since the first schema; ALTERed into older journals
+
+
+def source_stamp(key):
+    # Size and mtime of a local input, so a file edited since it was compressed is redone
+    try:
+        stat = os.stat(key)
+    except (OSError, ValueError):
+        return None
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class JobJournal:
+    """Job journal at ``path``; inputs that failed ``max_attempts`` times are not retried.
+
+    Safe to pickle: each process opens its own SQLite connection on first use.
+    """
+
+    def __init__(self, path, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = os.path.abspath(path)
+        self.max_attempts = max_attempts
+        self._conn = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['_pid'] = None
+        return state
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            existing = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for column, kind in COLUMNS.items():
+                if column not in existing:
+                    try:
+                        conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {kind}')
+                    except sqlite3.OperationalError:
+                        pass  # Another process added it first
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def skip_reason(self, key):
+        """"done" or "gave up" if a resumed run should leave ``key`` alone, else None."""
+        row = self.conn.execute('SELECT status, stamp, attempts FROM jobs WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        status, stamp, attempts = row
+        if stamp != source_stamp(key):
+            return None  # Changed since: a new input as far as retries go
+        if status == 'done':
+            return 'done'
+        if status == 'failed' and attempts >= self.max_attempts:
+            return 'gave up'
+        return None
+
+    def target(self, key):
+        """The output path (or variant paths) an earlier run used for ``key``, if any."""
+        row = self.conn.execute('SELECT target FROM jobs WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def source_digest(self, key):
+        """The source SHA-256 ``finish`` recorded for the last successful compression of ``key``, if any."""
+        row = self.conn.execute("SELECT source_digest FROM jobs WHERE key = ? AND status = 'done'", (key,)).fetchone()
+        return row[0] if row else None
+
+    def start(self, key, name, target):
+        # A changed input starts its attempt count over
+        self.conn.execute("INSERT INTO jobs (key, name, stamp, status, target, updated) "
+                          "VALUES (?, ?, ?, 'pending', ?, ?) "
+                          "ON CONFLICT(key) DO UPDATE SET name = excluded.name, stamp = excluded.stamp, "
+                          "status = 'pending', target = excluded.target, updated = excluded.updated, "
+                          "attempts = CASE WHEN stamp IS excluded.stamp THEN attempts ELSE 0 END",
+                          (key, name, source_stamp(key), json.dumps(target), time.time()))
+
+    def finish(self, key, item, source_digest=None):
+        """Record the outcome of ``item`` (an engine.ItemResult) for ``key``.
+
+        ``source_digest`` is the SHA-256 of the source it was compressed from, if the caller hashed it.
+        """
+        result = item.result
+        if item.ok:
+            digest = result.digest or file_digest(result.path)  # Cache restores carry no digest
+            # The written paths, whose extensions may differ from the reserved ones
+            target = [variant.path for variant in result.variants] if result.variants else result.path
+            values = ('done', json.dumps(target), digest, result.size, None, json.dumps(result.timings),
+                      source_digest)
+        else:
+            values = ('failed', None, None, None, item.error, None, None)
+        self.conn.execute('INSERT INTO jobs (key, name, stamp, status, target, digest, size, attempts, error, '
+                          'timings, source_digest, updated) VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?) '
+                          'ON CONFLICT(key) DO UPDATE SET status = excluded.status, '
+                          'target = COALESCE(excluded.target, target), digest = excluded.digest, '
+                          'size = excluded.size, attempts = attempts + 1, error = excluded.error, '
+                          'timings = excluded.timings, source_digest = excluded.source_digest, '
+                          'updated = excluded.updated',
+                          (key, item.name, source_stamp(key)) + values + (time.time(),))
+
+    def counts(self):
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status'))
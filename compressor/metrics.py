@@ -0,0 +1,182 @@
+"""Per-image stage timings and per-batch aggregation.
+
+``StageTimer`` records how long each stage of one image took (load, decode,
+resize, encode, write, verify, ...). When instrumentation is off the engine uses
+``NULL_TIMER``, whose ``stage()`` hands back one shared no-op context manager,
+so the cost is a method call per stage.
+
+``BatchMetrics`` collects finished ItemResults in the parent process and
+reports p50/p95/p99 per stage as JSON lines or Prometheus text exposition.
+``profiled`` wraps a batch in cProfile.
+"""
+import contextlib
+import cProfile
+import json
+import math
+import time
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class _Stage:
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        stages = self.timer.stages
+        stages[self.name] = stages.get(self.name, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+class StageTimer:
+    """Accumulates seconds per stage name; a stage entered twice adds up."""
+
+    enabled = True
+
+    def __init__(self):
+        self.stages = {}
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def merge(self, other):
+        # Adds another timer's stages, e.g. one that ran on a helper thread
+        for name, seconds in other.stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+
+class NullTimer:
+    enabled = False
+    stages = {}
+
+    _null = contextlib.nullcontext()
+
+    def stage(self, name):
+        return self._null
+
+    def merge(self, other):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def percentile(sorted_values, quantile):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(quantile * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+class BatchMetrics:
+    """Aggregates ItemResults of one batch; feed it with ``observe``."""
+
+    def __init__(self, stream=None):
+        self.stream = stream  # JSON lines are written here as items finish, if given
+        self.started = time.perf_counter()
+        self.stage_values = {}
+        self.counts = {'ok': 0, 'failed': 0, 'cached': 0}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.encodes = 0
+        self.downloads = {}  # index -> (seconds, bytes), recorded before the item finishes
+
+    def record_download(self, index, seconds, size):
+        self.downloads[index] = (seconds, size)
+
+    def observe(self, item):
+        record = {'index': item.index, 'name': item.name, 'output': item.output_path, 'ok': item.ok}
+        stages = {}
+        download = self.downloads.pop(item.index, None)
+        if download is not None:
+            stages['download'] = download[0]
+            record['bytes_downloaded'] = download[1]
+        if item.ok:
+            result = item.result
+            self.counts['ok'] += 1
+            self.counts['cached'] += result.cached
+            stages.update(result.timings)
+            self.bytes_out += result.size
+            self.bytes_in += result.bytes_in or 0
+            if not result.cached:
+                self.encodes += result.encodes  # A cache hit performs no encodes
+            record.update(bytes_in=result.bytes_in, bytes_out=result.size, encodes=result.encodes,
+                          quality=result.quality, cached=result.cached)
+        else:
+            self.counts['failed'] += 1
+            record['error'] = item.error
+        for name, seconds in stages.items():
+            self.stage_values.setdefault(name, []).append(seconds)
+        record['stages'] = {name: round(seconds, 6) for name, seconds in stages.items()}
+        if self.stream is not None:
+            self.stream.write(json.dumps(record) + '\n')
+            self.stream.flush()
+        return record
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        images = self.counts['ok'] + self.counts['failed']
+        encoded = self.counts['ok'] - self.counts['cached']
+        stages = {}
+        for name, values in self.stage_values.items():
+            values = sorted(values)
+            stages[name] = {f"p{int(q * 100)}": percentile(values, q) for q in QUANTILES}
+            stages[name].update(count=len(values), total=sum(values))
+        return {
+            'type': 'summary', 'images': images, **self.counts, 'seconds': elapsed,
+            'images_per_second': images / elapsed if elapsed else None,
+            'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+            'encodes_per_image': self.encodes / encoded if encoded else None,
+            'stages': stages,
+        }
+
+    def write_summary(self, stream):
+        stream.write(json.dumps(self.summary()) + '\n')
+
+    def prometheus_text(self, prefix='image_compressor'):
+        """The batch as Prometheus text exposition (summaries and counters)."""
+        lines = [f"# HELP {prefix}_stage_seconds Time spent per image in each stage.",
+                 f"# TYPE {prefix}_stage_seconds summary"]
+        for name, values in sorted(self.stage_values.items()):
+            values = sorted(values)
+            for q in QUANTILES:
+                lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="{q}"}} {percentile(values, q):.6f}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {sum(values):.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {len(values)}')
+        lines += [f"# HELP {prefix}_images_total Images processed by outcome.",
+                  f"# TYPE {prefix}_images_total counter"]
+        for status, count in self.counts.items():
+            lines.append(f'{prefix}_images_total{{status="{status}"}} {count}')
+        for name, value, help_text in (('bytes_in', self.bytes_in, 'Source bytes of compressed images.'),
+                                       ('bytes_out', self.bytes_out, 'Output bytes written.'),
+                                       ('encodes', self.encodes, 'Full-size encodes performed.')):
+            lines += [f"# HELP {prefix}_{name}_total {help_text}", f"# TYPE {prefix}_{name}_total counter",
+                      f"{prefix}_{name}_total {value}"]
+        return '\n'.join(lines) + '\n'
+
+
+@contextlib.contextmanager
+def profiled(path=None):
+    """cProfile everything in the block and dump stats to ``path`` (no-op if None).
+
+    Only the calling process is profiled; with a process pool that is the
+    scheduling and download side, so profile with one worker to see encoding.
+    """
+    if not path:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
@@ -0,0 +1,260 @@
+"""Fan compression jobs out to a pool of worker processes.
+
+A job is a ``(source, name)`` pair where ``source`` is anything
+``engine.open_source`` accepts. File paths and encoded bytes are cheap to send
+to a worker; opened images are pickled with their pixel data, so prefer paths.
+"""
+import dataclasses
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from compressor import engine, metrics
+from compressor.cache import cache_key
+
+
+def source_size(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return len(source)
+    if isinstance(source, str):
+        try:
+            return os.path.getsize(source)
+        except OSError:
+            return None
+    return None
+
+
+def variant_options(options):
+    # compress_variants takes the budget, size and format from each Variant
+    return {k: v for k, v in options.items() if k not in ('max_size', 'max_dim', 'output_format')}
+
+
+def cache_keys(data, options, variants):
+    if not variants:
+        return [cache_key(data, options)]
+    shared = variant_options(options)
+    return [cache_key(data, dict(shared, variant=dataclasses.asdict(variant))) for variant in variants]
+
+
+def restore_cached(cache, keys, output_path, variants):
+    # All or nothing: one missing variant means the source is compressed again
+    if not variants:
+        return cache.get(keys[0], output_path)
+    results = []
+    for key, path in zip(keys, output_path):
+        result = cache.get(key, path)
+        if result is None:
+            return None
+        results.append(result)
+    return engine.variant_set(results, variants)
+
+
+def compress_job(source, output_path, cache=None, timings=False, variants=None,
+                 max_pixels=engine.MAX_IMAGE_PIXELS, **options):
+    # Runs inside the worker; returns (result, error) so nothing has to pickle an exception.
+    # With ``timings`` the result carries per-stage seconds (see metrics.StageTimer).
+    # With ``variants`` (engine.Variant list) ``output_path`` holds one path per variant.
+    # Sources over ``max_pixels`` are refused before they are decoded.
+    timer = metrics.StageTimer() if timings else metrics.NULL_TIMER
+    try:
+        keys = None
+        if cache is not None:
+            with timer.stage('cache'):
+                data = engine.read_source_bytes(source)
+                if data is not None:
+                    keys = cache_keys(data, options, variants)
+                    result = restore_cached(cache, keys, output_path, variants)
+                else:
+                    result = None
+            if result is not None:
+                result.timings = dict(timer.stages)
+                result.bytes_in = len(data)
+                return result, None
+            if data is not None:
+                source = data  # Decode the bytes already read instead of reading the file again
+
+        bytes_in = source_size(source)
+        with timer.stage('load'):
+            image = engine.open_source(source, max_pixels)
+        try:
+            if variants:
+                result = engine.compress_variants(image, output_path, variants, timer=timer,
+                                                  **variant_options(options))
+            else:
+                result = engine.compress_image(image, output_path, timer=timer, **options)
+        finally:
+            if image is not source:
+                image.close()  # Frees the decoded pixels before the next job is loaded
+        result.bytes_in = bytes_in
+        if keys is not None:
+            with timer.stage('cache'):
+                for key, stored in zip(keys, result.variants or [result]):
+                    cache.put(key, stored)
+            result.timings = dict(timer.stages)
+        return result, None
+    except Exception as e:
+        return None, str(e)
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def reserve_target(namer, source, name, index, variants=None, previous=None, max_pixels=engine.MAX_IMAGE_PIXELS):
+    """The path (one per variant with ``variants``) a job writes to.
+
+    ``previous`` is the target an earlier run reserved for the same input; it is
+    reused when it has the shape this run needs, so reruns overwrite their outputs.
+    """
+    if variants and isinstance(previous, list) and len(previous) == len(variants):
+        namer.hold(previous)
+        return previous
+    if not variants and isinstance(previous, str):
+        namer.hold([previous])
+        return previous
+    image_format = engine.source_format(source, max_pixels)
+    if variants:
+        return namer.reserve_variants(name, index, image_format, variants)
+    return namer.reserve(name, index, image_format)
+
+
+def job_key(job):
+    # A job is (source, name) or (source, name, key); file paths are their own key
+    if len(job) > 2:
+        return job[2]
+    return job[0] if isinstance(job[0], str) else None
+
+
+def iter_compress_jobs(jobs, output_folder, workers=None, executor="process", max_in_flight=None,
+                       progress=None, total=None, journal=None, cancel=None, **options):
+    """Compress ``jobs`` and yield one ItemResult per job, in job order.
+
+    Output names are reserved in job order with the same rules as the serial path.
+    At most ``max_in_flight`` jobs (default: twice the worker count) are submitted
+    at once, so ``jobs`` may be a lazy iterable. ``progress(done, total, item)`` is
+    called as each job finishes; ``total`` defaults to ``len(jobs)`` when available.
+    Remaining keyword arguments (``max_size``, ``max_dim``, ...) go to
+    ``engine.compress_image``; pass ``cache=ResultCache(...)`` to reuse outputs
+    of identical inputs from earlier runs, and ``max_pixels`` to change the
+    largest source accepted (engine.MAX_IMAGE_PIXELS). A ``model`` (predict.QualityModel) is
+    calibrated with every finished job's encodes. With ``timings=True`` each
+    result carries per-stage seconds for ``metrics.BatchMetrics``. With
+    ``variants=[engine.Variant(...), ...]`` every source is compressed into each
+    variant from a single decode (``max_size``, ``max_dim`` and ``output_format``
+    then come from the variants); the item's result is the largest variant and
+    lists them all in ``result.variants``.
+
+    With a ``journal`` (journal.JobJournal) every job with a key (its path, or a
+    third tuple element such as the URL it was downloaded from) is recorded
+    before and after it runs, and reuses the output path an earlier run
+    reserved for it. Filtering out completed jobs is left to the caller.
+
+    Setting ``cancel`` (a threading.Event) stops the run: no further jobs are
+    taken, submitted jobs that have not started are dropped, and the items of
+    jobs already running are yielded once they finish.
+    """
+    output_folder = engine.ensure_output_folder(output_folder)
+    namer = engine.OutputNamer(output_folder, options.get("output_format", "keep"))
+    variants = options.get("variants")
+    workers = workers or default_workers()
+    max_in_flight = max(max_in_flight or workers * 2, 1)
+    if total is None and hasattr(jobs, "__len__"):
+        total = len(jobs)
+    done = 0
+    if journal is not None:
+        options["timings"] = True  # Stored with each finished job
+
+    model = options.get("model")
+    max_pixels = options.get("max_pixels", engine.MAX_IMAGE_PIXELS)
+    keys = {}  # index -> journal key of jobs in flight
+
+    def finish(item, outcome):
+        nonlocal done
+        item.result, item.error = outcome
+        key = keys.pop(item.index, None)
+        if key is not None:
+            journal.finish(key, item)
+        if item.result is not None:
+            item.output_path = item.result.path  # The extension follows the codec chosen
+        if model is not None and item.result is not None:
+            # Workers only read the model; calibration from their encodes is applied here
+            for result in item.result.variants or [item.result]:
+                model.observe(result.samples)
+        done += 1
+        if progress:
+            progress(done, total, item)
+        return item
+
+    def prepare(index, source, name, key):
+        # Returns the item and what compress_job writes to: a path, or one path per variant
+        item = engine.ItemResult(index, name)
+        target = None
+        if journal is not None and key is not None:
+            keys[index] = key
+        try:
+            previous = journal.target(key) if index in keys else None
+            target = reserve_target(namer, source, name, index, variants, previous, max_pixels)
+            item.output_path = target[engine.largest_variant(variants)] if variants else target
+            if index in keys:
+                journal.start(key, name, target)
+        except Exception as e:
+            finish(item, (None, str(e)))
+        return item, target
+
+    if workers == 1:
+        for index, job in enumerate(jobs, 1):
+            if cancel is not None and cancel.is_set():
+                return
+            item, target = prepare(index, job[0], job[1], job_key(job))
+            source = job[0]
+            if item.error is None:
+                finish(item, compress_job(source, target, **options))
+            yield item
+        return
+
+    pool_class = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+    with pool_class(max_workers=workers) as pool:
+        pending = {}  # future -> item
+        finished = {}  # index -> item, held until every earlier index has been yielded
+        next_index = 1
+        job_iter = enumerate(jobs, 1)
+        exhausted = False
+
+        while True:
+            if cancel is not None and cancel.is_set() and not exhausted:
+                exhausted = True
+                for future in [future for future in pending if future.cancel()]:
+                    del pending[future]
+
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    index, job = next(job_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                source = job[0]
+                item, target = prepare(index, source, job[1], job_key(job))
+                if item.error is None:
+                    pending[pool.submit(compress_job, source, target, **options)] = item
+                else:
+                    finished[index] = item
+
+            while next_index in finished:
+                yield finished.pop(next_index)
+                next_index += 1
+
+            if not pending:
+                if exhausted:
+                    # Only a cancelled run leaves gaps in the indexes
+                    for index in sorted(finished):
+                        yield finished.pop(index)
+                    break
+                continue
+            # With a cancel event, wake up now and then to notice it
+            completed, _ = wait(pending, timeout=0.1 if cancel is not None else None, return_when=FIRST_COMPLETED)
+            for future in completed:
+                item = pending.pop(future)
+                finished[item.index] = finish(item, future.result())
+
+
+def compress_jobs(jobs, output_folder, **kwargs):
+    return list(iter_compress_jobs(jobs, output_folder, **kwargs))
@@ -0,0 +1,193 @@
+"""Strategy search for PNG outputs that must fit a byte budget.
+
+The search tries, in order of preference: the image as-is, a palette of 256,
+128, 64 or 32 colours at full size (bisecting over the palette sizes), and
+finally a reduced scale, bisecting the scale factor. Images with at most 256
+colours (screenshots, diagrams) are scaled as an exact palette with nearest
+neighbour sampling, which keeps them flat and compressible; everything else is
+LANCZOS-resized and then quantised to SCALED_COLORS. Every trial is encoded
+with a fast zlib level; only the chosen configuration is re-encoded with
+``optimize=True`` for the final output.
+"""
+import io
+import math
+
+from PIL import Image, features
+
+from compressor import backends
+
+PALETTE_SIZES = (256, 128, 64, 32)
+SCALED_COLORS = 64
+SEARCH_LEVEL = 1  # zlib level for trial encodes
+VERIFY_MARGIN = 1.25  # trials that miss by less than this are re-checked with optimize=True
+SCALE_PRECISION = 0.02  # stop bisecting once the scale bracket is this narrow
+MAX_SCALE_STEPS = 12
+
+QUANTIZERS = {
+    'fastoctree': Image.Quantize.FASTOCTREE,
+    'mediancut': Image.Quantize.MEDIANCUT,
+    'libimagequant': Image.Quantize.LIBIMAGEQUANT,
+}
+
+
+def pick_quantizer(name="auto"):
+    # libimagequant gives the best palettes but is an optional Pillow build feature
+    if name == "auto":
+        return 'libimagequant' if features.check_feature('libimagequant') else 'fastoctree'
+    if name not in QUANTIZERS:
+        raise ValueError(f"Unknown quantizer: {name}")
+    if name == 'libimagequant' and not features.check_feature('libimagequant'):
+        raise ValueError("This Pillow build has no libimagequant support")
+    return name
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+
+
+def exact_palette(image, colors):
+    """RGB(A) ``image`` as a palette image of exactly its ``colors`` (``getcolors()``, at most 256)."""
+    if image.mode == 'RGB':
+        # MEDIANCUT keeps up to 256 colours exactly (FASTOCTREE merges close ones), but takes no alpha
+        return image.quantize(256, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+    palette = [color for count, color in colors]
+    lookup = {bytes(color): index for index, color in enumerate(palette)}
+    bands = len(image.getbands())
+    data = image.tobytes()
+    indices = bytes(map(lookup.__getitem__, (data[i:i + bands] for i in range(0, len(data), bands))))
+    result = Image.frombytes('P', image.size, indices)
+    result.putpalette([channel for color in palette for channel in color], image.mode)
+    return result
+
+
+def encode_png(image, optimize=False):
+    buffer = io.BytesIO()
+    if optimize:
+        image.save(buffer, format='PNG', optimize=True)
+    else:
+        image.save(buffer, format='PNG', compress_level=SEARCH_LEVEL)
+    return buffer
+
+
+class PngSearch:
+    """Runs the strategy search for one image; see ``search_png``."""
+
+    def __init__(self, image, max_size, quantizer="auto", backend="auto"):
+        self.image = image
+        self.max_size = max_size
+        self.backend = backends.get_backend(backend)
+        self.quantizer = pick_quantizer(quantizer)
+        self.alpha = has_alpha(image)
+        # MEDIANCUT cannot quantise an alpha channel
+        if self.alpha and self.quantizer == 'mediancut':
+            self.quantizer = 'fastoctree'
+        self.source = image.convert('RGBA' if self.alpha else 'RGB')
+        self.flat_colors = self.source.getcolors(256)
+        self.flat = self.flat_colors is not None
+        self.flat_palette = None
+        self.verified = None
+        self.encodes = 0
+        self.palette_sizes = {}  # colours -> trial size at full scale
+
+    def quantize(self, image, colors):
+        return self.backend.quantize(image, colors, QUANTIZERS[self.quantizer])
+
+    def trial(self, image):
+        self.encodes += 1
+        return encode_png(image).tell()
+
+    def fits(self, image, size):
+        # A fast-level size slightly over budget may still fit once optimized
+        if size <= self.max_size:
+            return True
+        if size > self.max_size * VERIFY_MARGIN:
+            return False
+        self.encodes += 1
+        buffer = encode_png(image, optimize=True)
+        self.verified = (image, buffer)  # reused by finish() if this candidate wins
+        return buffer.tell() <= self.max_size
+
+    def scaled(self, scale):
+        size = (max(int(self.source.width * scale), 1), max(int(self.source.height * scale), 1))
+        if self.flat:
+            if self.flat_palette is None:
+                self.flat_palette = exact_palette(self.source, self.flat_colors)
+            return self.flat_palette.resize(size, Image.NEAREST)
+        return self.quantize(self.backend.resize(self.source, size, reducing_gap=2.0), SCALED_COLORS)
+
+    def search_colors(self):
+        # Bisect over PALETTE_SIZES for the most colours that fit at full size
+        best = None
+        low, high = 0, len(PALETTE_SIZES) - 1
+        while low <= high:
+            middle = (low + high) // 2
+            candidate = self.quantize(self.source, PALETTE_SIZES[middle])
+            size = self.palette_sizes[PALETTE_SIZES[middle]] = self.trial(candidate)
+            if self.fits(candidate, size):
+                best = (candidate, PALETTE_SIZES[middle])
+                high = middle - 1
+            else:
+                low = middle + 1
+        return best
+
+    def search_scale(self, smallest_size):
+        # Bisect for the largest scale that fits; PNG size is roughly proportional
+        # to area, so the first probe is the area estimate
+        best = None
+        low, high = 0.0, 1.0
+        scale = min(math.sqrt(self.max_size / smallest_size) * 0.95, 1.0)
+        for _ in range(MAX_SCALE_STEPS):
+            candidate = self.scaled(scale)
+            if self.fits(candidate, self.trial(candidate)):
+                best = (candidate, scale)
+                low = scale
+            else:
+                high = scale
+            if high - low < SCALE_PRECISION and best is not None:
+                break
+            if candidate.width == 1 and candidate.height == 1 and best is None:
+                break
+            scale = (low + high) / 2
+        return best
+
+    def run(self):
+        if self.fits(self.image, self.trial(self.image)):
+            return self.finish(self.image, {'colors': None, 'scale': 1.0})
+
+        found = self.search_colors()
+        if found is not None:
+            candidate, colors = found
+            return self.finish(candidate, {'colors': colors, 'scale': 1.0, 'quantizer': self.quantizer})
+
+        # The colour bisection always reaches the smallest palette before giving up
+        found = self.search_scale(self.palette_sizes[PALETTE_SIZES[-1]])
+        if found is None:
+            return None, self.encodes, {}
+        candidate, scale = found
+        colors = len(self.flat_colors) if self.flat else SCALED_COLORS
+        return self.finish(candidate, {'colors': colors, 'scale': round(scale, 3),
+                                       'quantizer': self.quantizer,
+                                       'size': f"{candidate.width}x{candidate.height}"})
+
+    def finish(self, image, settings):
+        if self.verified is not None and self.verified[0] is image:
+            return self.verified[1], self.encodes, settings
+        buffer = encode_png(image, optimize=True)
+        self.encodes += 1
+        if buffer.tell() > self.max_size:
+            # optimize=True is almost always smaller than the trial level, but not guaranteed
+            buffer = encode_png(image)
+            self.encodes += 1
+            settings['optimize'] = False
+        return buffer, self.encodes, settings
+
+
+def search_png(image, max_size, quantizer="auto", backend="auto"):
+    """Find the best-looking PNG encoding of ``image`` within ``max_size`` bytes.
+
+    Returns ``(buffer, encodes, settings)``; ``buffer`` is None if even the
+    smallest scale does not fit. ``settings`` records the chosen palette size,
+    scale and quantiser. Scaling and quantising go through ``backend`` (see
+    ``backends``); the PNG encodes are always Pillow's.
+    """
+    return PngSearch(image, max_size, quantizer, backend).run()
@@ -0,0 +1,204 @@
+"""Predict the JPEG quality that meets a byte budget before any full-size encode.
+
+The model samples a grid of full-resolution, block-aligned crops from the image
+into a small mosaic and encodes that at a range of qualities (a few percent of
+the cost of one full encode). Bytes per pixel of the mosaic track the full
+image's closely; a ridge regression on cheap NumPy statistics (mosaic
+compressibility, luma entropy, edge strength, image size) learns the remaining
+log size ratio from every full encode and is persisted as JSON between runs.
+
+``search_jpeg_quality`` uses the prediction as its first guess, corrects it with
+each real encode and stops as soon as an encode fits and fills most of the
+budget, so most images need one or two full encodes.
+"""
+import io
+import json
+import math
+import os
+
+import numpy as np
+from PIL import Image
+
+CROP_GRID = 4  # CROP_GRID x CROP_GRID crops
+CROP_SIZE = 64  # a multiple of 16 keeps crops aligned with JPEG MCUs
+SAMPLE_QUALITIES = (5, 15, 25, 35, 45, 55, 65, 75, 85, 90, 95)
+REFERENCE_QUALITY = 75
+FEATURE_NAMES = ('bias', 'quality', 'quality_squared', 'sample_log_bpp', 'edge_strength', 'entropy',
+                 'log_pixels')
+# Before any calibration: the mosaic's crop seams make it slightly less compressible than the image
+PRIOR_WEIGHTS = (-0.1, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+TARGET_FILL = 0.98  # aim just under the budget so a small misprediction still fits
+ACCEPT_FILL = 0.92  # an encode that fits and fills this much of the budget ends the search
+
+
+def encoded_size(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return buffer.tell()
+
+
+def crop_mosaic(image):
+    # Full-resolution crops spread over the image, pasted side by side
+    if image.width <= CROP_SIZE * CROP_GRID and image.height <= CROP_SIZE * CROP_GRID:
+        return image
+    size = min(CROP_SIZE, image.width, image.height)
+    xs = np.linspace(0, image.width - size, CROP_GRID).astype(int) // 16 * 16
+    ys = np.linspace(0, image.height - size, CROP_GRID).astype(int) // 16 * 16
+    mosaic = Image.new(image.mode, (size * CROP_GRID, size * CROP_GRID))
+    for column, x in enumerate(xs):
+        for row, y in enumerate(ys):
+            mosaic.paste(image.crop((x, y, x + size, y + size)), (column * size, row * size))
+    return mosaic
+
+
+class ImageFeatures:
+    """Sampled size curve and statistics for one (already resized, RGB) image."""
+
+    def __init__(self, image):
+        self.pixels = image.width * image.height
+        mosaic = crop_mosaic(image)
+        mosaic_pixels = mosaic.width * mosaic.height
+        self.sample_log_bpp = np.array([math.log(encoded_size(mosaic, q) / mosaic_pixels)
+                                        for q in SAMPLE_QUALITIES])
+
+        luma = np.asarray(mosaic.convert('L'), dtype=np.float64)
+        histogram = np.bincount(luma.astype(np.uint8).ravel(), minlength=256) / luma.size
+        nonzero = histogram[histogram > 0]
+        entropy = float(-(nonzero * np.log2(nonzero)).sum()) / 8  # 0..1
+        edges = 0.0
+        if luma.shape[0] > 1 and luma.shape[1] > 1:
+            edges = float((np.abs(np.diff(luma, axis=0)).mean() + np.abs(np.diff(luma, axis=1)).mean()) / 510)
+        reference = self.sample_log_bpp[SAMPLE_QUALITIES.index(REFERENCE_QUALITY)]
+        self.static = (float(reference), edges, entropy, math.log(self.pixels) / 10)
+
+    def vector(self, quality):
+        q = quality / 100
+        return np.array((1.0, q, q * q) + self.static)
+
+    def sample_log_bpp_at(self, quality):
+        return float(np.interp(quality, SAMPLE_QUALITIES, self.sample_log_bpp))
+
+    def target(self, quality, size):
+        # What the regression learns: log of full-image bpp over mosaic bpp
+        return math.log(size / self.pixels) - self.sample_log_bpp_at(quality)
+
+
+class QualityModel:
+    """Ridge regression from ImageFeatures to log(full bpp / mosaic bpp).
+
+    Keeps only the sufficient statistics (X'X and X'y), so observing a sample
+    and saving are cheap and samples from several processes can be merged.
+    """
+
+    def __init__(self, path=None, ridge=4.0):
+        self.path = path
+        self.ridge = ridge
+        size = len(FEATURE_NAMES)
+        self.xtx = np.zeros((size, size))
+        self.xty = np.zeros(size)
+        self.samples = 0
+        self.weights = np.array(PRIOR_WEIGHTS)
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def load(self, path):
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+        if tuple(state.get('features', ())) != FEATURE_NAMES:
+            return  # Model from an incompatible version; start again from the prior
+        self.xtx = np.array(state['xtx'])
+        self.xty = np.array(state['xty'])
+        self.samples = state['samples']
+        self.refit()
+
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'features': FEATURE_NAMES, 'samples': self.samples,
+                       'xtx': self.xtx.tolist(), 'xty': self.xty.tolist()}, f)
+        os.replace(temp_path, path)
+
+    def refit(self):
+        # Shrink towards the prior rather than towards zero
+        penalty = self.ridge * np.eye(len(FEATURE_NAMES))
+        self.weights = np.linalg.solve(self.xtx + penalty, self.xty + penalty @ np.array(PRIOR_WEIGHTS))
+
+    def observe(self, samples):
+        """Add ``(feature_vector, target)`` pairs, e.g. from CompressionResult.samples."""
+        for vector, target in samples:
+            vector = np.asarray(vector)
+            self.xtx += np.outer(vector, vector)
+            self.xty += vector * target
+            self.samples += 1
+        if samples:
+            self.refit()
+
+    def predict_log_size(self, features, quality, correction=0.0):
+        log_ratio = float(self.weights @ features.vector(quality))
+        return math.log(features.pixels) + features.sample_log_bpp_at(quality) + log_ratio + correction
+
+    def predict_quality(self, features, max_size, correction=0.0, low=1, high=95):
+        """Highest quality in [low, high] predicted to fit ``max_size``; ``low`` if none does."""
+        limit = math.log(max_size * TARGET_FILL)
+        for quality in range(high, low - 1, -1):
+            if self.predict_log_size(features, quality, correction) <= limit:
+                return quality
+        return low
+
+
+def search_jpeg_quality(image, max_size, model, encode):
+    """Model-guided search for the highest quality whose encode fits ``max_size``.
+
+    ``encode(image, quality)`` returns a BytesIO. The first guess comes from the
+    model; after one encode the model is re-anchored on the real size, and once
+    there is an encode on each side of the budget the next guess interpolates
+    log size between them. The search stops early once an encode fits and fills
+    ACCEPT_FILL of the budget. Returns ``(quality, buffer, encodes, samples)`` where
+    quality and buffer are None if even quality 1 is too large, and samples are
+    calibration pairs for ``QualityModel.observe``.
+    """
+    features = ImageFeatures(image)
+    best_quality, best_buffer = None, None
+    fit_point = fail_point = None  # (quality, log size) of the closest encodes on each side
+    low, high = 1, 95  # qualities not yet ruled out
+    encodes = 0
+    samples = []
+    limit = math.log(max_size)
+
+    quality = model.predict_quality(features, max_size)
+    while True:
+        buffer = encode(image, quality)
+        encodes += 1
+        size = buffer.tell()
+        samples.append((features.vector(quality).tolist(), features.target(quality, size)))
+        if size <= max_size:
+            best_quality, best_buffer = quality, buffer
+            fit_point = (quality, math.log(size))
+            low = quality + 1
+            if size >= max_size * ACCEPT_FILL:
+                break
+        else:
+            fail_point = (quality, math.log(size))
+            high = quality - 1
+        if low > high:
+            break
+
+        if fit_point and fail_point:
+            # Interpolate log size linearly in quality between the two bracketing encodes
+            (q0, s0), (q1, s1) = fit_point, fail_point
+            crossing = q0 + (limit - s0) * (q1 - q0) / (s1 - s0) if s1 > s0 else q0
+            guess = int(math.floor(crossing))
+        else:
+            correction = math.log(size) - model.predict_log_size(features, quality)
+            guess = model.predict_quality(features, max_size, correction, low, high)
+            if best_quality is not None and guess == low and \
+                    model.predict_log_size(features, low, correction) > limit:
+                guess = best_quality
+        if best_quality is not None and guess <= best_quality:
+            break  # The estimate says the next quality up would overshoot
+        quality = min(max(guess, low), high)
+
+    return best_quality, best_buffer, encodes, samples
@@ -0,0 +1,307 @@
+"""HTTP compression service: ``python -m compressor --serve 127.0.0.1:8080``.
+
+    POST /compress?max_size=BYTES&max_dim=PX&format=webp   body: the image
+    GET  /healthz                                         JSON status
+    GET  /metrics                                         Prometheus text
+
+The response body is the compressed image, with its quality, encodes and
+dimensions in ``X-Compressor-*`` headers and per-stage times in ``Server-Timing``.
+Parameters left out use the server's defaults. Errors answer 400 (bad
+parameters), 413 (body over ``max_body``), 415 (not an image we accept),
+422 (does not fit the budget) or 429 when full.
+
+Requests are compressed by a process pool that is started and warmed up
+before the first request. At most ``workers + queue_size`` requests are
+admitted at once; the rest get 429 with ``Retry-After`` before their body is
+read, so a client can back off without the server buffering its upload.
+Bodies are read and written in CHUNK_SIZE pieces; chunked uploads are
+accepted.
+"""
+import io
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image, UnidentifiedImageError
+
+from compressor import codecs, engine, metrics, parallel
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_BODY = 50 * 1024 * 1024
+DEFAULT_QUEUE_SIZE = 16
+LATENCY_WINDOW = 10000  # latest request latencies kept for the percentiles
+CONTENT_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp', 'AVIF': 'image/avif'}
+
+
+class RequestError(Exception):
+    """An error answered with ``status`` instead of a 500."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def warm_up():
+    # Runs once per worker: imports the codecs and pays for their first-use setup
+    image = Image.new('RGB', (64, 64), (128, 128, 128))
+    engine.compress_to_bytes(image, 10000, 64)
+    time.sleep(0.05)  # Keeps this worker busy so the pool starts the next one
+    return True
+
+
+def compress_request(data, options, max_pixels=engine.MAX_IMAGE_PIXELS):
+    # Runs inside the worker; returns (result, data, None) or (None, None, (status, message))
+    timer = metrics.StageTimer()
+    try:
+        with timer.stage('load'):
+            image = engine.open_source(data, max_pixels)
+        try:
+            return engine.compress_to_bytes(image, timer=timer, **options) + (None,)
+        finally:
+            image.close()
+    except UnidentifiedImageError:
+        return None, None, (415, "the body is not an image this service can read")
+    except engine.UnsupportedImageError as e:
+        return None, None, (415, str(e))
+    except (IOError, ValueError) as e:
+        return None, None, (422, str(e))
+    except Exception as e:
+        return None, None, (500, str(e))
+
+
+class CompressionServer(ThreadingHTTPServer):
+    """Serves compression requests on ``address`` with ``workers`` warm worker processes.
+
+    ``defaults`` (``max_size``, ``max_dim``, ``output_format``, ``search``, ...)
+    go to ``engine.compress_to_bytes`` for parameters a request leaves out.
+    Images over ``max_pixels`` are answered with 415 before they are decoded.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, workers=None, queue_size=DEFAULT_QUEUE_SIZE, max_body=DEFAULT_MAX_BODY,
+                 max_pixels=engine.MAX_IMAGE_PIXELS, debug=False, **defaults):
+        self.pool = None  # server_close runs before the pool exists when the bind fails
+        super().__init__(address, CompressionHandler)
+        self.workers = workers or parallel.default_workers()
+        self.capacity = self.workers + queue_size
+        self.max_body = max_body
+        self.max_pixels = max_pixels
+        self.debug = debug
+        self.defaults = dict(defaults, debug=debug)
+        self.slots = threading.BoundedSemaphore(self.capacity)
+        self.lock = threading.Lock()
+        self.admitted = 0
+        self.responses = {}  # status -> count
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.batch_metrics = metrics.BatchMetrics()
+        self.started = time.time()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        for future in [self.pool.submit(warm_up) for _ in range(self.workers)]:
+            future.result()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def server_close(self):
+        super().server_close()
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+    def admit(self):
+        if not self.slots.acquire(blocking=False):
+            return False
+        with self.lock:
+            self.admitted += 1
+        return True
+
+    def release(self):
+        with self.lock:
+            self.admitted -= 1
+        self.slots.release()
+
+    def record(self, status, seconds, result=None):
+        with self.lock:
+            self.responses[status] = self.responses.get(status, 0) + 1
+            if status == 200:
+                self.latencies.append(seconds)
+                self.batch_metrics.observe(engine.ItemResult(sum(self.responses.values()), "request",
+                                                             result=result))
+
+    def options_for(self, query):
+        """Compression options for a request's query string; raises RequestError(400)."""
+        params = {name: values[-1] for name, values in parse_qs(query).items()}
+        options = dict(self.defaults)
+        try:
+            for name in ('max_size', 'max_dim'):
+                if name in params:
+                    options[name] = int(params.pop(name))
+                    if options[name] <= 0:
+                        raise ValueError
+        except ValueError:
+            raise RequestError(400, "max_size and max_dim must be positive integers")
+        if 'format' in params:
+            output_format = params.pop('format')
+            if output_format not in codecs.available_formats():
+                raise RequestError(400, f"format must be one of {', '.join(codecs.available_formats())}")
+            options['output_format'] = output_format
+        if params:
+            raise RequestError(400, f"unknown parameters: {', '.join(sorted(params))}")
+        return options
+
+    def health(self):
+        with self.lock:
+            admitted = self.admitted
+        return {'status': 'ok', 'workers': self.workers, 'capacity': self.capacity, 'admitted': admitted,
+                'queued': max(admitted - self.workers, 0), 'uptime': round(time.time() - self.started, 3)}
+
+    def prometheus_text(self, prefix='image_compressor'):
+        health = self.health()
+        with self.lock:
+            latencies = sorted(self.latencies)
+            responses = dict(self.responses)
+            stage_text = self.batch_metrics.prometheus_text(prefix)
+        lines = []
+        for name, help_text in (('admitted', 'Requests being compressed or waiting for a worker.'),
+                                ('queued', 'Admitted requests waiting for a worker.'),
+                                ('capacity', 'Requests admitted at most before answering 429.'),
+                                ('workers', 'Worker processes.')):
+            lines += [f"# HELP {prefix}_server_{name} {help_text}", f"# TYPE {prefix}_server_{name} gauge",
+                      f"{prefix}_server_{name} {health[name]}"]
+        lines += [f"# HELP {prefix}_server_responses_total Responses by HTTP status.",
+                  f"# TYPE {prefix}_server_responses_total counter"]
+        for status, count in sorted(responses.items()):
+            lines.append(f'{prefix}_server_responses_total{{status="{status}"}} {count}')
+        lines += [f"# HELP {prefix}_server_latency_seconds Seconds from request to response for compressed "
+                  f"images (last {LATENCY_WINDOW}).",
+                  f"# TYPE {prefix}_server_latency_seconds summary"]
+        if latencies:
+            for q in metrics.QUANTILES:
+                lines.append(f'{prefix}_server_latency_seconds{{quantile="{q}"}} '
+                             f'{metrics.percentile(latencies, q):.6f}')
+        lines += [f"{prefix}_server_latency_seconds_sum {sum(latencies):.6f}",
+                  f"{prefix}_server_latency_seconds_count {len(latencies)}"]
+        return '\n'.join(lines) + '\n' + stage_text
+
+
+class CompressionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # headers and body are separate writes; avoid delayed-ACK stalls
+    timeout = 60  # seconds a client may stall mid-request
+
+    def log_message(self, format, *args):
+        if self.server.debug:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/healthz':
+            self.send_body(200, json.dumps(self.server.health()).encode(), 'application/json')
+        elif path == '/metrics':
+            self.send_body(200, self.server.prometheus_text().encode(), 'text/plain; version=0.0.4')
+        else:
+            self.send_error_body(404, "not found")
+
+    def do_POST(self):
+        start = time.perf_counter()
+        url = urlsplit(self.path)
+        if url.path != '/compress':
+            self.close_connection = True  # The body is not read
+            self.send_error_body(404, "not found")
+            return
+        server = self.server
+        if not server.admit():
+            self.close_connection = True
+            server.record(429, time.perf_counter() - start)
+            self.send_error_body(429, "server busy", {'Retry-After': '1'})
+            return
+        data = None
+        try:
+            options = server.options_for(url.query)
+            data = self.read_body(server.max_body)
+            result, output, error = server.pool.submit(compress_request, data, options, server.max_pixels).result()
+            if error:
+                raise RequestError(*error)
+        except Exception as e:
+            status = e.status if isinstance(e, RequestError) else 500
+            if data is None:
+                self.close_connection = True  # What is left of the body cannot be skipped reliably
+            server.record(status, time.perf_counter() - start)
+            self.send_error_body(status, str(e))
+            return
+        finally:
+            server.release()
+        codec = codecs.CODECS[result.settings['codec']]
+        timing = ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in result.timings.items())
+        headers = {'X-Compressor-Quality': '' if result.quality is None else str(result.quality),
+                   'X-Compressor-Encodes': str(result.encodes),
+                   'X-Compressor-Dimensions': f"{result.width}x{result.height}",
+                   'Server-Timing': timing}
+        self.send_body(200, output, CONTENT_TYPES[codec.format], headers)
+        server.record(200, time.perf_counter() - start, result)
+
+    def read_body(self, limit):
+        # The request body in CHUNK_SIZE reads, never more than ``limit`` bytes
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            return self.read_chunked(limit)
+        try:
+            length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            self.close_connection = True
+            raise RequestError(411, "Content-Length or chunked transfer encoding required")
+        if length > limit:
+            self.close_connection = True
+            raise RequestError(413, f"body over {limit} bytes")
+        body = io.BytesIO()
+        while body.tell() < length:
+            chunk = self.rfile.read(min(CHUNK_SIZE, length - body.tell()))
+            if not chunk:
+                self.close_connection = True
+                raise RequestError(400, "body ended early")
+            body.write(chunk)
+        return body.getvalue()
+
+    def read_chunked(self, limit):
+        body = io.BytesIO()
+        while True:
+            try:
+                size = int(self.rfile.readline(64).split(b';')[0], 16)
+            except ValueError:
+                self.close_connection = True
+                raise RequestError(400, "bad chunk size")
+            if size == 0:
+                while self.rfile.readline(1024).strip():
+                    pass  # Trailers
+                return body.getvalue()
+            if body.tell() + size > limit:
+                self.close_connection = True
+                raise RequestError(413, f"body over {limit} bytes")
+            while size:
+                chunk = self.rfile.read(min(CHUNK_SIZE, size))
+                if not chunk:
+                    self.close_connection = True
+                    raise RequestError(400, "body ended early")
+                body.write(chunk)
+                size -= len(chunk)
+            self.rfile.readline(8)  # The CRLF after each chunk
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        view = memoryview(body)
+        for offset in range(0, len(view), CHUNK_SIZE):
+            self.wfile.write(view[offset:offset + CHUNK_SIZE])
+
+    def send_error_body(self, status, message, headers=None):
+        self.send_body(status, json.dumps({'error': message}).encode() + b'\n', 'application/json', headers)
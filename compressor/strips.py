@@ -0,0 +1,201 @@
+"""Downscaling very large images a strip of rows at a time.
+
+Decoding a 15000x10000 scan whole takes 450 MB for RGB before the resize
+makes its own copy. ``reduce_in_strips`` instead decodes about STRIP_BYTES
+of rows at a time straight from the file and box-reduces each strip by the
+integer factors ``Image.resize(..., reducing_gap=...)`` would pick for the
+whole image. Strips are a multiple of the vertical factor tall, so the
+reduced image is exactly the one a whole-image reduce gives and the final
+LANCZOS pass matches the in-memory "fast" resize. Peak memory is about two
+strips plus the reduced image. (Pillow skips the box reduce for images with
+alpha, so those differ from the in-memory resize by up to about 10 levels
+along alpha edges rather than being identical; ``benchmarks.check_strips``
+measures it.)
+
+Strips are read from uncompressed rasters (BMP, TGA, PPM, uncompressed TIFF)
+and from non-interlaced 8-bit PNGs; anything else returns None and is decoded
+whole, as are palette images with a transparency key. JPEGs do not need
+strips: the decoder already scales them down by up to 8 while decoding
+(``Image.draft``).
+"""
+import struct
+import zlib
+
+from PIL import Image
+
+from compressor.metrics import NULL_TIMER
+
+STRIP_BYTES = 16 * 1024 * 1024  # decoded bytes per strip
+READ_SIZE = 256 * 1024
+MODES = ['L', 'LA', 'RGB', 'RGBA', 'P']
+PREMULTIPLIED = {'LA': 'La', 'RGBA': 'RGBa'}  # Pillow resizes images with alpha premultiplied
+
+
+def reduce_factors(size, target, reducing_gap):
+    # The box-reduce factors Image.resize picks for this reducing_gap
+    return (max(int(size[0] / target[0] / reducing_gap), 1),
+            max(int(size[1] / target[1] / reducing_gap), 1))
+
+
+def raw_stride(mode, rawmode, width):
+    # Bytes per row the raw decoder assumes when a tile gives a stride of 0
+    try:
+        return len(Image.new(mode, (width, 1)).tobytes('raw', rawmode))
+    except ValueError:
+        return None
+
+
+def raw_strips(image):
+    # A function yielding (top, strip) from a source stored as uncompressed rows, or None
+    width, height = image.size
+    bands = []
+    for codec, (x0, y0, x1, y1), offset, args in image.tile:
+        rawmode, stride, ystep = (args, 0, 1) if isinstance(args, str) else (tuple(args) + (0, 1))[:3]
+        stride = stride or raw_stride(image.mode, rawmode, width)
+        if (x0, x1) != (0, width) or not stride:
+            return None
+        bands.append((y0, y1, offset, rawmode, stride, ystep))
+    bands.sort()
+    if bands[0][0] != 0 or bands[-1][1] != height or any(a[1] != b[0] for a, b in zip(bands, bands[1:])):
+        return None
+
+    def read(rows):
+        for top in range(0, height, rows):
+            bottom = min(top + rows, height)
+            pieces = []
+            for y0, y1, offset, rawmode, stride, ystep in bands:
+                first, last = max(top, y0), min(bottom, y1)
+                if first >= last:
+                    continue
+                # Bottom-up rasters (ystep -1) store the strip's last row first
+                image.fp.seek(offset + ((first - y0) if ystep > 0 else (y1 - last)) * stride)
+                data = image.fp.read((last - first) * stride)
+                if len(data) < (last - first) * stride:
+                    raise OSError("image file is truncated")
+                pieces.append((first - top, Image.frombytes(image.mode, (width, last - first), data, 'raw',
+                                                            rawmode, stride, ystep)))
+            if len(pieces) == 1:
+                yield top, pieces[0][1]
+            else:
+                strip = Image.new(image.mode, (width, bottom - top))
+                for y, piece in pieces:
+                    strip.paste(piece, (0, y))
+                yield top, strip
+    return read
+
+
+def idat_data(fp):
+    # Yields the zlib stream of a PNG from fp, positioned at the first IDAT header
+    while True:
+        header = fp.read(8)
+        if len(header) < 8:
+            return
+        length, kind = struct.unpack('>I4s', header)
+        if kind != b'IDAT':
+            return
+        while length:
+            data = fp.read(min(READ_SIZE, length))
+            if not data:
+                return
+            length -= len(data)
+            yield data
+        fp.read(4)  # CRC
+
+
+def png_strips(image):
+    """A function yielding (top, strip) from a non-interlaced 8-bit PNG, or None.
+
+    The zlib stream is inflated here, ``rows`` filtered rows at a time. PNG
+    filters refer to the row above, so each strip after the first is handed
+    to Pillow's PNG decoder behind an unfiltered copy of the previous strip's
+    last row, which is then cropped off.
+    """
+    codec, extents, offset, rawmode = image.tile[0]
+    if rawmode != image.mode or image.info.get('interlace'):
+        return None
+    width, height = image.size
+    row_size = width * len(image.getbands()) + 1  # filter type byte + 8-bit samples
+
+    def read(rows):
+        image.fp.seek(offset - 8)
+        stream = idat_data(image.fp)
+        inflater = zlib.decompressobj()
+        previous = None
+        for top in range(0, height, rows):
+            count = min(rows, height - top)
+            filtered = bytearray()
+            while len(filtered) < count * row_size:
+                data = inflater.unconsumed_tail or next(stream, None)
+                if data is None:
+                    raise OSError("image file is truncated")
+                filtered += inflater.decompress(data, count * row_size - len(filtered))
+            if previous is not None:
+                filtered[:0] = b'\0' + previous
+            strip = Image.frombytes(image.mode, (width, len(filtered) // row_size), zlib.compress(filtered, 0),
+                                    'zip', rawmode)
+            if previous is not None:
+                strip = strip.crop((0, 1, width, strip.height))
+            previous = strip.crop((0, count - 1, width, count)).tobytes()
+            yield top, strip
+    return read
+
+
+def strip_reader(image):
+    # A function yielding (top, strip) for ``rows`` rows at a time, or None
+    if not image.tile or image.mode not in MODES or not hasattr(image, 'fp'):
+        return None
+    if image.mode == 'P' and 'transparency' in image.info:
+        # Decoded whole, so the transparency key expands to alpha exactly as in memory
+        return None
+    codecs = {tile[0] for tile in image.tile}
+    if codecs == {'raw'}:
+        return raw_strips(image)
+    if image.format == 'PNG' and codecs == {'zip'} and len(image.tile) == 1:
+        return png_strips(image)
+    return None
+
+
+def working_copy(strip, image, mode=None):
+    # The strip in the mode Image.resize would reduce it in
+    if strip.mode == 'P':
+        strip.putpalette(image.palette)
+        strip = strip.convert(mode or 'RGB')
+    elif mode and strip.mode != mode:
+        strip = strip.convert(mode)
+    return strip.convert(PREMULTIPLIED[strip.mode]) if strip.mode in PREMULTIPLIED else strip
+
+
+def reduce_in_strips(image, size, reducing_gap, timer=None, mode=None):
+    """Resize a not yet loaded ``image`` to ``size`` without decoding it whole.
+
+    Gives the pixels of ``image.resize(size, Image.LANCZOS,
+    reducing_gap=reducing_gap)``, except that palette images are converted to
+    RGB first instead of being resized with NEAREST. With ``mode``, each strip
+    is converted to it first, like ``image.convert(mode).resize(...)``.
+    Returns None when the source cannot be read in strips or is too close to
+    ``size`` to reduce.
+    """
+    timer = timer or NULL_TIMER
+    factors = reduce_factors(image.size, size, reducing_gap)
+    read = strip_reader(image)
+    if read is None or factors == (1, 1):
+        return None
+    width, height = image.size
+    bands = 4 if image.mode == 'P' else len(image.getbands())
+    rows = max(STRIP_BYTES // (width * bands) // factors[1], 1) * factors[1]
+
+    reduced = None
+    strips = read(rows)
+    while True:
+        with timer.stage('decode'):
+            top, strip = next(strips, (None, None))
+        if strip is None:
+            break
+        with timer.stage('resize'):
+            part = working_copy(strip, image, mode).reduce(factors)
+            if reduced is None:
+                reduced = Image.new(part.mode, (-(-width // factors[0]), -(-height // factors[1])))
+            reduced.paste(part, (0, top // factors[1]))
+    with timer.stage('resize'):
+        resized = reduced.resize(size, Image.LANCZOS, box=(0, 0, width / factors[0], height / factors[1]))
+        return resized.convert(resized.mode.upper()) if resized.mode in PREMULTIPLIED.values() else resized
@@ -0,0 +1,331 @@
+"""Watch a hot folder and compress images as they land in it.
+
+    python -m compressor --watch UPLOADS -o OUTPUT
+
+On Linux new and modified files are reported by inotify; elsewhere, or with
+``poll=True`` (network shares do not deliver inotify events), the folder is
+rescanned every POLL_INTERVAL. A file counts as completely written when its
+writer closes it or renames it into place, or otherwise once it has had no
+events for ``settle`` seconds.
+
+Settled files go through a bounded queue to a pool of workers running
+``parallel.compress_job``. A JobJournal remembers what was compressed and
+the SHA-256 of each source, so only new or changed inputs (by size and
+mtime, then by content hash) are compressed again, also across restarts, and
+a changed input overwrites its earlier output. ``stats()`` and
+``prometheus_text()`` report queue depth, jobs in flight and lag, the
+seconds from a file's arrival to its output.
+"""
+import ctypes
+import ctypes.util
+import os
+import queue
+import select
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from compressor import engine, journal, metrics, parallel
+
+SETTLE_SECONDS = 0.2  # quiet time after which a file nobody closed is taken as complete
+POLL_INTERVAL = 0.25
+DEFAULT_QUEUE_SIZE = 64
+LAG_WINDOW = 1000  # lags kept for the percentiles
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+
+def is_input(name):
+    # Hidden files (our own temporary outputs among them) and partial uploads are never inputs
+    return not name.startswith('.') and os.path.splitext(name)[1].lower() in engine.SUPPORTED_EXTENSIONS
+
+
+class InotifyEvents:
+    """File events in ``folder`` from Linux inotify; raises OSError where unavailable."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except AttributeError:
+            raise OSError("inotify is not available on this system")
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, os.strerror(error), folder)
+
+    def wait(self, timeout):
+        """Events within ``timeout`` seconds as (name, complete) pairs."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # The kernel dropped events: look at everything again, the journal skips what is done
+                events.extend((name, False) for name in os.listdir(self.folder))
+            elif name:
+                events.append((name, bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO))))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingEvents:
+    """The same events from rescanning ``folder`` every ``interval`` seconds."""
+
+    def __init__(self, folder, interval=POLL_INTERVAL):
+        self.folder = folder
+        self.interval = interval
+        self.stamps = {}
+        self.next_scan = time.monotonic()
+
+    def wait(self, timeout):
+        delay = self.next_scan - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(delay, 0))
+        self.next_scan = time.monotonic() + self.interval
+        stamps = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        stamps[entry.name] = (stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    continue  # Removed while scanning
+        changed = [(name, False) for name, stamp in stamps.items() if self.stamps.get(name) != stamp]
+        self.stamps = stamps
+        return changed
+
+    def close(self):
+        pass
+
+
+class FolderWatcher:
+    """Compresses images arriving in ``folder`` into ``output_folder`` until ``stop()``.
+
+    ``run()`` blocks; call ``stop()`` from another thread or a signal handler.
+    Up to ``queue_size`` settled files wait for a worker; when the queue is full
+    the watcher stops taking files off the settle list until it drains. Keyword
+    arguments go to ``parallel.compress_job`` as with ``iter_compress_jobs``.
+    ``progress(item, lag)`` is called as each file finishes. With ``status_path``
+    the Prometheus text is kept up to date in that file (for node_exporter's
+    textfile collector, say).
+    """
+
+    def __init__(self, folder, output_folder, workers=None, executor="process", queue_size=DEFAULT_QUEUE_SIZE,
+                 settle=SETTLE_SECONDS, poll=False, job_journal=None, batch_metrics=None, progress=None,
+                 status_path=None, status_interval=1.0, debug=False, **options):
+        self.folder = os.path.abspath(folder)
+        self.output_folder = engine.ensure_output_folder(output_folder)
+        if self.folder == self.output_folder:
+            raise ValueError("The output folder must not be the watched folder")
+        self.workers = workers or parallel.default_workers()
+        self.executor = executor
+        self.settle = settle
+        self.poll = poll
+        self.journal = job_journal or journal.JobJournal(os.path.join(self.output_folder, journal.JOURNAL_NAME))
+        self.batch_metrics = batch_metrics or metrics.BatchMetrics()
+        self.progress = progress
+        self.status_path = status_path  # prometheus_text() is rewritten here every status_interval seconds
+        self.status_interval = status_interval
+        self.debug = debug
+        self.options = dict(options, debug=debug, timings=True)
+        self.queue = queue.Queue(maxsize=queue_size)  # (path, arrival time)
+        self.namer = engine.OutputNamer(self.output_folder, options.get("output_format", "keep"))
+        self.running = {}  # future -> (key, item, arrival, digest)
+        self.running_keys = set()
+        self.changed_while_running = {}  # key -> earliest arrival of a change seen while it was compressing
+        self.settling = {}  # name -> (arrival, last event)
+        self.lags = deque(maxlen=LAG_WINDOW)
+        self.counts = {'compressed': 0, 'failed': 0, 'unchanged': 0}
+        self.index = 0
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def open_events(self):
+        if not self.poll:
+            try:
+                return InotifyEvents(self.folder)
+            except OSError as e:
+                if self.debug:
+                    print(f"inotify unavailable ({e}), polling {self.folder} every {POLL_INTERVAL}s")
+        # A growing file has to be seen unchanged by a later scan before it counts as settled
+        self.settle = max(self.settle, 1.5 * POLL_INTERVAL)
+        return PollingEvents(self.folder)
+
+    def watch(self, events):
+        # Watcher thread: turns events into settled paths on the queue
+        now = time.time()
+        for name in os.listdir(self.folder):
+            self.settling[name] = (now, 0.0)  # Whatever is already there counts as settled
+        while not self.stopped.is_set():
+            now = time.time()
+            for name, complete in events.wait(0.05):
+                if not is_input(name):
+                    continue
+                arrival = self.settling.get(name, (now,))[0]
+                self.settling[name] = (arrival, 0.0 if complete else now)
+            for name, (arrival, last_event) in list(self.settling.items()):
+                if not is_input(name):
+                    del self.settling[name]
+                elif now - last_event >= self.settle:
+                    try:
+                        self.queue.put((os.path.join(self.folder, name), arrival), timeout=0.05)
+                    except queue.Full:
+                        break  # Back-pressure: leave the rest settling until workers catch up
+                    del self.settling[name]
+
+    def run(self):
+        events = self.open_events()
+        watcher = threading.Thread(target=self.watch, args=(events,), name="compressor-watch", daemon=True)
+        watcher.start()
+        pool_class = ProcessPoolExecutor if self.executor == "process" else ThreadPoolExecutor
+        next_status = 0
+        try:
+            with pool_class(max_workers=self.workers) as pool:
+                while not self.stopped.is_set():
+                    if self.status_path and time.monotonic() >= next_status:
+                        self.write_status()
+                        next_status = time.monotonic() + self.status_interval
+                    while len(self.running) < self.workers:
+                        try:
+                            # Only block on the queue when there is nothing to wait for
+                            path, arrival = self.queue.get(timeout=0.05 if not self.running else 0)
+                        except queue.Empty:
+                            break
+                        self.submit(pool, path, arrival)
+                    if self.running:
+                        completed, _ = wait(self.running, timeout=0.05, return_when=FIRST_COMPLETED)
+                        for future in completed:
+                            self.finish(pool, future)
+                for future in self.running:
+                    future.cancel()
+        finally:
+            self.stopped.set()
+            watcher.join()
+            events.close()
+            self.journal.close()
+
+    def submit(self, pool, path, arrival):
+        key = os.path.abspath(path)
+        if key in self.running_keys:
+            # Compress it again once the running job is done; its output would be stale
+            self.changed_while_running.setdefault(key, arrival)
+            return
+        if not os.path.exists(path) or self.journal.skip_reason(key) == 'done':
+            return
+        try:
+            digest = journal.file_digest(path)
+        except OSError:
+            return  # Gone before it could be read
+        if self.journal.source_digest(key) == digest:
+            self.counts['unchanged'] += 1  # Touched or rewritten with the same bytes
+            return
+        self.index += 1
+        name = os.path.splitext(os.path.basename(path))[0]
+        item = engine.ItemResult(self.index, name)
+        variants = self.options.get("variants")
+        try:
+            target = parallel.reserve_target(self.namer, path, name, self.index, variants, self.journal.target(key),
+                                             self.options.get("max_pixels", engine.MAX_IMAGE_PIXELS))
+        except Exception as e:
+            item.error = str(e)
+            self.journal.finish(key, item)
+            self.report(key, item, arrival)
+            return
+        item.output_path = target[engine.largest_variant(variants)] if variants else target
+        self.journal.start(key, name, target)
+        future = pool.submit(parallel.compress_job, path, target, **self.options)
+        self.running[future] = (key, item, arrival, digest)
+        self.running_keys.add(key)
+
+    def finish(self, pool, future):
+        key, item, arrival, digest = self.running.pop(future)
+        self.running_keys.discard(key)
+        item.result, item.error = future.result()
+        self.journal.finish(key, item, digest)
+        if item.ok:
+            item.output_path = item.result.path
+            model = self.options.get("model")
+            if model is not None:
+                for result in item.result.variants or [item.result]:
+                    model.observe(result.samples)
+        self.report(key, item, arrival)
+        if key in self.changed_while_running:
+            self.submit(pool, key, self.changed_while_running.pop(key))
+
+    def report(self, key, item, arrival):
+        lag = time.time() - arrival
+        self.lags.append(lag)
+        self.counts['compressed' if item.ok else 'failed'] += 1
+        self.batch_metrics.observe(item)
+        if self.progress:
+            self.progress(item, lag)
+
+    def write_status(self):
+        temp_path = f"{self.status_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_path, self.status_path)
+
+    def stats(self):
+        lags = sorted(self.lags)
+        return {
+            'queue_depth': self.queue.qsize(),
+            'settling': len(self.settling),
+            'in_flight': len(self.running),
+            'workers': self.workers,
+            'lag_p50': metrics.percentile(lags, 0.5),
+            'lag_p95': metrics.percentile(lags, 0.95),
+            'lag_max': lags[-1] if lags else None,
+            **self.counts,
+        }
+
+    def prometheus_text(self, prefix='image_compressor'):
+        """Watch gauges and arrival-to-output lag, followed by the BatchMetrics of every file so far."""
+        stats = self.stats()
+        lines = []
+        for name, help_text in (('queue_depth', 'Settled files waiting for a worker.'),
+                                ('settling', 'Files still being written.'),
+                                ('in_flight', 'Files being compressed.'),
+                                ('workers', 'Worker count.')):
+            lines += [f"# HELP {prefix}_watch_{name} {help_text}", f"# TYPE {prefix}_watch_{name} gauge",
+                      f"{prefix}_watch_{name} {stats[name]}"]
+        lags = sorted(self.lags)
+        lines += [f"# HELP {prefix}_watch_lag_seconds Seconds from a file's arrival to its output "
+                  f"(last {LAG_WINDOW} files).",
+                  f"# TYPE {prefix}_watch_lag_seconds summary"]
+        if lags:
+            for q in metrics.QUANTILES:
+                lines.append(f'{prefix}_watch_lag_seconds{{quantile="{q}"}} {metrics.percentile(lags, q):.6f}')
+        lines += [f"{prefix}_watch_lag_seconds_sum {sum(lags):.6f}", f"{prefix}_watch_lag_seconds_count {len(lags)}",
+                  f"# HELP {prefix}_watch_unchanged_total Modified files whose content had not changed.",
+                  f"# TYPE {prefix}_watch_unchanged_total counter",
+                  f"{prefix}_watch_unchanged_total {self.counts['unchanged']}"]
+        return '\n'.join(lines) + '\n' + self.batch_metrics.prometheus_text(prefix)
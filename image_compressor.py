@@ -1,21 +1,30 @@
 import tkinter as tk
 import tkinter.font as tkfont
-from tkinter import filedialog, TclError
-from PIL import Image
-import io
+from tkinter import filedialog, ttk, TclError
 import os
-import requests
-import re
+import queue
+import threading
+import time
+
+from compressor import engine, parallel
+from compressor.fetch import Downloader
 
 class ImageCompressorApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Image Compressor")
-        self.root.geometry("600x500")
+        self.root.geometry("640x680")
         self.root.configure(bg="#F4F4F4")
         self.output_folder = None
         self.debug = True  # Enable debug logging
 
+        # Batches run on a background thread and report through this queue, polled with root.after
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.worker = None
+        self.batch = None  # (total, source description, start time, done, failed) of the running batch
+        self.closing = False  # the window closes once the running batch has stopped
+
         # Styling variables
         self.bg_color = "#F4F4F4"
         self.accent_color = "#1F6AA5"
@@ -75,6 +84,39 @@ class ImageCompressorApp:
         )
         self.status_label.pack(pady=10)
 
+        # Progress bar, throughput/ETA and cancel button for the running batch
+        self.progress_bar = ttk.Progressbar(self.main_frame, orient="horizontal", mode="determinate")
+        self.progress_bar.pack(fill="x", pady=5)
+
+        progress_row = tk.Frame(self.main_frame, bg=self.bg_color)
+        progress_row.pack(fill="x")
+        self.progress_label = tk.Label(
+            progress_row, text="", font=self.font_label, bg=self.bg_color, fg=self.text_color, anchor="w"
+        )
+        self.progress_label.pack(side="left", fill="x", expand=True)
+        self.cancel_button = tk.Button(
+            progress_row, text="Cancel", font=self.font_label, bg=self.accent_color, fg="white",
+            activebackground=self.hover_color, activeforeground="white", disabledforeground="white",
+            command=self.cancel_batch, relief="flat", padx=10, state="disabled"
+        )
+        self.cancel_button.pack(side="right")
+
+        # Log of every image, so errors stay visible after later images finish
+        log_frame = tk.Frame(self.main_frame, bg=self.bg_color)
+        log_frame.pack(fill="both", expand=True, pady=10)
+        log_scrollbar = tk.Scrollbar(log_frame, orient="vertical")
+        log_scrollbar.pack(side="right", fill="y")
+        self.log_text = tk.Text(
+            log_frame, font=self.font_label, height=10, bg="white", fg=self.text_color, wrap="word",
+            yscrollcommand=log_scrollbar.set, state="disabled"
+        )
+        self.log_text.pack(side="left", fill="both", expand=True)
+        self.log_text.tag_config("error", foreground="#B00020")
+        self.log_text.tag_config("warning", foreground="#9A6700")
+        log_scrollbar.config(command=self.log_text.yview)
+
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+
     def is_font_available(self, font_name):
         try:
             tkfont.Font(family=font_name)
@@ -104,179 +146,127 @@ class ImageCompressorApp:
         else:
             self.status_label.config(text="No output folder selected")
 
-    def compress_image(self, image, output_path, max_size=100352):  # 98 KB
-        try:
-            output_path = os.path.abspath(output_path)  # Ensure absolute path
-            output_dir = os.path.dirname(output_path)
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir, exist_ok=True)
+    def compress_image(self, image, output_path, max_size=engine.DEFAULT_MAX_SIZE, search="bisect"):
+        return engine.compress_image(image, output_path, max_size, search=search, debug=self.debug)
 
-            if self.debug:
-                print(f"Attempting to save to: {output_path}")
-
-            # Pre-resize the image to a maximum dimension of 1920 pixels
-            max_dim = 1920
-            if image.width > max_dim or image.height > max_dim:
-                ratio = min(max_dim / image.width, max_dim / image.height)
-                new_width = int(image.width * ratio)
-                new_height = int(image.height * ratio)
-                image = image.resize((new_width, new_height), Image.LANCZOS)
-
-            # Determine the format to save as
-            saved_format = image.format if image.format in ['JPEG', 'PNG'] else 'JPEG'
-            if saved_format == 'JPEG' and image.mode != 'RGB':
-                image = image.convert('RGB')
-            final_quality = None  # For JPEG quality feedback
-
-            # Check initial size
-            buffer = io.BytesIO()
-            if saved_format == 'JPEG':
-                image.save(buffer, format='JPEG', quality=95, optimize=True, progressive=True)
-            else:  # PNG
-                image.save(buffer, format='PNG', optimize=True)
-
-            if buffer.tell() <= max_size:
-                if saved_format == 'JPEG':
-                    image.save(output_path, format='JPEG', quality=95, optimize=True, progressive=True)
-                    final_quality = 95
-                else:
-                    image.save(output_path, format='PNG', optimize=True)
-            else:
-                # Compress based on format
-                if saved_format == 'JPEG':
-                    for quality in range(95, 29, -5):
-                        buffer = io.BytesIO()
-                        image.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
-                        size = buffer.tell()
-                        if size <= max_size:
-                            image.save(output_path, format='JPEG', quality=quality, optimize=True, progressive=True)
-                            final_quality = quality
-                            break
-                    else:
-                        image.save(output_path, format='JPEG', quality=30, optimize=True, progressive=True)
-                        compressed_size = os.path.getsize(output_path)
-                        if compressed_size > max_size:
-                            raise IOError(f"Could not compress JPEG image to {max_size} bytes (final size: {compressed_size} bytes) at minimum quality 30")
-                        final_quality = 30
-                else:  # PNG
-                    # Convert to 128-color palette
-                    palette_image = image.convert('P', palette=Image.ADAPTIVE, colors=128)
-                    buffer = io.BytesIO()
-                    palette_image.save(buffer, format='PNG', optimize=True)
-                    size = buffer.tell()
-                    if size <= max_size:
-                        palette_image.save(output_path, format='PNG', optimize=True)
-                    else:
-                        # Resize progressively
-                        factor = 1
-                        while True:
-                            current_width = int(palette_image.width / factor)
-                            current_height = int(palette_image.height / factor)
-                            if current_width < 1 or current_height < 1:
-                                break
-                            resized_image = palette_image.resize((current_width, current_height), Image.LANCZOS)
-                            buffer = io.BytesIO()
-                            resized_image.save(buffer, format='PNG', optimize=True)
-                            size = buffer.tell()
-                            if size <= max_size:
-                                resized_image.save(output_path, format='PNG', optimize=True)
-                                break
-                            factor *= 2
-                        else:
-                            # If still too large, save the smallest version and check size
-                            if 'resized_image' in locals() and current_width > 0 and current_height > 0:
-                                resized_image.save(output_path, format='PNG', optimize=True)
-                            else:
-                                palette_image.save(output_path, format='PNG', optimize=True)
-                            compressed_size = os.path.getsize(output_path)
-                            if compressed_size > max_size:
-                                raise IOError(f"Could not compress PNG image to {max_size} bytes (final size: {compressed_size} bytes)")
-
-            # Check if file exists after saving
-            if not os.path.exists(output_path):
-                raise IOError(f"Failed to save file: {output_path}")
-
-            compressed_size = os.path.getsize(output_path)
-            final_path = output_path
-
-            # Validate the saved image
-            try:
-                with Image.open(final_path) as test_image:
-                    test_image.verify()  # Verify image integrity
-            except Exception as e:
-                raise IOError(f"Saved image is corrupted: {final_path}, Error: {str(e)}")
-
-            return final_path, compressed_size, final_quality
-
-        except (PermissionError, OSError) as e:
-            raise IOError(f"Error saving image to {output_path}: {str(e)}")
-
-    def process_images(self, images, names, source_description="image"):
+    def process_images(self, jobs, total, source_description="image", downloader=None):
+        # jobs is an iterable of (source, name); they are compressed on a background thread while
+        # the window stays responsive. The downloader, if any, is closed when the batch ends.
+        if self.worker is not None:
+            self.status_label.config(text="A batch is already running")
+            if downloader:
+                downloader.close()
+            return
+        self.cancel_event.clear()
+        self.batch = [total, source_description, time.perf_counter(), 0, 0]
+        self.progress_bar.config(maximum=max(total, 1), value=0)
+        self.progress_label.config(text=f"0 of {total}")
+        self.status_label.config(text=f"Processing {total} {source_description}s")
+        self.set_running(True)
+        self.log(f"Started {total} {source_description}s")
+        self.worker = threading.Thread(target=self.run_batch, args=(jobs, total, downloader), daemon=True)
+        self.worker.start()
+        self.root.after(100, self.poll_events)
+
+    def run_batch(self, jobs, total, downloader):
+        # Background thread: never touches Tk widgets, only posts events
         try:
-            if not os.path.exists(self.output_folder):
-                os.makedirs(self.output_folder, exist_ok=True)
-            if not os.access(self.output_folder, os.W_OK):
-                self.status_label.config(text=f"Error: Output folder {self.output_folder} is not writable")
-                return
+            for item in parallel.iter_compress_jobs(jobs, self.output_folder, workers=parallel.default_workers(),
+                                                    executor="thread", total=total, cancel=self.cancel_event,
+                                                    debug=self.debug):
+                self.events.put(("item", item))
         except Exception as e:
-            self.status_label.config(text=f"Error accessing output folder: {str(e)}")
-            return
-
-        if len(images) != len(names):
-            self.status_label.config(text="Error: Number of images and names must match")
-            return
-
-        total_images = len(images)
-        used_filenames = set()
-
-        for index, (image, custom_name) in enumerate(zip(images, names), 1):
-            self.status_label.config(text=f"Processing {index} of {total_images} {source_description}s")
-            self.root.update()
-
-            try:
-                if not custom_name:
-                    custom_name = f"image_{index}"
-                custom_name = re.sub(r'[<>:"/\\|?*]', '', custom_name)
-                if not custom_name:
-                    custom_name = f"image_{index}"
-
-                # Determine extension based on image format
-                ext = '.jpg' if image.format == 'JPEG' else '.png' if image.format == 'PNG' else '.jpg'
-                base_name = custom_name
-                output_filename = f"{base_name}_compressed{ext}"
-                output_path = os.path.join(self.output_folder, output_filename)
-
-                counter = 1
-                while output_filename.lower() in used_filenames or os.path.exists(output_path):
-                    output_filename = f"{base_name}_compressed_{counter}{ext}"
-                    output_path = os.path.join(self.output_folder, output_filename)
-                    counter += 1
-                used_filenames.add(output_filename.lower())
-
-                if self.debug:
-                    print(f"Saving {output_filename} to: {output_path}")
-
-                final_path, size, final_quality = self.compress_image(image, output_path)
-                if os.path.exists(final_path):
-                    status_message = f"Compressed {os.path.basename(final_path)} ({size} bytes) to {final_path}"
-                    if final_quality is not None and final_quality < 50:  # Only for JPEGs
-                        status_message += f"\nWarning: Low quality ({final_quality}) used, may appear degraded"
-                    self.status_label.config(text=status_message)
-                    if self.debug:
-                        print(f"Success: File saved to {final_path}" + (f" with quality {final_quality}" if final_quality is not None else ""))
+            self.events.put(("error", str(e)))
+        finally:
+            if downloader:
+                downloader.close()  # Drops downloads that have not started
+            self.events.put(("finished", None))
+
+    def poll_events(self):
+        finished = False
+        try:
+            while True:
+                kind, payload = self.events.get_nowait()
+                if kind == "item":
+                    self.report_item(payload)
+                elif kind == "error":
+                    self.log(f"Error: {payload}", "error")
                 else:
-                    self.status_label.config(text=f"Error: Failed to save {os.path.basename(final_path)} to {final_path}")
-                    if self.debug:
-                        print(f"Failure: File not found at {final_path}")
-                    continue
-
-            except (IOError, Exception) as e:
-                self.status_label.config(text=f"Error processing {source_description} {index}: {str(e)}")
-                if self.debug:
-                    print(f"Error: {str(e)}")
-                continue
-
-        self.status_label.config(text="Compression complete!")
+                    finished = True
+        except queue.Empty:
+            pass
+        if finished:
+            self.finish_batch()
+        else:
+            self.root.after(100, self.poll_events)
+
+    def report_item(self, item):
+        total, source_description, start, done, failed = self.batch
+        done += 1
+        if item.ok:
+            result = item.result
+            self.log(f"Compressed {os.path.basename(result.path)} ({result.size} bytes, {result.encodes} encodes) to {result.path}")
+            if result.quality is not None and result.quality < 50:  # Only for JPEGs
+                self.log(f"Warning: Low quality ({result.quality}) used for {os.path.basename(result.path)}, may appear degraded", "warning")
+            if self.debug:
+                print(f"Success: File saved to {result.path}" + (f" with quality {result.quality}" if result.quality is not None else ""))
+        else:
+            failed += 1
+            self.log(f"Error processing {source_description} {item.index}: {item.error}", "error")
+        self.batch[3:] = [done, failed]
+
+        elapsed = time.perf_counter() - start
+        rate = done / elapsed if elapsed > 0 else 0
+        eta = f", about {self.format_seconds((total - done) / rate)} left" if rate and done < total else ""
+        self.progress_bar.config(value=done)
+        self.progress_label.config(text=f"{done} of {total}, {rate:.1f} images/s{eta}")
+
+    def finish_batch(self):
+        total, source_description, start, done, failed = self.batch
+        self.worker.join()
+        self.worker = None
+        self.set_running(False)
+        elapsed = self.format_seconds(time.perf_counter() - start)
+        if self.cancel_event.is_set():
+            message = f"Cancelled after {done} of {total} {source_description}s ({elapsed})"
+        elif failed:
+            message = f"Compression complete with {failed} error(s), see the log ({elapsed})"
+        else:
+            message = f"Compression complete! ({elapsed})"
+        self.status_label.config(text=message)
+        self.log(message, "error" if failed else None)
+        if self.closing:
+            self.root.destroy()
+
+    def cancel_batch(self):
+        # Images being compressed finish (outputs are written atomically); nothing new is started
+        self.cancel_event.set()
+        self.cancel_button.config(state="disabled")
+        self.status_label.config(text="Cancelling: finishing the images in progress")
+
+    def close(self):
+        if self.worker is None:
+            self.root.destroy()
+            return
+        self.closing = True
+        self.cancel_batch()  # The window closes once the batch has stopped
+
+    def set_running(self, running):
+        state = "disabled" if running else "normal"
+        for button in (self.select_url_button, self.select_local_button, self.output_button):
+            button.config(state=state)
+        self.cancel_button.config(state="normal" if running else "disabled")
+
+    def log(self, message, tag=None):
+        self.log_text.config(state="normal")
+        self.log_text.insert(tk.END, message + "\n", tag or ())
+        self.log_text.see(tk.END)
+        self.log_text.config(state="disabled")
+
+    @staticmethod
+    def format_seconds(seconds):
+        minutes, seconds = divmod(int(seconds + 0.5), 60)
+        return f"{minutes}:{seconds:02d}"
 
     def select_files(self):
         url_window = tk.Toplevel(self.root)
@@ -435,100 +425,18 @@ class ImageCompressorApp:
         while len(names) < len(urls):
             names.append("")
 
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36',
-            'Accept': 'image/jpeg,image/png,image/webp,image/*,*/*;q=0.8'
-        }
-        fallback_headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Safari/605.1.15',
-            'Accept': 'image/*,*/*;q=0.8'
-        }
-
-        images = []
-        valid_names = []
-        total_urls = len(urls)
-
-        for index, (url, name) in enumerate(zip(urls, names), 1):
-            self.status_label.config(text=f"Downloading {index} of {total_urls} images: {url}")
-            self.root.update()
-
-            try:
-                try:
-                    response = requests.get(url, headers=headers, timeout=10)
-                    response.raise_for_status()
-                except requests.HTTPError as e:
-                    if response.status_code == 406:
-                        if self.debug:
-                            print(f"406 Error for {url}, retrying with fallback headers: {response.text[:100]}...")
-                        response = requests.get(url, headers=fallback_headers, timeout=10)
-                        response.raise_for_status()
-
-                content_type = response.headers.get('content-type', '')
-                if not content_type.startswith('image/'):
-                    self.status_label.config(text=f"Error: {url} is not an image")
-                    if self.debug:
-                        print(f"Invalid content-type: {content_type}")
-                    continue
-
-                image = Image.open(io.BytesIO(response.content))
-                if image.format not in ['JPEG', 'PNG', 'GIF', 'BMP']:
-                    image = image.convert('RGB')
-                images.append(image)
-                valid_names.append(name)
-
-            except requests.HTTPError as e:
-                self.status_label.config(text=f"Error: 406 Client Error for {url}. Server may block automated requests.")
-                if self.debug:
-                    print(f"HTTP Error: {str(e)}, Response: {response.text[:100]}...")
-                continue
-            except (requests.RequestException, IOError) as e:
-                self.status_label.config(text=f"Error downloading {url}: {str(e)}")
-                if self.debug:
-                    print(f"Error: {str(e)}")
-                continue
-
-        if images:
-            self.process_images(images, valid_names, source_description="image from URL")
-        else:
-            self.status_label.config(text="No valid images to process")
-
         url_window.destroy()
+        downloader = Downloader(debug=self.debug)
+        jobs = ((outcome, name) for (url, outcome), name in zip(downloader.iter_fetch(urls), names))
+        self.process_images(jobs, len(urls), source_description="image from URL", downloader=downloader)
 
     def compress_local_files(self, local_window, file_paths, name_text):
         names = [name.strip() for name in name_text.get("1.0", tk.END).splitlines() if name.strip()]
-        images = []
-        valid_names = []
-
         while len(names) < len(file_paths):
             names.append("")
 
-        for file_path, name in zip(file_paths, names):
-            try:
-                ext = os.path.splitext(file_path)[1].lower()
-                if ext not in ['.jpg', '.jpeg', '.png', '.gif', '.bmp']:
-                    self.status_label.config(text=f"Skipping {file_path}: Unsupported file format")
-                    if self.debug:
-                        print(f"Unsupported format: {file_path}")
-                    continue
-
-                image = Image.open(file_path)
-                if image.format not in ['JPEG', 'PNG', 'GIF', 'BMP']:
-                    image = image.convert('RGB')
-                images.append(image)
-                valid_names.append(name)
-
-            except (IOError, Exception) as e:
-                self.status_label.config(text=f"Error loading {file_path}: {str(e)}")
-                if self.debug:
-                    print(f"Error loading local file {file_path}: {str(e)}")
-                continue
-
-        if images:
-            self.process_images(images, valid_names, source_description="local image")
-        else:
-            self.status_label.config(text="No valid local images to process")
-
         local_window.destroy()
+        self.process_images(list(zip(file_paths, names)), len(file_paths), source_description="local image")
 
 if __name__ == "__main__":
     root = tk.Tk()